@@ -3,6 +3,9 @@ ASGI config for MedAi project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+Serve it with an ASGI server (e.g. ``uvicorn MedAi.asgi:application``) to get
+the non-blocking chat endpoint at ``chatbot/chat/async/``.
+
 For more information on this file, see
 https://docs.djangoproject.com/en/6.0/howto/deployment/asgi/
 """
@@ -1,5 +1,8 @@
 import os
 from celery import Celery
+from celery.signals import before_task_publish, task_prerun, task_postrun
+
+from .log import request_id
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'MedAi.settings')
 
@@ -7,6 +10,32 @@ app = Celery('MedAi')
 app.config_from_object('django.conf:settings', namespace='CELERY')
 app.autodiscover_tasks()
 
+
+@before_task_publish.connect
+def propagate_request_id(headers=None, **kwargs):
+    # Tasks queued while handling a request log under that request's ID
+    current = request_id.get()
+    if headers is not None and current != '-':
+        headers.setdefault('request_id', current)
+
+
+# task id -> ContextVar token, so the ID is unset again once the task ends
+_request_id_tokens = {}
+
+
+@task_prerun.connect
+def restore_request_id(task_id=None, task=None, **kwargs):
+    _request_id_tokens[task_id] = request_id.set(task.request.get('request_id') or task.request.id)
+
+
+@task_postrun.connect
+def clear_request_id(task_id=None, **kwargs):
+    # Otherwise the worker (or an eager caller) keeps logging under this ID
+    token = _request_id_tokens.pop(task_id, None)
+    if token is not None:
+        request_id.reset(token)
+
+
 @app.task(bind=True, ignore_result=True)
 def debug_task(self):
     print(f'Request: {self.request!r}')
\ No newline at end of file
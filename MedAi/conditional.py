@@ -0,0 +1,39 @@
+"""
+Conditional GET for polled list endpoints.
+
+An endpoint supplies a cheap validator (one aggregate query), and the ETag
+is a hash of it plus the user, the absolute URL (host, cursor, page size)
+and the negotiated format. When the client's If-None-Match matches, Django's
+condition() answers 304 before the view runs, so nothing is serialized.
+
+Only ETags are emitted: deleting rows or marking notifications read does
+not move any timestamp, so a Last-Modified validator could answer 304 for
+a body that did change.
+"""
+import hashlib
+
+from django.utils.decorators import method_decorator
+from django.views.decorators.http import condition
+
+
+def make_etag(request, *parts):
+    renderer = getattr(request, "accepted_renderer", None)
+    key = "|".join(str(part) for part in (
+        request.user.pk,
+        request.build_absolute_uri(),
+        renderer.format if renderer else "",
+        *parts,
+    ))
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()[:32]
+
+
+def conditional_get(validator):
+    """
+    Decorate an APIView.get; validator(request, *args, **kwargs) returns
+    values that change whenever the response body would, or None to skip.
+    """
+    def etag_func(request, *args, **kwargs):
+        parts = validator(request, *args, **kwargs)
+        return None if parts is None else make_etag(request, *parts)
+
+    return method_decorator(condition(etag_func=etag_func))
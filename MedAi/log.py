@@ -0,0 +1,192 @@
+"""
+Structured logging: JSON lines, request IDs, sampling, background writes.
+
+Wired up by settings.LOGGING:
+
+- RequestIDMiddleware tags every request with an ID (the caller's
+  X-Request-ID or a fresh one), echoes it in the response and keeps it in a
+  context variable. Celery tasks inherit the ID of the request that queued
+  them (see MedAi/celery.py).
+- RequestIDFilter copies that ID onto each log record.
+- get_logger() returns a SampledLogger that keeps only a share of
+  sub-WARNING events for the noisy subsystems in settings.LOG_SAMPLE_RATES;
+  warnings and errors always pass.
+- JSONFormatter writes one JSON object per line, including `extra=` fields.
+- BackgroundStreamHandler queues records and writes them from a thread, so
+  the request path never waits on stdout.
+"""
+import os
+import re
+import sys
+import json
+import uuid
+import queue
+import atexit
+import random
+import logging
+import logging.handlers
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+
+request_id = ContextVar("request_id", default="-")
+
+REQUEST_ID_HEADER = "X-Request-ID"
+_VALID_REQUEST_ID = re.compile(r"^[A-Za-z0-9._-]{1,64}$")
+
+# Attributes every LogRecord has; anything else came from extra=
+_RECORD_FIELDS = set(vars(logging.makeLogRecord({}))) | {"message", "asctime", "request_id"}
+
+
+class RequestIDMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def _start(self, request):
+        incoming = request.headers.get(REQUEST_ID_HEADER, "")
+        request.request_id = incoming if _VALID_REQUEST_ID.match(incoming) else uuid.uuid4().hex
+        return request_id.set(request.request_id)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        token = self._start(request)
+        try:
+            response = self.get_response(request)
+        finally:
+            request_id.reset(token)
+        response[REQUEST_ID_HEADER] = request.request_id
+        return response
+
+    async def __acall__(self, request):
+        token = self._start(request)
+        try:
+            response = await self.get_response(request)
+        finally:
+            request_id.reset(token)
+        response[REQUEST_ID_HEADER] = request.request_id
+        return response
+
+
+class RequestIDFilter(logging.Filter):
+
+    def filter(self, record):
+        record.request_id = request_id.get()
+        if record.request_id == "-":
+            # django.request logs 4xx/5xx after the middleware has returned
+            record.request_id = getattr(getattr(record, "request", None), "request_id", "-")
+        return True
+
+
+class SampledLogger(logging.LoggerAdapter):
+    """
+    Logger for high-volume events: keeps only a share of sub-WARNING
+    records, given by settings.LOG_SAMPLE_RATES for the logger (or its
+    nearest configured parent). The decision is made before a LogRecord is
+    built, so a dropped event costs about a microsecond.
+    """
+
+    def __init__(self, logger, rate=None):
+        super().__init__(logger, {})
+        self.rate = rate
+
+    def _rate(self):
+        if self.rate is not None:
+            return self.rate
+        from django.conf import settings
+
+        rates = getattr(settings, "LOG_SAMPLE_RATES", {})
+        name = self.logger.name
+        while name:
+            if name in rates:
+                return rates[name]
+            name = name.rpartition(".")[0]
+        return 1.0
+
+    def isEnabledFor(self, level):
+        if not self.logger.isEnabledFor(level):
+            return False
+        if level >= logging.WARNING:
+            return True
+        rate = self._rate()
+        return rate >= 1.0 or random.random() < rate
+
+    def process(self, msg, kwargs):
+        return msg, kwargs  # keep the caller's extra=
+
+
+def get_logger(name, rate=None):
+    """Per-subsystem logger with sampling (see SampledLogger)"""
+    return SampledLogger(logging.getLogger(name), rate)
+
+
+class JSONFormatter(logging.Formatter):
+
+    def format(self, record):
+        entry = {
+            "ts": self.formatTime(record, "%Y-%m-%dT%H:%M:%S") + f".{int(record.msecs):03d}",
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+            "request_id": getattr(record, "request_id", "-"),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_FIELDS:
+                entry[key] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class BackgroundStreamHandler(logging.handlers.QueueHandler):
+    """
+    Filters run in the caller (they need its request ID); formatting and
+    the write to `stream` happen on a listener thread.
+    """
+
+    def __init__(self, stream=None, maxsize=10_000):
+        self.maxsize = maxsize
+        super().__init__(queue.Queue(maxsize))
+        self.target = logging.StreamHandler(stream or sys.stdout)
+        self._start_listener()
+        # A forked worker (Celery prefork, gunicorn) inherits neither the
+        # thread nor a safe queue, so give it fresh ones
+        os.register_at_fork(after_in_child=self._start_listener)
+        atexit.register(self.close)
+
+    def _start_listener(self):
+        self.queue = queue.Queue(self.maxsize)
+        self.listener = logging.handlers.QueueListener(self.queue, self.target)
+        self.listener.start()
+
+    def setFormatter(self, fmt):
+        super().setFormatter(fmt)
+        self.target.setFormatter(fmt)
+
+    def prepare(self, record):
+        # Resolve args and tracebacks now; the record is read on another thread
+        record = logging.makeLogRecord(vars(record))
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            pass  # drop rather than block the request when the writer falls behind
+
+    def close(self):
+        if self.listener._thread is not None:
+            self.listener.stop()
+        super().close()
@@ -0,0 +1,314 @@
+"""
+Per-request stage timing and Prometheus-style metrics.
+
+- timed(view) wraps a view handler. The stages it marks with span() go
+  back to the client in a Server-Timing header and are observed into the
+  request_stage_seconds histogram (plus a "total" stage).
+- Histograms are buffered per process and flushed to the shared Django
+  cache every METRICS["flush_interval"] seconds by a background thread
+  (the TTS cache and the circuit breakers keep their counters there too),
+  so one scrape sees every worker without requests paying for the writes.
+  On Redis a flush is one pipelined round trip. A worker's last few
+  seconds may lag by that interval.
+- metrics_view renders the histograms and the gauges of registered
+  collectors in the Prometheus text format at /metrics.
+"""
+import os
+import time
+import hmac
+import atexit
+import bisect
+import threading
+from functools import wraps
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.core.cache import cache
+from django.http import Http404, HttpResponse
+
+from .log import get_logger
+
+logger = get_logger("medai.metrics")
+
+# Seconds; a chat spans sub-millisecond parsing to minute-long AI calls
+DEFAULT_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25,
+    0.5, 1.0, 2.5, 5.0, 10.0, 25.0, 60.0,
+)
+
+SERIES_KEY = "metrics:series"
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+_timing = ContextVar("timing", default=None)
+_lock = threading.Lock()
+_flusher = None
+
+REGISTRY = {}
+COLLECTORS = []
+
+
+class Histogram:
+
+    def __init__(self, name, help, labelnames, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        # labels -> per-bucket counts (last one is +Inf), then the sum in µs
+        self._pending = {}
+        REGISTRY[name] = self
+
+    def key(self, labels, index):
+        return f"metrics:{self.name}:{','.join(labels)}:{index}"
+
+    def observe(self, value, **labels):
+        labels = tuple(str(labels[name]) for name in self.labelnames)
+        index = bisect.bisect_left(self.buckets, value)
+        with _lock:
+            counts = self._pending.get(labels)
+            if counts is None:
+                counts = self._pending[labels] = [0] * (len(self.buckets) + 2)
+            counts[index] += 1
+            counts[-1] += round(value * 1_000_000)
+        if _flusher is None:
+            _start_flusher()
+
+
+REQUEST_STAGE_SECONDS = Histogram(
+    "request_stage_seconds",
+    "Time spent in each stage of a request",
+    ["view", "stage"],
+)
+
+
+def register_collector(collector):
+    """
+    collector() returns [(name, type, help, [(labels dict, value), ...]), ...]
+    and is called on every scrape.
+    """
+    COLLECTORS.append(collector)
+
+
+def _redis_client():
+    # django-redis exposes the raw client, which can pipeline the increments
+    client = getattr(cache, "client", None)
+    if client is None or not hasattr(client, "get_client"):
+        return None
+    return client.get_client(write=True)
+
+
+def _incr(key, delta):
+    try:
+        cache.incr(key, delta)
+    except ValueError:
+        if not cache.add(key, delta, timeout=None):
+            cache.incr(key, delta)
+
+
+def _incr_many(deltas):
+    client = _redis_client()
+    if client is None:
+        for key, delta in deltas.items():
+            _incr(key, delta)
+        return
+    # INCRBY creates missing keys, and django-redis stores integers as-is
+    pipeline = client.pipeline(transaction=False)
+    for key, delta in deltas.items():
+        pipeline.incrby(cache.make_key(key), delta)
+    pipeline.execute()
+
+
+def flush():
+    """Move this process's buffered observations into the shared cache"""
+    with _lock:
+        batches = [(histogram, histogram._pending) for histogram in REGISTRY.values() if histogram._pending]
+        for histogram, _ in batches:
+            histogram._pending = {}
+    if not batches:
+        return
+
+    try:
+        known = cache.get(SERIES_KEY) or set()
+        series = {(histogram.name, labels) for histogram, pending in batches for labels in pending}
+        if not series <= known:
+            # Racing writers can drop a series here; the next flush re-adds it
+            cache.set(SERIES_KEY, known | series, timeout=None)
+        _incr_many({
+            histogram.key(labels, index): delta
+            for histogram, pending in batches
+            for labels, counts in pending.items()
+            for index, delta in enumerate(counts)
+            if delta
+        })
+    except Exception:
+        # Metrics must never fail a request; this batch is lost
+        logger.warning("Metrics flush failed", exc_info=True)
+
+
+def _flush_loop():
+    while True:
+        time.sleep(settings.METRICS["flush_interval"])
+        flush()
+
+
+def _start_flusher():
+    global _flusher
+    with _lock:
+        if _flusher is None:
+            _flusher = threading.Thread(target=_flush_loop, name="metrics-flush", daemon=True)
+            _flusher.start()
+
+
+def _after_fork():
+    global _lock, _flusher
+    _lock = threading.Lock()
+    _flusher = None  # threads don't survive a fork; the child starts its own
+    for histogram in REGISTRY.values():
+        histogram._pending = {}  # the parent reports these itself
+
+
+os.register_at_fork(after_in_child=_after_fork)
+atexit.register(flush)
+
+
+class Timing:
+    """Stage durations of one request, in the order they ran"""
+
+    def __init__(self, view):
+        self.view = view
+        self.spans = []
+
+    def add(self, stage, seconds):
+        self.spans.append((stage, seconds))
+
+    def header(self):
+        return ", ".join(f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in self.spans)
+
+    def observe(self):
+        for stage, seconds in self.spans:
+            REQUEST_STAGE_SECONDS.observe(seconds, view=self.view, stage=stage)
+
+
+@contextmanager
+def span(stage):
+    """Time a stage of the current timed() request; no-op outside one"""
+    timing = _timing.get()
+    if timing is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timing.add(stage, time.perf_counter() - started)
+
+
+def _finish(timing, response, started):
+    timing.add("total", time.perf_counter() - started)
+    timing.observe()
+    if response is not None and settings.METRICS["server_timing"]:
+        response["Server-Timing"] = timing.header()
+
+
+def timed(view):
+    """
+    Decorate a (sync or async) view handler to collect its span()s.
+    Streamed responses are timed up to the point the stream starts.
+    """
+    def decorator(handler):
+        if iscoroutinefunction(handler):
+            @wraps(handler)
+            async def wrapper(*args, **kwargs):
+                timing = Timing(view)
+                token = _timing.set(timing)
+                started = time.perf_counter()
+                response = None
+                try:
+                    response = await handler(*args, **kwargs)
+                    return response
+                finally:
+                    _timing.reset(token)
+                    _finish(timing, response, started)
+        else:
+            @wraps(handler)
+            def wrapper(*args, **kwargs):
+                timing = Timing(view)
+                token = _timing.set(timing)
+                started = time.perf_counter()
+                response = None
+                try:
+                    response = handler(*args, **kwargs)
+                    return response
+                finally:
+                    _timing.reset(token)
+                    _finish(timing, response, started)
+        return wrapper
+    return decorator
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    escaped = (
+        (name, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for name, value in labels.items()
+    )
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+
+def _format_le(bound):
+    return repr(float(bound))
+
+
+def render():
+    """All metrics in the Prometheus text exposition format"""
+    flush()
+    series = sorted(cache.get(SERIES_KEY) or ())
+    keys = [
+        REGISTRY[name].key(labels, index)
+        for name, labels in series if name in REGISTRY
+        for index in range(len(REGISTRY[name].buckets) + 2)
+    ]
+    values = cache.get_many(keys)
+
+    lines = []
+    for histogram in REGISTRY.values():
+        lines.append(f"# HELP {histogram.name} {histogram.help}")
+        lines.append(f"# TYPE {histogram.name} histogram")
+        for name, labels in series:
+            if name != histogram.name:
+                continue
+            base = dict(zip(histogram.labelnames, labels))
+            cumulative = 0
+            for index, bound in enumerate(histogram.buckets + ("+Inf",)):
+                cumulative += values.get(histogram.key(labels, index), 0)
+                le = bound if bound == "+Inf" else _format_le(bound)
+                lines.append(f"{histogram.name}_bucket{_labels({**base, 'le': le})} {cumulative}")
+            total = values.get(histogram.key(labels, len(histogram.buckets) + 1), 0) / 1_000_000
+            lines.append(f"{histogram.name}_sum{_labels(base)} {total}")
+            lines.append(f"{histogram.name}_count{_labels(base)} {cumulative}")
+
+    for collector in COLLECTORS:
+        for name, kind, help, samples in collector():
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in samples:
+                lines.append(f"{name}{_labels(labels)} {value}")
+
+    return "\n".join(lines) + "\n"
+
+
+def metrics_view(request):
+    """
+    Prometheus scrape endpoint. Requires `Authorization: Bearer
+    <METRICS_TOKEN>`; without a configured token it is not served at all.
+    """
+    token = settings.METRICS["token"]
+    if not token:
+        raise Http404
+    supplied = request.headers.get("Authorization", "").removeprefix("Bearer ")
+    if not hmac.compare_digest(supplied.encode(), token.encode()):
+        return HttpResponse("Unauthorized\n", status=401, content_type=CONTENT_TYPE)
+    return HttpResponse(render(), content_type=CONTENT_TYPE)
@@ -0,0 +1,17 @@
+from django.middleware.gzip import GZipMiddleware as DjangoGZipMiddleware
+
+# Token streams are tiny per chunk and must reach the client immediately
+UNCOMPRESSED_STREAMS = ("text/event-stream", "application/x-ndjson")
+
+
+class GZipMiddleware(DjangoGZipMiddleware):
+    """
+    Django's gzip (with its BREACH length mitigation), minus live chat
+    streams. Bodies under 200 bytes and responses that already carry a
+    Content-Encoding (e.g. the gzip chat export) are left alone by Django.
+    """
+
+    def process_response(self, request, response):
+        if response.streaming and response.get("Content-Type", "").startswith(UNCOMPRESSED_STREAMS):
+            return response
+        return super().process_response(request, response)
@@ -43,8 +43,10 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'MedAi.log.RequestIDMiddleware',
     "corsheaders.middleware.CorsMiddleware",
     'django.middleware.security.SecurityMiddleware',
+    'MedAi.middleware.GZipMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -117,6 +119,10 @@ REST_FRAMEWORK = {
         'rest_framework_simplejwt.authentication.JWTAuthentication',
     ),
     'DEFAULT_SCHEMA_CLASS': 'drf_spectacular.openapi.AutoSchema',
+    # Reverse proxies in front of the app (e.g. 1 behind nginx). Throttles
+    # take the client IP from X-Forwarded-For only that many hops deep;
+    # with 0 they use REMOTE_ADDR, since clients can forge the header.
+    'NUM_PROXIES': config('NUM_PROXIES', default=0, cast=int),
 }
 
 SPECTACULAR_SETTINGS = {
@@ -153,6 +159,155 @@ DEFAULT_FROM_EMAIL = EMAIL_HOST_USER
 AI_CHATBOT_URL = config("AI_CHATBOT_URL")
 AI_TTS_URL = config("AI_TTS_URL")
 
+# Keep-alive connection pool per AI upstream host (see chatbot/client.py)
+AI_HTTP_POOL = {
+    "chatbot": {
+        "max_connections": config("AI_CHATBOT_MAX_CONNECTIONS", default=100, cast=int),
+        "max_keepalive_connections": config("AI_CHATBOT_MAX_KEEPALIVE", default=20, cast=int),
+        "keepalive_expiry": 30,
+        "timeout": 60,
+    },
+    "tts": {
+        "max_connections": config("AI_TTS_MAX_CONNECTIONS", default=50, cast=int),
+        "max_keepalive_connections": config("AI_TTS_MAX_KEEPALIVE", default=10, cast=int),
+        "keepalive_expiry": 30,
+        "timeout": 60,
+    },
+}
+
+# Circuit breaker + adaptive concurrency limit per AI upstream, shared by all
+# workers through the cache (chatbot/resilience.py). Latencies in seconds.
+AI_RESILIENCE = {
+    "chatbot": {
+        "failure_threshold": config("AI_CHATBOT_FAILURE_THRESHOLD", default=5, cast=int),
+        "failure_window": 30,
+        "reset_timeout": config("AI_CHATBOT_RESET_TIMEOUT", default=30, cast=int),
+        "initial_limit": 20,
+        "min_limit": 2,
+        "max_limit": AI_HTTP_POOL["chatbot"]["max_connections"],
+        "latency_target": config("AI_CHATBOT_LATENCY_TARGET", default=20, cast=float),
+    },
+    "tts": {
+        "failure_threshold": config("AI_TTS_FAILURE_THRESHOLD", default=5, cast=int),
+        "failure_window": 30,
+        "reset_timeout": config("AI_TTS_RESET_TIMEOUT", default=30, cast=int),
+        "initial_limit": 10,
+        "min_limit": 1,
+        "max_limit": AI_HTTP_POOL["tts"]["max_connections"],
+        "latency_target": config("AI_TTS_LATENCY_TARGET", default=10, cast=float),
+    },
+}
+
+# Size cap for the shared TTS audio cache (chatbot/tts_cache.py)
+TTS_CACHE_MAX_BYTES = config("TTS_CACHE_MAX_BYTES", default=500 * 1024 * 1024, cast=int)
+
+# Chat image uploads are downscaled and re-encoded (metadata stripped) before
+# they are stored and forwarded to the AI service (chatbot/images.py)
+CHAT_IMAGE = {
+    "enabled": config("CHAT_IMAGE_PREPROCESS", default=True, cast=bool),
+    "max_dimension": config("CHAT_IMAGE_MAX_DIMENSION", default=1600, cast=int),
+    "format": config("CHAT_IMAGE_FORMAT", default="WEBP"),  # WEBP or JPEG
+    "quality": config("CHAT_IMAGE_QUALITY", default=80, cast=int),
+    "workers": config("CHAT_IMAGE_WORKERS", default=4, cast=int),
+}
+
+# Voice uploads are transcoded, silence-trimmed and capped before they are
+# stored and forwarded (chatbot/audio.py). "processor" is a dotted path:
+# chatbot.audio.FFmpegAudioProcessor, WaveAudioProcessor (pure Python, WAV
+# only) or PassthroughAudioProcessor.
+CHAT_AUDIO = {
+    "processor": config("CHAT_AUDIO_PROCESSOR", default="chatbot.audio.FFmpegAudioProcessor"),
+    "ffmpeg": config("FFMPEG_BINARY", default="ffmpeg"),
+    "sample_rate": 16000,
+    "bitrate": config("CHAT_AUDIO_BITRATE", default="24k"),
+    "max_seconds": config("CHAT_AUDIO_MAX_SECONDS", default=120, cast=int),
+    "silence_threshold_db": -45,
+    "timeout": 30,
+    "workers": config("CHAT_AUDIO_WORKERS", default=4, cast=int),
+}
+
+# Recent turns sent with each chat request, cached per conversation
+# (chatbot/context.py). Tokens are estimated at ~4 characters each.
+CHAT_CONTEXT_WINDOW = {
+    "max_turns": config("CHAT_CONTEXT_MAX_TURNS", default=10, cast=int),
+    "max_tokens": config("CHAT_CONTEXT_MAX_TOKENS", default=2000, cast=int),
+    "timeout": 60 * 60 * 24,
+}
+
+# Idempotency-Key dedupe for chat submissions (chatbot/idempotency.py).
+# Duplicates wait up to wait_timeout for the original (longer than an AI call).
+CHAT_IDEMPOTENCY = {
+    "ttl": config("CHAT_IDEMPOTENCY_TTL", default=60 * 60 * 24, cast=int),
+    "wait_timeout": 75,
+    "lock_timeout": 180,
+}
+
+# Chat submission limits per message kind (chatbot/ratelimit.py): a token
+# bucket per user and per client IP ("<requests>/<period>"; the bucket holds
+# <requests> and refills at that rate) and a per-user daily quota (0 = none).
+CHAT_RATE_LIMIT = {
+    "enabled": config("CHAT_RATE_LIMIT", default=True, cast=bool),
+    "user": {
+        "text": config("CHAT_RATE_USER_TEXT", default="20/min"),
+        "voice": config("CHAT_RATE_USER_VOICE", default="6/min"),
+        "image": config("CHAT_RATE_USER_IMAGE", default="6/min"),
+    },
+    "ip": {
+        "text": config("CHAT_RATE_IP_TEXT", default="60/min"),
+        "voice": config("CHAT_RATE_IP_VOICE", default="20/min"),
+        "image": config("CHAT_RATE_IP_IMAGE", default="20/min"),
+    },
+    "daily_quota": {
+        "text": config("CHAT_QUOTA_TEXT", default=500, cast=int),
+        "voice": config("CHAT_QUOTA_VOICE", default=100, cast=int),
+        "image": config("CHAT_QUOTA_IMAGE", default=100, cast=int),
+    },
+}
+
+# Logging: JSON lines with request IDs, written off the request path
+# (MedAi/log.py). High-volume INFO events from the subsystems below are
+# sampled at LOG_SAMPLE_RATE; warnings and errors are always kept.
+LOG_LEVEL = config("LOG_LEVEL", default="INFO")
+LOG_SAMPLE_RATE = config("LOG_SAMPLE_RATE", default=0.1, cast=float)
+LOG_SAMPLE_RATES = {
+    "chatbot.ai": LOG_SAMPLE_RATE,
+    "prescriptions.push": LOG_SAMPLE_RATE,
+    "prescriptions.reminders": LOG_SAMPLE_RATE,
+}
+
+# Stage timings (Server-Timing header) and the Prometheus /metrics endpoint
+# (MedAi/metrics.py). Scrapers send "Authorization: Bearer <METRICS_TOKEN>";
+# with no token configured, /metrics is not served (404).
+METRICS = {
+    "token": config("METRICS_TOKEN", default=""),
+    "flush_interval": config("METRICS_FLUSH_INTERVAL", default=10, cast=float),
+    "server_timing": config("SERVER_TIMING", default=True, cast=bool),
+}
+
+LOGGING = {
+    "version": 1,
+    "disable_existing_loggers": False,
+    "filters": {
+        "request_id": {"()": "MedAi.log.RequestIDFilter"},
+    },
+    "formatters": {
+        "json": {"()": "MedAi.log.JSONFormatter"},
+    },
+    "handlers": {
+        "console": {
+            "class": "MedAi.log.BackgroundStreamHandler",
+            "formatter": "json",
+            "filters": ["request_id"],
+        },
+    },
+    "root": {"handlers": ["console"], "level": "WARNING"},
+    "loggers": {
+        "django": {"handlers": ["console"], "level": "INFO", "propagate": False},
+        "chatbot": {"level": config("LOG_LEVEL_CHATBOT", default=LOG_LEVEL)},
+        "prescriptions": {"level": config("LOG_LEVEL_PRESCRIPTIONS", default=LOG_LEVEL)},
+    },
+}
+
 # JWT Configuration
 SIMPLE_JWT = {
     'ACCESS_TOKEN_LIFETIME': timedelta(days=1),
@@ -181,6 +336,14 @@ if not firebase_admin._apps:
     except Exception as e:
         print(f"⚠️ Firebase Admin SDK initialization failed: {e}")
 
+# Push notifications (prescriptions/push.py): backend dotted path; messages
+# per backend call (FCM allows 500) and notifications collected per batch
+PUSH_NOTIFICATIONS = {
+    "backend": config("PUSH_BACKEND", default="prescriptions.push.FirebasePushBackend"),
+    "chunk_size": 500,
+    "batch_size": config("PUSH_BATCH_SIZE", default=2000, cast=int),
+}
+
 # = == == == == == == Celery Configuration ==  == == == == == =
 CELERY_BROKER_URL = 'redis://localhost:6379/0'
 CELERY_RESULT_BACKEND = 'redis://localhost:6379/0'
@@ -188,10 +351,20 @@ CELERY_ACCEPT_CONTENT = ['json']
 CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TIMEZONE = 'Asia/Dhaka'
+CELERY_WORKER_HIJACK_ROOT_LOGGER = False  # keep the JSON LOGGING setup in workers
 
 # Low stock threshold
 LOW_STOCK_THRESHOLD_DAYS = 3
 
+# Medicine reminders: a per-minute beat task finds the slots starting
+# `lead_minutes` from now and fans them out to workers `batch_size` at a time.
+# After downtime it catches up on missed minutes, at most `max_catchup_minutes`.
+MEDICINE_REMINDERS = {
+    "lead_minutes": config("REMINDER_LEAD_MINUTES", default=30, cast=int),
+    "batch_size": config("REMINDER_BATCH_SIZE", default=200, cast=int),
+    "max_catchup_minutes": config("REMINDER_MAX_CATCHUP_MINUTES", default=30, cast=int),
+}
+
 # Celery Beat Schedule (must be at the end)
 from celery.schedules import crontab
 
@@ -204,6 +377,10 @@ CELERY_BEAT_SCHEDULE = {
         'task': 'prescriptions.tasks.delete_old_notifications',
         'schedule': crontab(hour=0, minute=0),
     },
+    'dispatch-medicine-reminders': {
+        'task': 'prescriptions.tasks.dispatch_due_reminders',
+        'schedule': crontab(),
+    },
 }
 # Default primary key field type
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
@@ -5,6 +5,8 @@ from django.conf.urls.static import static
 from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
 from drf_spectacular.views import SpectacularAPIView, SpectacularRedocView, SpectacularSwaggerView
 
+from .metrics import metrics_view
+
 urlpatterns = [
     path("admin/", admin.site.urls),
     path("api-auth/", include("rest_framework.urls")),
@@ -16,6 +18,7 @@ urlpatterns = [
     path("treatments/", include("prescriptions.urls")),
     # Chatbot URLs
     path("chatbot/", include("chatbot.urls")),
+    path("metrics", metrics_view, name="metrics"),  # Prometheus scrape
 
     # Documentation URLs
     path('api/schema/', SpectacularAPIView.as_view(), name='schema'),
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Conversation, Message
+from .models import Conversation, ConversationSummary, Message, TTSAudio
 
 
 @admin.register(Conversation)
@@ -27,3 +27,24 @@ class MessageAdmin(admin.ModelAdmin):
         if obj.text_content:
             return obj.text_content[:50]
         return "-"
+
+
+
+@admin.register(ConversationSummary)
+class ConversationSummaryAdmin(admin.ModelAdmin):
+    list_display = (
+        "conversation",
+        "message_count",
+        "last_sender",
+        "has_unpaired_user_message",
+        "last_activity_at",
+    )
+    list_filter = ("last_sender", "has_unpaired_user_message")
+    ordering = ("-last_activity_at",)
+
+
+@admin.register(TTSAudio)
+class TTSAudioAdmin(admin.ModelAdmin):
+    list_display = ("key", "size", "hits", "last_used_at", "created_at")
+    readonly_fields = ("key", "audio_file", "size", "hits", "created_at", "last_used_at")
+    ordering = ("-last_used_at",)
@@ -3,3 +3,9 @@ from django.apps import AppConfig
 
 class ChatbotConfig(AppConfig):
     name = 'chatbot'
+
+    def ready(self):
+        from MedAi.metrics import register_collector
+        from . import metrics
+
+        register_collector(metrics.collect)
@@ -0,0 +1,197 @@
+"""
+Preprocessing for chat voice uploads.
+
+Before a recording is stored as Message.voice_file and forwarded to the AI
+service (STT), the configured processor transcodes it to a compact speech
+format at a fixed sample rate, trims leading/trailing silence and caps the
+duration. The processor is a dotted path in settings.CHAT_AUDIO so it can be
+swapped:
+
+- FFmpegAudioProcessor (default): mono Opus/Ogg via the ffmpeg binary.
+- WaveAudioProcessor: pure Python, PCM WAV only; for tests and hosts
+  without ffmpeg.
+- PassthroughAudioProcessor: leaves uploads untouched.
+
+A processor that cannot handle an upload returns it unchanged, so a failed
+transcode never loses the user's message. Work runs on a small thread pool,
+like image preprocessing.
+"""
+import io
+import sys
+import wave
+import tempfile
+import threading
+import subprocess
+from array import array
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.uploadedfile import InMemoryUploadedFile
+from django.utils.module_loading import import_string
+
+from MedAi.log import get_logger
+
+logger = get_logger("chatbot.audio")
+
+_lock = threading.Lock()
+_executor = None
+
+
+class AudioProcessor:
+    """Base class: process(upload) returns the file to store and forward"""
+
+    def __init__(self, config):
+        self.config = config
+
+    def process(self, upload):
+        raise NotImplementedError
+
+    def _output(self, upload, data, extension, content_type):
+        return InMemoryUploadedFile(
+            io.BytesIO(data),
+            field_name="audio",
+            name=Path(upload.name).stem + extension,
+            content_type=content_type,
+            size=len(data),
+            charset=None,
+        )
+
+
+class PassthroughAudioProcessor(AudioProcessor):
+
+    def process(self, upload):
+        return upload
+
+
+class FFmpegAudioProcessor(AudioProcessor):
+    """Transcode to mono Opus in an Ogg container with the ffmpeg binary"""
+
+    def _trim_filter(self):
+        # silenceremove only trims the start, so trim, reverse, trim, reverse
+        trim = f"silenceremove=start_periods=1:start_threshold={self.config['silence_threshold_db']}dB"
+        return f"{trim},areverse,{trim},areverse"
+
+    def _command(self, source):
+        config = self.config
+        return [
+            config["ffmpeg"], "-hide_banner", "-loglevel", "error", "-nostdin",
+            "-t", str(config["max_seconds"]),  # stop decoding past the cap
+            "-i", source,
+            "-vn", "-ac", "1", "-ar", str(config["sample_rate"]),
+            "-af", self._trim_filter(),
+            "-c:a", "libopus", "-b:a", config["bitrate"], "-application", "voip",
+            "-map_metadata", "-1",
+            "-f", "ogg", "pipe:1",
+        ]
+
+    def _run(self, source):
+        result = subprocess.run(
+            self._command(source),
+            capture_output=True,
+            timeout=self.config["timeout"],
+        )
+        if result.returncode != 0 or not result.stdout:
+            raise RuntimeError(result.stderr.decode("utf-8", "replace").strip() or "empty output")
+        return result.stdout
+
+    def process(self, upload):
+        try:
+            # Containers like m4a need a seekable input, so ffmpeg reads a file path
+            if hasattr(upload, "temporary_file_path"):
+                data = self._run(upload.temporary_file_path())
+            else:
+                with tempfile.NamedTemporaryFile(suffix=Path(upload.name).suffix) as tmp:
+                    for chunk in upload.chunks():
+                        tmp.write(chunk)
+                    tmp.flush()
+                    data = self._run(tmp.name)
+        except (OSError, RuntimeError, subprocess.TimeoutExpired) as e:
+            logger.warning("Audio transcode skipped", extra={"upload": upload.name, "error": str(e)})
+            upload.seek(0)
+            return upload
+        return self._output(upload, data, ".ogg", "audio/ogg")
+
+
+class WaveAudioProcessor(AudioProcessor):
+    """
+    Pure-Python processor for 16-bit PCM WAV: downmix to mono, resample
+    (nearest sample) to the configured rate, trim silence and cap the
+    duration. Other formats pass through untouched.
+    """
+
+    def process(self, upload):
+        config = self.config
+        upload.seek(0)
+        try:
+            with wave.open(upload, "rb") as source:
+                channels = source.getnchannels()
+                rate = source.getframerate()
+                if source.getsampwidth() != 2:
+                    upload.seek(0)
+                    return upload
+                frames = source.readframes(min(source.getnframes(), rate * config["max_seconds"]))
+        except (wave.Error, EOFError):
+            upload.seek(0)
+            return upload
+
+        samples = array("h")
+        samples.frombytes(frames)
+        if sys.byteorder == "big":
+            samples.byteswap()
+
+        if channels > 1:
+            samples = array("h", (
+                sum(samples[i:i + channels]) // channels
+                for i in range(0, len(samples), channels)
+            ))
+
+        target_rate = config["sample_rate"]
+        if rate != target_rate:
+            step = rate / target_rate
+            samples = array("h", (samples[int(i * step)] for i in range(int(len(samples) / step))))
+
+        threshold = int(32767 * 10 ** (config["silence_threshold_db"] / 20))
+        start = next((i for i, sample in enumerate(samples) if abs(sample) > threshold), None)
+        if start is None:
+            samples = array("h")
+        else:
+            end = next(i for i in range(len(samples) - 1, -1, -1) if abs(samples[i]) > threshold)
+            samples = samples[start:end + 1]
+
+        if sys.byteorder == "big":
+            samples.byteswap()
+        buffer = io.BytesIO()
+        with wave.open(buffer, "wb") as output:
+            output.setnchannels(1)
+            output.setsampwidth(2)
+            output.setframerate(target_rate)
+            output.writeframes(samples.tobytes())
+        return self._output(upload, buffer.getvalue(), ".wav", "audio/wav")
+
+
+def get_processor():
+    config = settings.CHAT_AUDIO
+    return import_string(config["processor"])(config)
+
+
+def _pool():
+    global _executor
+    if _executor is None:
+        with _lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=settings.CHAT_AUDIO["workers"],
+                    thread_name_prefix="chat-audio",
+                )
+    return _executor
+
+
+def submit(validated_data):
+    """
+    Start preprocessing validated_data["audio"] on the pool.
+    Returns a concurrent Future, or None when there is no recording.
+    """
+    if not validated_data.get("audio"):
+        return None
+    return _pool().submit(get_processor().process, validated_data["audio"])
@@ -0,0 +1,76 @@
+"""
+Shared HTTP clients for the AI upstream services.
+
+Each upstream ("chatbot", "tts") gets its own keep-alive connection pool so
+chat and TTS calls reuse sockets instead of opening a new connection per
+request. Pool sizes come from settings.AI_HTTP_POOL.
+"""
+import asyncio
+import threading
+import weakref
+
+import httpx
+from django.conf import settings
+
+_lock = threading.Lock()
+_sync_clients = {}
+# Async clients are bound to the event loop that created them
+_async_clients = weakref.WeakKeyDictionary()
+
+
+def upstream_url(upstream):
+    """Return the configured URL for an upstream service"""
+    if upstream == "tts":
+        return settings.AI_TTS_URL
+    return settings.AI_CHATBOT_URL
+
+
+def _client_options(upstream):
+    pool = settings.AI_HTTP_POOL.get(upstream, {})
+    return {
+        "limits": httpx.Limits(
+            max_connections=pool.get("max_connections", 100),
+            max_keepalive_connections=pool.get("max_keepalive_connections", 20),
+            keepalive_expiry=pool.get("keepalive_expiry", 30),
+        ),
+        "timeout": httpx.Timeout(
+            pool.get("timeout", 60),
+            connect=pool.get("connect_timeout", 5),
+        ),
+    }
+
+
+def get_client(upstream="chatbot"):
+    """
+    Process-wide sync client for an upstream (thread safe)
+    """
+    client = _sync_clients.get(upstream)
+    if client is None:
+        with _lock:
+            client = _sync_clients.get(upstream)
+            if client is None:
+                client = httpx.Client(**_client_options(upstream))
+                _sync_clients[upstream] = client
+    return client
+
+
+def get_async_client(upstream="chatbot"):
+    """
+    Async client for an upstream, shared by everything on the running loop
+    """
+    loop = asyncio.get_running_loop()
+    clients = _async_clients.get(loop)
+    if clients is None:
+        clients = _async_clients[loop] = {}
+    client = clients.get(upstream)
+    if client is None:
+        client = clients[upstream] = httpx.AsyncClient(**_client_options(upstream))
+    return client
+
+
+def close_clients():
+    """Close the sync pools (used by management commands and benchmarks)"""
+    with _lock:
+        for client in _sync_clients.values():
+            client.close()
+        _sync_clients.clear()
@@ -0,0 +1,103 @@
+"""
+Rolling context window per conversation, kept in the shared cache (Redis).
+
+The last `max_turns` user/AI turns, trimmed to a rough `max_tokens` budget,
+are sent to the AI service with every chat request so it does not have to
+reload the conversation from its own database. The window is updated as
+messages are saved and rebuilt from the DB on a cache miss. If the cache is
+unreachable, reads fall back to the DB and updates are dropped (logged),
+so a cache outage never fails a chat.
+"""
+from django.conf import settings
+from django.core.cache import cache
+
+from MedAi.log import get_logger
+
+from .models import Message
+
+logger = get_logger("chatbot.context")
+
+ROLES = {
+    Message.SenderType.USER: "user",
+    Message.SenderType.AI: "assistant",
+}
+
+PLACEHOLDERS = {
+    Message.MessageType.VOICE: "[voice message]",
+    Message.MessageType.IMAGE: "[image]",
+}
+
+
+def _settings():
+    return settings.CHAT_CONTEXT_WINDOW
+
+
+def _key(conversation_id):
+    return f"chat:ctx:{conversation_id}"
+
+
+def estimate_tokens(text):
+    # ~4 characters per token is close enough for budgeting
+    return max(1, len(text) // 4)
+
+
+def _entry(message):
+    return {
+        "id": message.id,
+        "role": ROLES.get(message.sender, message.sender),
+        "content": message.text_content or PLACEHOLDERS.get(message.message_type, ""),
+    }
+
+
+def _trim(entries):
+    config = _settings()
+    entries = entries[-config["max_turns"] * 2:]
+    budget = config["max_tokens"]
+    total = sum(estimate_tokens(e["content"]) for e in entries)
+    while entries and total > budget:
+        total -= estimate_tokens(entries.pop(0)["content"])
+    return entries
+
+
+def _load(conversation_id):
+    limit = _settings()["max_turns"] * 2
+    messages = Message.objects.filter(
+        conversation_id=conversation_id
+    ).order_by("-created_at", "-id")[:limit]
+    return _trim([_entry(m) for m in reversed(messages)])
+
+
+def get_window(conversation_id):
+    """Context entries ({"role", "content"}) for the saved turns, oldest first"""
+    try:
+        entries = cache.get(_key(conversation_id))
+        if entries is None:
+            entries = _load(conversation_id)
+            cache.set(_key(conversation_id), entries, timeout=_settings()["timeout"])
+    except Exception:
+        logger.warning("Context cache unavailable; loading from the DB", exc_info=True)
+        entries = _load(conversation_id)
+    return [{"role": e["role"], "content": e["content"]} for e in entries]
+
+
+def append(message):
+    """Add a saved message to its cached window (no-op if not cached)"""
+    key = _key(message.conversation_id)
+    try:
+        entries = cache.get(key)
+        if entries is None:
+            return  # rebuilt from the DB on next read
+        if any(e["id"] == message.id for e in entries):
+            return
+        entries.append(_entry(message))
+        cache.set(key, _trim(entries), timeout=_settings()["timeout"])
+    except Exception:
+        logger.warning("Context cache update failed; dropping the window", exc_info=True)
+        invalidate([message.conversation_id])
+
+
+def invalidate(conversation_ids):
+    try:
+        cache.delete_many([_key(cid) for cid in conversation_ids])
+    except Exception:
+        logger.warning("Context cache invalidation failed", exc_info=True)
@@ -0,0 +1,77 @@
+"""
+Streaming chat export as NDJSON (optionally gzip-compressed).
+
+Rows are read with a chunked iterator in (conversation, created_at) index
+order and encoded line by line, so memory stays flat however many messages
+are exported. Used by ChatExportAPIView and the export_chats command.
+"""
+import zlib
+
+from django.core.serializers.json import DjangoJSONEncoder
+
+from .models import Message
+
+EXPORT_FIELDS = (
+    "id",
+    "conversation_id",
+    "conversation__user_id",
+    "sender",
+    "message_type",
+    "text_content",
+    "voice_file",
+    "voice_status",
+    "image_file",
+    "is_truncated",
+    "created_at",
+)
+
+# Flush roughly this many bytes per yielded chunk
+BUFFER_SIZE = 64 * 1024
+
+
+def export_queryset(user_ids):
+    return Message.objects.filter(
+        conversation__user_id__in=user_ids
+    ).order_by("conversation_id", "created_at")
+
+
+def iter_rows(queryset, media_url="", chunk_size=2000):
+    """Yield one dict per message; file fields become media_url + path"""
+    for values in queryset.values_list(*EXPORT_FIELDS).iterator(chunk_size=chunk_size):
+        row = dict(zip(EXPORT_FIELDS, values))
+        row["user_id"] = row.pop("conversation__user_id")
+        for field in ("voice_file", "image_file"):
+            row[field] = media_url + row[field] if row[field] else None
+        yield row
+
+
+def iter_ndjson(rows):
+    """Encode rows as NDJSON, batched into ~64 KB byte chunks"""
+    encoder = DjangoJSONEncoder(ensure_ascii=False)
+    buffer = []
+    size = 0
+    for row in rows:
+        line = (encoder.encode(row) + "\n").encode("utf-8")
+        buffer.append(line)
+        size += len(line)
+        if size >= BUFFER_SIZE:
+            yield b"".join(buffer)
+            buffer = []
+            size = 0
+    if buffer:
+        yield b"".join(buffer)
+
+
+def iter_gzip(chunks, level=6):
+    """Incrementally gzip a byte stream"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)  # 31 = gzip container
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def iter_export(user_ids, media_url="", compress=False):
+    chunks = iter_ndjson(iter_rows(export_queryset(user_ids), media_url))
+    return iter_gzip(chunks) if compress else chunks
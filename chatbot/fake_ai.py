@@ -0,0 +1,168 @@
+"""
+Local stand-in for the AI chatbot and TTS services.
+
+Used by the chat benchmarks so they run offline. POST /tts returns fake MP3
+bytes, any other POST returns an assistant_message JSON reply, streamed
+as SSE token events when the caller sends `Accept: text/event-stream`.
+The server tracks how many requests are in flight and how many body bytes
+arrived so callers can measure concurrency and upload forwarding.
+
+Knobs: `latency` plus up to `jitter` seconds of random extra delay,
+`reply_chars` / `tts_bytes` for payload sizes, and `error_rate` to fail
+that share of requests with `error_status`. Set `status` (e.g. 503) to
+fail every request, or `drop_after` to cut streamed replies off after
+that many tokens. Random draws come from `seed`, so a run can be
+repeated.
+"""
+import json
+import time
+import random
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+REPLY_TEXT = "This is a reply from the fake AI service."
+
+
+class FakeAIHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        server = self.server
+        # Drain the body in chunks so large uploads don't sit in memory
+        remaining = int(self.headers.get("Content-Length") or 0)
+        while remaining > 0:
+            chunk = self.rfile.read(min(remaining, 64 * 1024))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            server.received(len(chunk))
+
+        server.enter()
+        try:
+            delay, status = server.draw()
+            time.sleep(delay)
+            if status != 200:
+                self._send(b'{"error": "fake upstream failure"}', "application/json", status)
+            elif self.path.rstrip("/").endswith("tts"):
+                self._send(b"\xff\xfb" + b"\x00" * server.tts_bytes, "audio/mpeg")
+            elif "text/event-stream" in self.headers.get("Accept", ""):
+                self._stream_reply()
+            else:
+                self._send(json.dumps(self._reply()).encode(), "application/json")
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # caller hung up mid-reply
+        finally:
+            server.leave()
+
+    def _reply(self):
+        text = self.server.reply_text
+        return {
+            "assistant_message": text,
+            "data": None,
+            "tts": {
+                "enabled": self.server.tts,
+                "payload": {"text": text, "voice": "default"},
+            },
+        }
+
+    def _write_chunk(self, data):
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+        self.wfile.flush()
+
+    def _stream_reply(self):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for index, token in enumerate(self.server.reply_text.split(" ")):
+            if index == self.server.drop_after:
+                self.close_connection = True  # no final chunk: the caller sees a broken stream
+                return
+            time.sleep(self.server.token_delay)
+            event = json.dumps({"delta": token + " "})
+            self._write_chunk(f"data: {event}\n\n".encode())
+        self._write_chunk(f"data: {json.dumps(self._reply())}\n\n".encode())
+        self._write_chunk(b"data: [DONE]\n\n")
+        self.wfile.write(b"0\r\n\r\n")
+
+    def _send(self, body, content_type, status=200):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class FakeAIServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def __init__(self, address=("127.0.0.1", 0), latency=0.5, token_delay=0.02, tts=False, status=200,
+                 jitter=0.0, reply_chars=None, tts_bytes=2048, error_rate=0.0, error_status=503, seed=None, drop_after=None):
+        super().__init__(address, FakeAIHandler)
+        self.tts = tts
+        self.status = status
+        self.latency = latency
+        self.jitter = jitter
+        self.token_delay = token_delay
+        self.tts_bytes = tts_bytes
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.drop_after = drop_after
+        self.reply_text = REPLY_TEXT
+        if reply_chars:
+            repeats = reply_chars // (len(REPLY_TEXT) + 1) + 1
+            self.reply_text = " ".join([REPLY_TEXT] * repeats)[:reply_chars]
+        self.random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.total_requests = 0
+        self.bytes_received = 0
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def draw(self):
+        """Delay and status for the next request"""
+        with self._lock:
+            delay = self.latency + self.jitter * self.random.random()
+            failed = self.error_rate and self.random.random() < self.error_rate
+        if self.status != 200:
+            return delay, self.status
+        return delay, self.error_status if failed else 200
+
+    def enter(self):
+        with self._lock:
+            self.in_flight += 1
+            self.total_requests += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+
+    def received(self, size):
+        with self._lock:
+            self.bytes_received += size
+
+    def leave(self):
+        with self._lock:
+            self.in_flight -= 1
+
+    def reset_stats(self):
+        with self._lock:
+            self.peak_in_flight = self.in_flight
+            self.total_requests = 0
+            self.bytes_received = 0
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
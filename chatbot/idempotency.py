@@ -0,0 +1,178 @@
+"""
+Idempotency-Key handling for chat submissions.
+
+Mobile clients retry on timeout. A retry that carries the same
+`Idempotency-Key` header as the original request must not save another
+user message or call the AI again:
+
+- the first request claims the key (atomic cache add) and runs normally;
+- duplicates that arrive while it is in flight wait for it, up to
+  `wait_timeout` seconds, then get 409;
+- once it finishes, duplicates get the stored response (with an
+  `Idempotent-Replayed: true` header) until the key expires after `ttl`.
+
+Keys are scoped per user. Reusing a key with a different request body is
+rejected with 422. 5xx responses are not stored, so the client's next retry
+runs again. Streamed replies are not deduplicated.
+"""
+import time
+import asyncio
+import hashlib
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.uploadedfile import UploadedFile
+from rest_framework.response import Response
+
+HEADER = "Idempotency-Key"
+MAX_KEY_LENGTH = 255
+
+PENDING = "pending"
+DONE = "done"
+
+
+def fingerprint(data):
+    """Hash of the submitted fields; uploads count by name and size"""
+    digest = hashlib.sha256()
+    for name in sorted(data.keys()):
+        value = data.get(name)
+        if isinstance(value, UploadedFile):
+            value = f"{value.name}:{value.size}"
+        digest.update(f"{name}={value}\n".encode("utf-8"))
+    return digest.hexdigest()
+
+
+class IdempotentRequest:
+
+    def __init__(self, user_id, key, data):
+        digest = hashlib.sha256(key.encode("utf-8")).hexdigest()
+        self.cache_key = f"chat:idem:{user_id}:{digest}"
+        self.fingerprint = fingerprint(data)
+        self.config = settings.CHAT_IDEMPOTENCY
+
+    def _poll(self):
+        """
+        One claim attempt. Returns (None, None) when this request owns the
+        key, (response, None) when it should answer right away, or
+        (None, delay) to wait and try again.
+        """
+        pending = {"state": PENDING, "fingerprint": self.fingerprint}
+        if cache.add(self.cache_key, pending, timeout=self.config["lock_timeout"]):
+            return None, None
+
+        record = cache.get(self.cache_key)
+        if record is None:
+            return None, 0  # released or expired in between; claim again
+        if record["fingerprint"] != self.fingerprint:
+            return Response(
+                {"error": f"{HEADER} was already used for a different request"},
+                status=422,
+            ), None
+        if record["state"] == DONE:
+            return Response(
+                record["data"],
+                status=record["status"],
+                headers={"Idempotent-Replayed": "true"},
+            ), None
+        return None, 0.1
+
+    def _timed_out(self):
+        return Response(
+            {"error": f"A request with this {HEADER} is still in progress"},
+            status=409,
+        )
+
+    def claim(self):
+        """None if the caller should handle the request, else a Response"""
+        deadline = time.monotonic() + self.config["wait_timeout"]
+        while True:
+            response, delay = self._poll()
+            if delay is None:
+                return response
+            if time.monotonic() >= deadline:
+                return self._timed_out()
+            time.sleep(delay)
+
+    async def aclaim(self):
+        deadline = time.monotonic() + self.config["wait_timeout"]
+        while True:
+            response, delay = await sync_to_async(self._poll)()
+            if delay is None:
+                return response
+            if time.monotonic() >= deadline:
+                return self._timed_out()
+            await asyncio.sleep(delay)
+
+    def finish(self, response):
+        if response.status_code >= 500:
+            self.release()
+            return
+        cache.set(self.cache_key, {
+            "state": DONE,
+            "fingerprint": self.fingerprint,
+            "status": response.status_code,
+            "data": response.data,
+        }, timeout=self.config["ttl"])
+
+    def release(self):
+        cache.delete(self.cache_key)
+
+
+def _invalid_key(key):
+    if len(key) > MAX_KEY_LENGTH:
+        return Response(
+            {"error": f"{HEADER} must be at most {MAX_KEY_LENGTH} characters"},
+            status=400,
+        )
+    return None
+
+
+def _applies(request, data):
+    return HEADER in request.headers and not data.get("stream")
+
+
+def run(request, handler):
+    """Run handler() at most once per Idempotency-Key"""
+    if not _applies(request, request.data):
+        return handler()
+    key = request.headers[HEADER]
+    invalid = _invalid_key(key)
+    if invalid:
+        return invalid
+
+    entry = IdempotentRequest(request.user.id, key, request.data)
+    response = entry.claim()
+    if response is not None:
+        return response
+    try:
+        response = handler()
+    except BaseException:
+        entry.release()
+        raise
+    entry.finish(response)
+    return response
+
+
+async def arun(request, handler):
+    """Async run(); handler is a coroutine function"""
+    # Parsing the body may read an upload; keep it off the event loop
+    data = await sync_to_async(lambda: request.data)()
+    if not _applies(request, data):
+        return await handler()
+    key = request.headers[HEADER]
+    invalid = _invalid_key(key)
+    if invalid:
+        return invalid
+
+    entry = IdempotentRequest(request.user.id, key, data)
+    response = await entry.aclaim()
+    if response is not None:
+        return response
+    try:
+        response = await handler()
+    except BaseException:
+        await sync_to_async(entry.release)()
+        raise
+    await sync_to_async(entry.finish)(response)
+    return response
@@ -0,0 +1,107 @@
+"""
+Preprocessing for chat image uploads.
+
+Phone photos arrive as multi-megabyte JPEG/HEIC-sized files. Before the
+upload is stored under chat/images/ and forwarded to the AI service it is
+downscaled to settings.CHAT_IMAGE["max_dimension"], re-encoded (WebP or
+JPEG at the configured quality) and saved without EXIF/XMP metadata, after
+applying the EXIF orientation.
+
+The work runs on a small bounded thread pool (Pillow releases the GIL while
+decoding, resizing and encoding), so it overlaps with the rest of request
+setup and concurrent uploads cannot oversubscribe the CPU.
+
+An upload Pillow cannot decode (truncated, corrupt, a decompression bomb)
+is forwarded unchanged, like a failed audio transcode, rather than failing
+the request.
+"""
+import io
+import threading
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.uploadedfile import InMemoryUploadedFile
+from PIL import Image, ImageOps
+
+from MedAi.log import get_logger
+
+logger = get_logger("chatbot.images")
+
+CONTENT_TYPES = {
+    "WEBP": "image/webp",
+    "JPEG": "image/jpeg",
+}
+
+EXTENSIONS = {
+    "WEBP": ".webp",
+    "JPEG": ".jpg",
+}
+
+_lock = threading.Lock()
+_executor = None
+
+
+def _pool():
+    global _executor
+    if _executor is None:
+        with _lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=settings.CHAT_IMAGE["workers"],
+                    thread_name_prefix="chat-image",
+                )
+    return _executor
+
+
+def preprocess(upload):
+    """Return a downscaled, re-encoded, metadata-free copy of an image upload"""
+    try:
+        return _reencode(upload)
+    except (OSError, ValueError, Image.DecompressionBombError) as e:
+        logger.warning("Image preprocessing skipped", extra={"upload": upload.name, "error": str(e)})
+        upload.seek(0)
+        return upload
+
+
+def _reencode(upload):
+    config = settings.CHAT_IMAGE
+    fmt = config["format"].upper()
+    max_dimension = config["max_dimension"]
+
+    upload.seek(0)
+    with Image.open(upload) as original:
+        # JPEG can decode straight at a reduced scale, which is much cheaper
+        original.draft("RGB", (max_dimension, max_dimension))
+        image = ImageOps.exif_transpose(original)
+        image.thumbnail((max_dimension, max_dimension), Image.Resampling.LANCZOS)
+
+        if fmt == "JPEG" and image.mode != "RGB":
+            image = image.convert("RGB")
+        elif fmt == "WEBP" and image.mode not in ("RGB", "RGBA"):
+            image = image.convert("RGBA" if "A" in image.getbands() else "RGB")
+
+        buffer = io.BytesIO()
+        # No exif= / xmp= arguments, so no metadata is written
+        image.save(buffer, fmt, quality=config["quality"], optimize=True)
+
+    size = buffer.tell()
+    buffer.seek(0)
+    return InMemoryUploadedFile(
+        buffer,
+        field_name="file",
+        name=Path(upload.name).stem + EXTENSIONS[fmt],
+        content_type=CONTENT_TYPES[fmt],
+        size=size,
+        charset=None,
+    )
+
+
+def submit(validated_data):
+    """
+    Start preprocessing validated_data["file"] on the pool.
+    Returns a concurrent Future, or None when there is nothing to do.
+    """
+    if not settings.CHAT_IMAGE["enabled"] or not validated_data.get("file"):
+        return None
+    return _pool().submit(preprocess, validated_data["file"])
@@ -0,0 +1,99 @@
+import time
+import statistics
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.test.utils import override_settings
+
+from chatbot import resilience
+from chatbot.client import close_clients
+from chatbot.fake_ai import FakeAIServer
+from chatbot.services import AIServiceError, call_ai
+
+
+class Command(BaseCommand):
+    help = (
+        "Drive the guarded chatbot call through healthy, failing, slow and "
+        "recovered phases of a local fake AI service, and report how the "
+        "circuit breaker and adaptive concurrency limit react."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--calls", type=int, default=200, help="Chat calls per phase")
+        parser.add_argument("--rate", type=float, default=100, help="Calls started per second")
+        parser.add_argument("--latency", type=float, default=0.1, help="Healthy model latency in seconds")
+        parser.add_argument(
+            "--shared-cache", action="store_true",
+            help="Use the configured cache (Redis) instead of a local in-memory one",
+        )
+
+    def handle(self, *args, **options):
+        server = FakeAIServer(latency=options["latency"]).start()
+        overrides = {
+            "AI_CHATBOT_URL": server.url,
+            "AI_RESILIENCE": {
+                "chatbot": {
+                    "failure_threshold": 5,
+                    "failure_window": 10,
+                    "reset_timeout": 2,
+                    "initial_limit": 8,
+                    "min_limit": 2,
+                    "max_limit": 64,
+                    "latency_target": options["latency"] * 5,
+                },
+            },
+        }
+        if not options["shared_cache"]:
+            overrides["CACHES"] = {
+                "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}
+            }
+
+        try:
+            with override_settings(**overrides):
+                resilience.UpstreamGuard("chatbot").reset()
+                self._phase("healthy", server, options)
+                server.status = 503
+                self._phase("failing (503)", server, options)
+                server.status = 200
+                server.latency = options["latency"] * 10
+                time.sleep(2)  # let the breaker move to half-open
+                self._phase("slow (10x latency)", server, options)
+                server.latency = options["latency"]
+                self._phase("recovered", server, options)
+                self._phase("recovered (steady)", server, options)
+        finally:
+            close_clients()
+            server.stop()
+
+    def _phase(self, label, server, options):
+        payload = {"user_id": 1, "conversation_id": 1, "reply_mode": "text", "text": "hello"}
+        outcomes = {}
+        timings = []
+
+        def one_call(_):
+            started = time.perf_counter()
+            try:
+                call_ai(payload, {}, {})
+                outcome = "ok"
+            except AIServiceError as e:
+                outcome = e.payload.get("reason") or f"http {e.status}"
+            timings.append(time.perf_counter() - started)
+            outcomes[outcome] = outcomes.get(outcome, 0) + 1
+
+        server.reset_stats()
+        started = time.perf_counter()
+        # Open-loop arrivals: a slow upstream does not slow the callers down
+        with ThreadPoolExecutor(max_workers=256) as pool:
+            for i in range(options["calls"]):
+                pool.submit(one_call, i)
+                time.sleep(1 / options["rate"])
+        elapsed = time.perf_counter() - started
+
+        stats = resilience.UpstreamGuard("chatbot").stats()
+        timings.sort()
+        self.stdout.write(
+            f"{label:20} wall={elapsed:5.2f}s  p50={statistics.median(timings) * 1000:7.1f}ms  "
+            f"upstream calls={server.total_requests:4d} peak={server.peak_in_flight:3d}  "
+            f"state={stats['state']:9} limit={stats['limit']:6.2f}  "
+            + "  ".join(f"{k}={v}" for k, v in sorted(outcomes.items()))
+        )
@@ -0,0 +1,60 @@
+import time
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+import requests
+from django.core.management.base import BaseCommand
+
+from chatbot.client import _client_options
+from chatbot.fake_ai import FakeAIServer
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare how many chats can be in flight at once on the sync path "
+        "(blocking requests.post per WSGI worker) and the async path "
+        "(pooled httpx.AsyncClient), against a local fake AI service."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chats", type=int, default=200, help="Total chat requests per path")
+        parser.add_argument("--workers", type=int, default=8, help="Sync WSGI workers to emulate")
+        parser.add_argument("--latency", type=float, default=1.0, help="Fake model latency in seconds")
+
+    def handle(self, *args, **options):
+        server = FakeAIServer(latency=options["latency"]).start()
+        payload = {"user_id": 1, "conversation_id": 1, "reply_mode": "text", "text": "hello"}
+
+        try:
+            self._report("sync (requests, %d workers)" % options["workers"], server,
+                         lambda: self._run_sync(server.url, payload, options))
+            self._report("async (pooled httpx)", server,
+                         lambda: asyncio.run(self._run_async(server.url, payload, options)))
+        finally:
+            server.stop()
+
+    def _report(self, label, server, run):
+        server.reset_stats()
+        started = time.perf_counter()
+        run()
+        elapsed = time.perf_counter() - started
+        self.stdout.write(
+            f"{label:32} peak in-flight={server.peak_in_flight:4d}  "
+            f"chats={server.total_requests}  wall={elapsed:.2f}s  "
+            f"throughput={server.total_requests / elapsed:.1f} chats/s"
+        )
+
+    def _run_sync(self, url, payload, options):
+        # Today's path: every chat holds a worker for the full round trip
+        def one_chat(_):
+            requests.post(url, json=payload, timeout=60)
+
+        with ThreadPoolExecutor(max_workers=options["workers"]) as pool:
+            list(pool.map(one_chat, range(options["chats"])))
+
+    async def _run_async(self, url, payload, options):
+        async with httpx.AsyncClient(**_client_options("chatbot")) as client:
+            await asyncio.gather(*[
+                client.post(url, json=payload) for _ in range(options["chats"])
+            ])
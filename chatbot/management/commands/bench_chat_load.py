@@ -0,0 +1,306 @@
+import os
+import shutil
+import json
+import time
+import logging
+import random
+import tempfile
+import statistics
+import threading
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand, CommandError
+from django.core.servers.basehttp import ThreadedWSGIServer
+from django.db import connections
+from django.test.testcases import QuietWSGIRequestHandler
+from django.test.utils import override_settings, setup_databases, teardown_databases
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from MedAi.celery import app as celery_app
+from chatbot.client import close_clients
+from chatbot.fake_ai import FakeAIServer
+from chatbot.services import get_conversation, new_ai_message, prepare_user_message, save_turn
+
+User = get_user_model()
+
+OPERATIONS = ("chat", "history", "detail")
+PERCENTILES = (50, 90, 95, 99)
+
+
+def parse_mix(value):
+    """'chat=5,history=3,detail=2' -> {"chat": 5, "history": 3, "detail": 2}"""
+    mix = {}
+    for part in value.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in OPERATIONS:
+            raise CommandError(f"Unknown operation {name!r} in --mix (use {', '.join(OPERATIONS)})")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def summarize(samples, wall):
+    """Throughput, error count and latency percentiles (ms) for one operation"""
+    latencies = sorted(elapsed for _, elapsed in samples)
+    statuses = Counter(status for status, _ in samples)
+    summary = {
+        "requests": len(samples),
+        "errors": sum(count for status, count in statuses.items() if not 200 <= status < 300),
+        "statuses": {str(status): count for status, count in sorted(statuses.items())},
+        "throughput": round(len(samples) / wall, 2),
+        "max_ms": round(latencies[-1] * 1000, 1) if latencies else None,
+    }
+    if len(latencies) >= 2:
+        cuts = statistics.quantiles(latencies, n=100, method="inclusive")
+        for p in PERCENTILES:
+            summary[f"p{p}_ms"] = round(cuts[p - 1] * 1000, 1)
+    else:
+        for p in PERCENTILES:
+            summary[f"p{p}_ms"] = summary["max_ms"]
+    return summary
+
+
+class Command(BaseCommand):
+    help = (
+        "Load-test the chat endpoints end to end: a threaded WSGI server on a "
+        "throwaway test database, a local fake AI/TTS service, and many "
+        "concurrent users mixing chat, history and conversation detail "
+        "requests. Reports throughput and latency percentiles per endpoint. "
+        "Runs offline; the same --seed replays the same workload."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=20, help="Concurrent virtual users")
+        parser.add_argument("--iterations", type=int, default=25, help="Requests per user")
+        parser.add_argument("--mix", type=parse_mix, default="chat=5,history=3,detail=2",
+                            help="Relative weights of chat, history and detail requests")
+        parser.add_argument("--think", type=float, default=0.0, help="Pause between a user's requests (s)")
+        parser.add_argument("--async-chat", action="store_true", help="Send chats to chat/async/")
+        parser.add_argument("--latency", type=float, default=0.2, help="Fake AI base latency (s)")
+        parser.add_argument("--jitter", type=float, default=0.1, help="Extra random fake AI latency, up to (s)")
+        parser.add_argument("--reply-chars", type=int, default=400, help="Fake assistant_message length")
+        parser.add_argument("--tts", action="store_true",
+                            help="Ask for voice replies; TTS tasks run eagerly in-process")
+        parser.add_argument("--tts-bytes", type=int, default=16 * 1024, help="Fake TTS audio size")
+        parser.add_argument("--error-rate", type=float, default=0.0, help="Share of fake AI requests that fail")
+        parser.add_argument("--seed-conversations", type=int, default=3, help="Conversations per user before the run")
+        parser.add_argument("--seed-turns", type=int, default=5, help="Turns per seeded conversation")
+        parser.add_argument("--seed", type=int, default=1)
+        parser.add_argument("--rate-limit", action="store_true",
+                            help="Keep CHAT_RATE_LIMIT on (all users share one IP, so expect 429s)")
+        parser.add_argument(
+            "--shared-cache", action="store_true",
+            help="Use the configured cache (Redis) instead of a local in-memory one",
+        )
+        parser.add_argument("--save", help="Write the results as JSON to this path")
+        parser.add_argument("--baseline", help="Compare against results saved earlier with --save")
+        parser.add_argument("--max-regression", type=float, default=0.2,
+                            help="Fail when a p95 is this much slower than the baseline (0.2 = 20%%)")
+
+    def handle(self, *args, **options):
+        mix = options["mix"]
+        fake = FakeAIServer(
+            latency=options["latency"],
+            jitter=options["jitter"],
+            reply_chars=options["reply_chars"],
+            tts=options["tts"],
+            tts_bytes=options["tts_bytes"],
+            error_rate=options["error_rate"],
+            seed=options["seed"],
+        ).start()
+
+        # Server threads need their own connections to one database, so an
+        # SQLite test database goes to a file rather than shared memory, with
+        # writers queueing (IMMEDIATE + busy timeout) instead of failing fast.
+        # Point DB_ENGINE at PostgreSQL for numbers that reflect production.
+        database = connections["default"].settings_dict
+        if database["ENGINE"].endswith("sqlite3"):
+            fd, database["TEST"]["NAME"] = tempfile.mkstemp(prefix="bench_chat_load_", suffix=".sqlite3")
+            os.close(fd)
+            database["OPTIONS"].update({
+                "timeout": 60,
+                "transaction_mode": "IMMEDIATE",
+                "init_command": "PRAGMA journal_mode=WAL;",
+            })
+        old_config = setup_databases(verbosity=0, interactive=False, aliases={"default"})
+
+        media_root = tempfile.mkdtemp(prefix="bench_chat_load_media_")
+        overrides = {
+            "AI_CHATBOT_URL": fake.url + "/chat",
+            "AI_TTS_URL": fake.url + "/tts",
+            "MEDIA_ROOT": media_root,  # uploads and TTS audio
+        }
+        if not options["rate_limit"]:
+            overrides["CHAT_RATE_LIMIT"] = {**settings.CHAT_RATE_LIMIT, "enabled": False}
+        if not options["shared_cache"]:
+            overrides["CACHES"] = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+        always_eager = celery_app.conf.task_always_eager
+        celery_app.conf.task_always_eager = True
+        if options["verbosity"] < 2:
+            logging.disable(logging.ERROR)  # failures show up in the statuses column
+        server = None
+        try:
+            with override_settings(**overrides):
+                tokens = self._seed(options)
+                connections.close_all()  # the server threads open their own
+                server = ThreadedWSGIServer(("127.0.0.1", 0), QuietWSGIRequestHandler, allow_reuse_address=False)
+                server.set_app(WSGIHandler())
+                threading.Thread(target=server.serve_forever, daemon=True).start()
+                base_url = "http://127.0.0.1:%d" % server.server_address[1]
+
+                fake.reset_stats()
+                results, wall = self._run(base_url, tokens, mix, options)
+        finally:
+            logging.disable(logging.NOTSET)
+            celery_app.conf.task_always_eager = always_eager
+            if server is not None:
+                server.shutdown()
+                server.server_close()
+            close_clients()
+            fake.stop()
+            connections.close_all()
+            teardown_databases(old_config, verbosity=0)
+            shutil.rmtree(media_root, ignore_errors=True)
+
+        report = {
+            "config": {
+                key: options[key] for key in (
+                    "users", "iterations", "think", "async_chat", "latency", "jitter",
+                    "reply_chars", "tts", "tts_bytes", "error_rate", "seed",
+                )
+            },
+            "mix": mix,
+            "wall_s": round(wall, 2),
+            "fake_ai": {"requests": fake.total_requests, "peak_in_flight": fake.peak_in_flight},
+            "operations": {name: summarize(samples, wall) for name, samples in sorted(results.items())},
+        }
+        self._print(report)
+
+        if options["save"]:
+            with open(options["save"], "w") as f:
+                json.dump(report, f, indent=2)
+        if options["baseline"]:
+            self._compare(report, options["baseline"], options["max_regression"])
+
+    def _seed(self, options):
+        """Create the users (and some history for them); return their JWTs"""
+        tokens = []
+        for i in range(options["users"]):
+            user = User.objects.create(email=f"load-{i}@example.com", full_name=f"Load {i}", is_active=True)
+            for _ in range(options["seed_conversations"]):
+                conversation = get_conversation(user, None)
+                for turn in range(options["seed_turns"]):
+                    user_message = prepare_user_message(conversation, {"text": f"Seeded question {turn}"})
+                    save_turn(conversation, user_message, new_ai_message(conversation, f"Seeded answer {turn}"))
+            tokens.append(str(RefreshToken.for_user(user).access_token))
+        return tokens
+
+    def _run(self, base_url, tokens, mix, options):
+        results = defaultdict(list)
+        lock = threading.Lock()
+        start = threading.Barrier(len(tokens) + 1)
+        chat_path = "/chatbot/chat/async/" if options["async_chat"] else "/chatbot/chat/"
+        names, weights = zip(*mix.items())
+
+        def virtual_user(index):
+            rng = random.Random(options["seed"] * 100_003 + index)
+            conversations = []
+            with httpx.Client(
+                base_url=base_url,
+                headers={"Authorization": f"Bearer {tokens[index]}"},
+                timeout=120,
+            ) as client:
+                start.wait()
+                for step in range(options["iterations"]):
+                    operation = rng.choices(names, weights)[0]
+                    if operation == "detail" and not conversations:
+                        operation = "history"
+                    started = time.perf_counter()
+                    try:
+                        if operation == "chat":
+                            body = {"text": f"Question {step} from user {index}"}
+                            if conversations and rng.random() < 0.7:
+                                body["conversation_id"] = rng.choice(conversations)
+                            response = client.post(chat_path, json=body)
+                        elif operation == "history":
+                            response = client.get("/chatbot/history/")
+                        else:
+                            response = client.get(f"/chatbot/history/{rng.choice(conversations)}/")
+                        status = response.status_code
+                    except httpx.HTTPError:
+                        status, response = 0, None
+                    elapsed = time.perf_counter() - started
+
+                    if status == 200 and operation == "chat":
+                        conversation_id = response.json().get("conversation_id")
+                        if conversation_id not in conversations:
+                            conversations.append(conversation_id)
+                    elif status == 200 and operation == "history" and not conversations:
+                        conversations.extend(item["id"] for item in response.json().get("results", []))
+                    with lock:
+                        results[operation].append((status, elapsed))
+                    if options["think"]:
+                        time.sleep(options["think"])
+
+        with ThreadPoolExecutor(max_workers=len(tokens)) as pool:
+            futures = [pool.submit(virtual_user, i) for i in range(len(tokens))]
+            start.wait()
+            started = time.perf_counter()
+            for future in futures:
+                future.result()
+            wall = time.perf_counter() - started
+        return results, wall
+
+    def _print(self, report):
+        config = report["config"]
+        self.stdout.write(
+            f"{config['users']} users x {config['iterations']} requests, "
+            f"fake AI {config['latency']}s +{config['jitter']}s jitter, "
+            f"error rate {config['error_rate']:g}, seed {config['seed']}"
+        )
+        self.stdout.write(
+            f"{'operation':10} {'requests':>8} {'errors':>6} {'req/s':>8} "
+            + " ".join(f"{f'p{p} ms':>8}" for p in PERCENTILES) + f" {'max ms':>8}"
+        )
+        for name, summary in report["operations"].items():
+            self.stdout.write(
+                f"{name:10} {summary['requests']:8d} {summary['errors']:6d} {summary['throughput']:8.1f} "
+                + " ".join(f"{summary[f'p{p}_ms']:8.1f}" for p in PERCENTILES)
+                + f" {summary['max_ms']:8.1f}"
+            )
+            if summary["errors"]:
+                self.stdout.write(f"{'':10} statuses: {summary['statuses']}")
+        total = sum(summary["requests"] for summary in report["operations"].values())
+        self.stdout.write(
+            f"total {total} requests in {report['wall_s']}s = {total / report['wall_s']:.1f} req/s; "
+            f"fake AI saw {report['fake_ai']['requests']} requests, "
+            f"peak {report['fake_ai']['peak_in_flight']} in flight"
+        )
+
+    def _compare(self, report, path, max_regression):
+        with open(path) as f:
+            baseline = json.load(f)
+        if baseline.get("config") != report["config"] or baseline.get("mix") != report["mix"]:
+            self.stderr.write("Warning: baseline was recorded with different settings")
+
+        regressions = []
+        self.stdout.write(f"vs baseline {path}:")
+        for name, summary in report["operations"].items():
+            before = baseline.get("operations", {}).get(name)
+            if not before or not before.get("p95_ms"):
+                continue
+            p95_change = summary["p95_ms"] / before["p95_ms"] - 1
+            throughput_change = summary["throughput"] / before["throughput"] - 1 if before["throughput"] else 0
+            self.stdout.write(
+                f"  {name:10} p95 {before['p95_ms']:.1f} -> {summary['p95_ms']:.1f} ms ({p95_change:+.0%})  "
+                f"throughput {before['throughput']:.1f} -> {summary['throughput']:.1f} req/s ({throughput_change:+.0%})"
+            )
+            if p95_change > max_regression:
+                regressions.append(name)
+        if regressions:
+            raise CommandError(f"p95 regressed by more than {max_regression:.0%}: {', '.join(regressions)}")
@@ -0,0 +1,94 @@
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import (
+    CaptureQueriesContext,
+    override_settings,
+    setup_databases,
+    teardown_databases,
+)
+
+from chatbot.fake_ai import REPLY_TEXT
+from chatbot.models import ConversationSummary, Message
+from chatbot.services import get_conversation, new_ai_message, prepare_user_message, save_turn
+
+User = get_user_model()
+
+TRANSACTION_CONTROL = ("BEGIN", "SAVEPOINT", "RELEASE SAVEPOINT", "ROLLBACK", "COMMIT")
+
+
+def legacy_turn(conversation, validated_data, ai_text):
+    """
+    The previous write path: the user message and the AI reply were each
+    saved in their own transaction, and Conversation.updated_at was not bumped.
+    """
+    with transaction.atomic():
+        user_message = Message.objects.create(
+            conversation=conversation,
+            sender=Message.SenderType.USER,
+            message_type=Message.MessageType.TEXT,
+            text_content=validated_data["text"],
+        )
+        ConversationSummary.record(user_message)
+    with transaction.atomic():
+        ai_message = Message.objects.create(
+            conversation=conversation,
+            sender=Message.SenderType.AI,
+            message_type=Message.MessageType.TEXT,
+            text_content=ai_text,
+        )
+        ConversationSummary.record(ai_message)
+    return ai_message
+
+
+def current_turn(conversation, validated_data, ai_text):
+    user_message = prepare_user_message(conversation, validated_data)
+    return save_turn(conversation, user_message, new_ai_message(conversation, ai_text))
+
+
+class Command(BaseCommand):
+    help = (
+        "Count the SQL statements one chat turn writes, before (per-message "
+        "transactions) and after (single-transaction save_turn), in a "
+        "throwaway test database. The AI call itself is not made."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--turns", type=int, default=200)
+
+    def handle(self, *args, **options):
+        old_config = setup_databases(verbosity=0, interactive=False)
+        # The context window cache is not under test; keep it in memory
+        local_cache = override_settings(CACHES={
+            "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}
+        })
+        local_cache.enable()
+        try:
+            user = User.objects.create(email="bench-writes@example.com", full_name="Bench")
+            for label, turn in (("before", legacy_turn), ("after", current_turn)):
+                self._run(f"{label}, existing conversation", user, turn, options["turns"], new=False)
+                self._run(f"{label}, new conversation", user, turn, options["turns"], new=True)
+        finally:
+            local_cache.disable()
+            teardown_databases(old_config, verbosity=0)
+
+    def _run(self, label, user, turn, turns, new):
+        conversation = get_conversation(user, None)
+        validated_data = {"text": "I have a headache and a mild fever since morning"}
+        with CaptureQueriesContext(connection) as ctx:
+            started = time.perf_counter()
+            for _ in range(turns):
+                if new:
+                    conversation = get_conversation(user, None)
+                turn(conversation, validated_data, REPLY_TEXT)
+            elapsed = time.perf_counter() - started
+
+        statements = [q["sql"] for q in ctx.captured_queries]
+        writes = [sql for sql in statements if not sql.upper().startswith(TRANSACTION_CONTROL)]
+        self.stdout.write(
+            f"{label:32} statements/turn={len(writes) / turns:5.2f}  "
+            f"incl. transaction control={len(statements) / turns:5.2f}  "
+            f"{elapsed / turns * 1000:6.2f} ms/turn"
+        )
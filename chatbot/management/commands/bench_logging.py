@@ -0,0 +1,86 @@
+import os
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+
+from MedAi.log import (
+    BackgroundStreamHandler,
+    JSONFormatter,
+    RequestIDFilter,
+    get_logger,
+    request_id,
+)
+
+AI_BODY = '{"assistant_message": "' + "x" * 480 + '"}'
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure what one hot-path log event costs the calling thread: the "
+        "old print() calls versus the structured logger (unsampled, sampled "
+        "and below level). Output goes to /dev/null."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--events", type=int, default=50_000, help="Events per thread")
+        parser.add_argument("--threads", type=int, default=8, help="Concurrent request threads")
+        parser.add_argument("--sample-rate", type=float, default=0.1)
+
+    def handle(self, *args, **options):
+        with open(os.devnull, "w") as devnull:
+            self._run("print() x2 (before)", options, self._print_event(devnull))
+            self._run("logger, every event", options, self._log_event(devnull, rate=1.0))
+            self._run(f"logger, sampled {options['sample_rate']:g}", options,
+                      self._log_event(devnull, rate=options["sample_rate"]))
+            self._run("logger, level disabled", options,
+                      self._log_event(devnull, rate=1.0, level=logging.WARNING))
+
+    def _print_event(self, devnull):
+        def event(i):
+            # What call_ai used to do on every reply (stdout is unbuffered in containers)
+            print(f"AI Response Status: {200}", file=devnull, flush=True)
+            print(f"AI Response Body: {AI_BODY[:500]}", file=devnull, flush=True)
+        return event
+
+    def _log_event(self, devnull, rate, level=logging.INFO):
+        logger = logging.getLogger(f"bench.logging.{rate}.{level}")
+        logger.handlers.clear()
+        logger.propagate = False
+        logger.setLevel(level)
+        handler = BackgroundStreamHandler(stream=devnull)
+        handler.setFormatter(JSONFormatter())
+        handler.addFilter(RequestIDFilter())
+        logger.addHandler(handler)
+        sampled = get_logger(logger.name, rate=rate)
+
+        def event(i):
+            sampled.info("AI chatbot response", extra={"status": 200, "bytes": len(AI_BODY), "elapsed_ms": 812})
+
+        event.handler = handler
+        return event
+
+    def _run(self, label, options, event):
+        def worker(n):
+            request_id.set(f"bench-{n}")
+            started = time.perf_counter()
+            for i in range(options["events"]):
+                event(i)
+            return time.perf_counter() - started
+
+        with ThreadPoolExecutor(max_workers=options["threads"]) as pool:
+            started = time.perf_counter()
+            busy = list(pool.map(worker, range(options["threads"])))
+            elapsed = time.perf_counter() - started
+
+        handler = getattr(event, "handler", None)
+        if handler is not None:
+            handler.close()  # drain the writer thread
+
+        total = options["events"] * options["threads"]
+        per_call = sum(busy) / total * 1e6
+        self.stdout.write(
+            f"{label:26} {per_call:7.2f} us/event in caller  "
+            f"{total / elapsed:10.0f} events/s  ({options['threads']} threads)"
+        )
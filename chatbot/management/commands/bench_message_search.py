@@ -0,0 +1,116 @@
+import random
+import time
+from itertools import accumulate
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import setup_databases, teardown_databases
+
+from chatbot.models import Conversation, Message
+from chatbot.search import search_messages, search_scan
+
+User = get_user_model()
+
+COMMON_WORDS = (
+    "fever headache cough pain stomach tablet capsule dose morning night "
+    "blood pressure sugar insulin allergy rash doctor appointment medicine "
+    "reminder stock refill prescription dizziness nausea vomiting sleep"
+).split()
+
+SYLLABLES = "ka lo mi ne su ra te vi do pa ze fo gu ri sha mo".split()
+
+
+def build_vocabulary(rng, size=20_000):
+    """Common medical words followed by synthetic rarer ones"""
+    words = list(COMMON_WORDS)
+    while len(words) < size:
+        words.append("".join(rng.choices(SYLLABLES, k=rng.randint(2, 4))))
+    return words
+
+
+class Command(BaseCommand):
+    help = (
+        "Build a synthetic message corpus in a throwaway test database and "
+        "compare indexed full-text search with the icontains scan."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--messages", type=int, default=1_000_000)
+        parser.add_argument("--users", type=int, default=100)
+        parser.add_argument("--queries", type=int, default=20)
+        parser.add_argument("--seed", type=int, default=42)
+
+    def handle(self, *args, **options):
+        old_config = setup_databases(verbosity=0, interactive=False)
+        try:
+            rng = random.Random(options["seed"])
+            vocabulary = build_vocabulary(rng)
+            # Zipf-like word frequencies, as in natural text
+            cum_weights = list(accumulate(1 / rank for rank in range(1, len(vocabulary) + 1)))
+            user = self._build_corpus(rng, options, vocabulary, cum_weights)
+
+            for label, low, high in (("frequent", 0, 50), ("rare", 50, 5000)):
+                terms = [vocabulary[rng.randint(low, high)] for _ in range(options["queries"])]
+                self._check(user, terms)
+                self._time(f"indexed, {label}", lambda term: search_messages(user, term), terms)
+                self._time(f"icontains, {label}", lambda term: search_scan(user, term, 50), terms)
+        finally:
+            teardown_databases(old_config, verbosity=0)
+
+    def _build_corpus(self, rng, options, vocabulary, cum_weights):
+        started = time.perf_counter()
+        users = User.objects.bulk_create([
+            User(email=f"bench{i}@example.com", full_name=f"Bench {i}")
+            for i in range(options["users"])
+        ])
+        conversations = Conversation.objects.bulk_create([
+            Conversation(user=users[i % len(users)])
+            for i in range(max(1, options["messages"] // 50))
+        ])
+
+        batch = []
+        for i in range(options["messages"]):
+            batch.append(Message(
+                conversation=conversations[i % len(conversations)],
+                sender=Message.SenderType.USER if i % 2 == 0 else Message.SenderType.AI,
+                text_content=" ".join(rng.choices(vocabulary, cum_weights=cum_weights, k=rng.randint(5, 25))),
+            ))
+            if len(batch) == 10_000:
+                Message.objects.bulk_create(batch)
+                batch = []
+        Message.objects.bulk_create(batch)
+
+        self.stdout.write(
+            f"corpus: {options['messages']} messages, {len(users)} users "
+            f"(built in {time.perf_counter() - started:.1f}s)"
+        )
+        return users[0]
+
+    def _check(self, user, terms):
+        """
+        Fail unless indexed search finds exactly the messages containing each
+        term as a word, so a stale or empty index can't pass as fast
+        """
+        for term in terms:
+            indexed = {message.id for message in search_messages(user, term, limit=10**9)}
+            scanned = {
+                message.id for message in search_scan(user, term, None)
+                if term in message.text_content.split()
+            }
+            if indexed != scanned:
+                raise CommandError(
+                    f"indexed search for {term!r} found {len(indexed)} messages, "
+                    f"the scan {len(scanned)}"
+                )
+
+    def _time(self, label, search, terms):
+        timings = []
+        for term in terms:
+            started = time.perf_counter()
+            search(term)
+            timings.append((time.perf_counter() - started) * 1000)
+        timings.sort()
+        self.stdout.write(
+            f"{label:20} p50={timings[len(timings) // 2]:8.2f} ms  "
+            f"max={timings[-1]:8.2f} ms  ({len(terms)} queries)"
+        )
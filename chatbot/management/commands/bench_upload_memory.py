@@ -0,0 +1,54 @@
+import os
+import tempfile
+import tracemalloc
+
+import requests
+from django.core.management.base import BaseCommand
+
+from chatbot.client import get_client, close_clients
+from chatbot.fake_ai import FakeAIServer
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure peak Python memory while forwarding one audio upload to a "
+        "local fake AI service: read() + requests multipart (old path) vs "
+        "streaming the stored file through the pooled httpx client."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--size-mb", type=int, default=20, help="Upload size in MB")
+
+    def handle(self, *args, **options):
+        server = FakeAIServer(latency=0).start()
+        data = {"user_id": 1, "conversation_id": 1, "reply_mode": "text"}
+
+        with tempfile.NamedTemporaryFile(suffix=".m4a", delete=False) as tmp:
+            for _ in range(options["size_mb"]):
+                tmp.write(os.urandom(1024 * 1024))
+        try:
+            def read_into_memory():
+                with open(tmp.name, "rb") as f:
+                    files = {"audio": ("voice.m4a", f.read(), "audio/m4a")}
+                    requests.post(server.url, data=data, files=files, timeout=60)
+
+            def stream_from_file():
+                with open(tmp.name, "rb") as f:
+                    files = {"audio": ("voice.m4a", f, "audio/m4a")}
+                    get_client("chatbot").post(server.url, data=data, files=files)
+
+            self.stdout.write(f"upload size: {options['size_mb']} MB")
+            self._measure("read() + requests", read_into_memory)
+            self._measure("streamed (httpx)", stream_from_file)
+        finally:
+            os.unlink(tmp.name)
+            close_clients()
+            server.stop()
+
+    def _measure(self, label, run):
+        run()  # warm up the connection pool and imports
+        tracemalloc.start()
+        run()
+        _current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        self.stdout.write(f"{label:20} peak memory = {peak / (1024 * 1024):8.2f} MB")
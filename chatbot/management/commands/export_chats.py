@@ -0,0 +1,50 @@
+import sys
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from chatbot.export import iter_export
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = (
+        "Export chat messages of many users as one NDJSON stream for offline "
+        "analytics. Each line carries user_id and conversation_id."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--user", action="append", default=[], help="User id or email (repeatable)")
+        parser.add_argument("--all", action="store_true", help="Export every user with a conversation")
+        parser.add_argument("--output", default="-", help="Output file path, '-' for stdout")
+        parser.add_argument("--gzip", action="store_true", help="Gzip-compress the output")
+        parser.add_argument("--media-url", default="", help="Prefix for voice/image file paths")
+
+    def handle(self, *args, **options):
+        if options["all"]:
+            user_ids = User.objects.filter(conversations__isnull=False).distinct().values("id")
+        elif options["user"]:
+            user_ids = [self._resolve(value) for value in options["user"]]
+        else:
+            raise CommandError("Pass --user (repeatable) or --all")
+
+        out = sys.stdout.buffer if options["output"] == "-" else open(options["output"], "wb")
+        written = 0
+        try:
+            for chunk in iter_export(user_ids, media_url=options["media_url"], compress=options["gzip"]):
+                out.write(chunk)
+                written += len(chunk)
+        finally:
+            if out is not sys.stdout.buffer:
+                out.close()
+
+        if options["output"] != "-":
+            self.stderr.write(f"Wrote {written} bytes to {options['output']}")
+
+    def _resolve(self, value):
+        lookup = {"id": value} if value.isdigit() else {"email": value}
+        try:
+            return User.objects.get(**lookup).id
+        except User.DoesNotExist:
+            raise CommandError(f"User not found: {value}")
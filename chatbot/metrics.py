@@ -0,0 +1,42 @@
+"""
+Chatbot metrics for /metrics (MedAi/metrics.py): background TTS timing,
+TTS cache counters and the per-upstream circuit breaker / concurrency
+limit gauges.
+"""
+from MedAi.metrics import Histogram
+
+from . import resilience, tts_cache
+
+TTS_SECONDS = Histogram(
+    "tts_seconds",
+    "Background TTS synthesis time per message, by outcome",
+    ["outcome"],
+)
+
+STATES = (resilience.CLOSED, resilience.HALF_OPEN, resilience.OPEN)
+
+
+def collect():
+    cache_stats = tts_cache.stats()
+    upstreams = resilience.stats()
+
+    def per_upstream(field):
+        return [({"upstream": name}, stats[field]) for name, stats in upstreams.items()]
+
+    return [
+        ("tts_cache_hits_total", "counter", "TTS cache hits", [({}, cache_stats["hits"])]),
+        ("tts_cache_misses_total", "counter", "TTS cache misses", [({}, cache_stats["misses"])]),
+        ("tts_cache_entries", "gauge", "Cached TTS blobs", [({}, cache_stats["entries"])]),
+        ("tts_cache_bytes", "gauge", "Total size of cached TTS audio", [({}, cache_stats["total_bytes"])]),
+        ("tts_cache_max_bytes", "gauge", "TTS cache size cap", [({}, cache_stats["max_bytes"])]),
+        ("upstream_circuit_state", "gauge", "1 for the current circuit breaker state", [
+            ({"upstream": name, "state": state}, int(stats["state"] == state))
+            for name, stats in upstreams.items()
+            for state in STATES
+        ]),
+        ("upstream_in_flight", "gauge", "Requests in flight to the upstream", per_upstream("in_flight")),
+        ("upstream_concurrency_limit", "gauge", "Adaptive concurrency limit", per_upstream("limit")),
+        ("upstream_recent_failures", "gauge", "Failures in the breaker window", per_upstream("recent_failures")),
+        ("upstream_rejected_open_total", "counter", "Calls refused by an open breaker", per_upstream("rejected_open")),
+        ("upstream_rejected_busy_total", "counter", "Calls shed at the concurrency limit", per_upstream("rejected_busy")),
+    ]
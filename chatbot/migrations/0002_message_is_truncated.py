@@ -0,0 +1,18 @@
+# Generated by Django 5.2.11 on 2026-10-18 04:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatbot', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='is_truncated',
+            field=models.BooleanField(default=False),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.11 on 2026-10-18 04:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatbot', '0002_message_is_truncated'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='voice_status',
+            field=models.CharField(choices=[('none', 'None'), ('pending', 'Pending'), ('ready', 'Ready'), ('failed', 'Failed')], default='none', max_length=10),
+        ),
+    ]
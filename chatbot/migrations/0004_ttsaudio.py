@@ -0,0 +1,34 @@
+# Generated by Django 5.2.11 on 2026-10-18 04:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatbot', '0003_message_voice_status'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TTSAudio',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=64, unique=True)),
+                ('audio_file', models.FileField(upload_to='chat/tts/')),
+                ('size', models.PositiveIntegerField()),
+                ('hits', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('last_used_at', models.DateTimeField(db_index=True)),
+            ],
+            options={
+                'verbose_name': 'TTS Audio',
+                'verbose_name_plural': 'TTS Audio',
+            },
+        ),
+        migrations.AlterField(
+            model_name='message',
+            name='voice_status',
+            field=models.CharField(choices=[('none', 'None'), ('pending', 'Pending'), ('ready', 'Ready'), ('failed', 'Failed'), ('expired', 'Expired')], default='none', max_length=10),
+        ),
+    ]
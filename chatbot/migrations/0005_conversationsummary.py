@@ -0,0 +1,46 @@
+# Generated by Django 5.2.11 on 2026-10-18 05:01
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def backfill_summaries(apps, schema_editor):
+    Conversation = apps.get_model('chatbot', 'Conversation')
+    ConversationSummary = apps.get_model('chatbot', 'ConversationSummary')
+    Message = apps.get_model('chatbot', 'Message')
+
+    summaries = []
+    for conversation in Conversation.objects.iterator():
+        messages = Message.objects.filter(conversation=conversation)
+        last = messages.order_by('-created_at', '-id').first()
+        summaries.append(ConversationSummary(
+            conversation=conversation,
+            message_count=messages.count(),
+            last_message_text=last.text_content[:255] if last and last.text_content else None,
+            last_sender=last.sender if last else None,
+            last_activity_at=last.created_at if last else None,
+            has_unpaired_user_message=bool(last and last.sender == 'user'),
+        ))
+    ConversationSummary.objects.bulk_create(summaries, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatbot', '0004_ttsaudio'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ConversationSummary',
+            fields=[
+                ('conversation', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='summary', serialize=False, to='chatbot.conversation')),
+                ('message_count', models.PositiveIntegerField(default=0)),
+                ('last_message_text', models.CharField(blank=True, max_length=255, null=True)),
+                ('last_sender', models.CharField(blank=True, choices=[('user', 'User'), ('ai', 'AI')], max_length=10, null=True)),
+                ('last_activity_at', models.DateTimeField(blank=True, null=True)),
+                ('has_unpaired_user_message', models.BooleanField(default=False)),
+            ],
+        ),
+        migrations.RunPython(backfill_summaries, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,84 @@
+from django.db import migrations
+
+SQLITE_FORWARD = [
+    # External-content FTS5 table: stores only the index, rows live in chatbot_message
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS chatbot_message_fts USING fts5(
+        text_content, content='chatbot_message', content_rowid='id'
+    )
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS chatbot_message_fts_ai AFTER INSERT ON chatbot_message BEGIN
+        INSERT INTO chatbot_message_fts(rowid, text_content) VALUES (new.id, new.text_content);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS chatbot_message_fts_ad AFTER DELETE ON chatbot_message BEGIN
+        INSERT INTO chatbot_message_fts(chatbot_message_fts, rowid, text_content)
+        VALUES ('delete', old.id, old.text_content);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS chatbot_message_fts_au AFTER UPDATE OF text_content ON chatbot_message BEGIN
+        INSERT INTO chatbot_message_fts(chatbot_message_fts, rowid, text_content)
+        VALUES ('delete', old.id, old.text_content);
+        INSERT INTO chatbot_message_fts(rowid, text_content) VALUES (new.id, new.text_content);
+    END
+    """,
+    "INSERT INTO chatbot_message_fts(chatbot_message_fts) VALUES ('rebuild')",
+]
+
+SQLITE_REVERSE = [
+    "DROP TRIGGER IF EXISTS chatbot_message_fts_ai",
+    "DROP TRIGGER IF EXISTS chatbot_message_fts_ad",
+    "DROP TRIGGER IF EXISTS chatbot_message_fts_au",
+    "DROP TABLE IF EXISTS chatbot_message_fts",
+]
+
+
+def _postgres_index(apps):
+    from django.contrib.postgres.indexes import GinIndex
+    from django.contrib.postgres.search import SearchVector
+
+    # Must match the expression used in chatbot/search.py
+    return GinIndex(
+        SearchVector('text_content', config='english'),
+        name='chatbot_msg_text_search',
+    )
+
+
+def _sqlite_has_fts5(connection):
+    with connection.cursor() as cursor:
+        cursor.execute('PRAGMA compile_options')
+        return any('FTS5' in row[0] for row in cursor.fetchall())
+
+
+def create_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        if not _sqlite_has_fts5(schema_editor.connection):
+            return  # chatbot/search.py falls back to icontains
+        for sql in SQLITE_FORWARD:
+            schema_editor.execute(sql)
+    elif vendor == 'postgresql':
+        schema_editor.add_index(apps.get_model('chatbot', 'Message'), _postgres_index(apps))
+
+
+def drop_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        for sql in SQLITE_REVERSE:
+            schema_editor.execute(sql)
+    elif vendor == 'postgresql':
+        schema_editor.remove_index(apps.get_model('chatbot', 'Message'), _postgres_index(apps))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatbot', '0005_conversationsummary'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
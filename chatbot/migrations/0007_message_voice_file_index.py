@@ -0,0 +1,17 @@
+# Generated by Django 5.2.11 on 2026-10-18 06:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatbot', '0006_message_search_index'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['voice_file'], name='chatbot_msg_voice_file_idx'),
+        ),
+    ]
@@ -0,0 +1,19 @@
+from importlib import import_module
+
+from django.db import migrations
+
+# The first version of 0007 altered voice_file, which rebuilt chatbot_message
+# on SQLite and dropped the search triggers. Recreating them is a no-op where
+# they exist; the FTS 'rebuild' re-indexes messages written in the meantime.
+search_index = import_module('chatbot.migrations.0006_message_search_index')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatbot', '0007_message_voice_file_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(search_index.create_search_index, migrations.RunPython.noop),
+    ]
@@ -42,6 +42,13 @@ class Message(models.Model):
         VOICE = "voice", "Voice"
         IMAGE = "image", "Image"
 
+    class VoiceStatus(models.TextChoices):
+        NONE = "none", "None"
+        PENDING = "pending", "Pending"
+        READY = "ready", "Ready"
+        FAILED = "failed", "Failed"
+        EXPIRED = "expired", "Expired"  # cached audio was evicted
+
     conversation = models.ForeignKey(
         Conversation,
         on_delete=models.CASCADE,
@@ -67,19 +74,107 @@ class Message(models.Model):
         null=True
     )
 
+    # TTS audio for AI replies is generated in the background
+    voice_status = models.CharField(
+        max_length=10,
+        choices=VoiceStatus.choices,
+        default=VoiceStatus.NONE
+    )
+
     image_file = models.ImageField(
         upload_to="chat/images/",
         blank=True,
         null=True
     )
 
+    # Set when a streamed AI reply was cut off before it finished
+    is_truncated = models.BooleanField(default=False)
+
     created_at = models.DateTimeField(auto_now_add=True)
 
     class Meta:
         ordering = ["created_at"]
         indexes = [
             models.Index(fields=["conversation", "created_at"]),
+            # TTS cache eviction clears messages by the evicted file name. An
+            # index, not db_index: AlterField rebuilds the table on SQLite and
+            # that drops the search triggers from migration 0006
+            models.Index(fields=["voice_file"], name="chatbot_msg_voice_file_idx"),
         ]
 
     def __str__(self):
         return f"{self.conversation.id} | {self.sender} | {self.created_at}"
+
+
+class ConversationSummary(models.Model):
+    """
+    Denormalized counters and preview for a conversation, updated in the
+    same transaction as every message insert so list views read one row
+    per conversation
+    """
+
+    conversation = models.OneToOneField(
+        Conversation,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name="summary"
+    )
+
+    message_count = models.PositiveIntegerField(default=0)
+    last_message_text = models.CharField(max_length=255, blank=True, null=True)
+    last_sender = models.CharField(
+        max_length=10,
+        choices=Message.SenderType.choices,
+        blank=True,
+        null=True
+    )
+    last_activity_at = models.DateTimeField(blank=True, null=True)
+
+    # The last message is from the user and has no AI reply yet
+    has_unpaired_user_message = models.BooleanField(default=False)
+
+    def __str__(self):
+        return f"Summary of conversation {self.conversation_id}"
+
+    @classmethod
+    def record(cls, *messages):
+        """Fold newly inserted messages (oldest first) into their conversation summary"""
+        message = messages[-1]
+        fields = {
+            "last_message_text": message.text_content[:255] if message.text_content else None,
+            "last_sender": message.sender,
+            "last_activity_at": message.created_at,
+            "has_unpaired_user_message": message.sender == Message.SenderType.USER,
+        }
+        updated = cls.objects.filter(conversation_id=message.conversation_id).update(
+            message_count=models.F("message_count") + len(messages),
+            **fields
+        )
+        if not updated:
+            cls.objects.create(
+                conversation_id=message.conversation_id,
+                message_count=Message.objects.filter(conversation_id=message.conversation_id).count(),
+                **fields
+            )
+
+
+class TTSAudio(models.Model):
+    """
+    Cached TTS audio blob, shared by every AI message whose TTS payload
+    normalizes to the same key (see chatbot/tts_cache.py)
+    """
+
+    key = models.CharField(max_length=64, unique=True)
+    audio_file = models.FileField(upload_to="chat/tts/")
+    size = models.PositiveIntegerField()
+    hits = models.PositiveIntegerField(default=0)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    last_used_at = models.DateTimeField(db_index=True)
+
+    class Meta:
+        verbose_name = "TTS Audio"
+        verbose_name_plural = "TTS Audio"
+
+    def __str__(self):
+        return f"{self.key[:12]} ({self.size} bytes)"
@@ -0,0 +1,17 @@
+from rest_framework.pagination import CursorPagination
+
+
+class ConversationCursorPagination(CursorPagination):
+    """Most recently active conversations first"""
+    page_size = 20
+    page_size_query_param = "page_size"
+    max_page_size = 100
+    ordering = ("-updated_at", "-id")
+
+
+class MessageCursorPagination(CursorPagination):
+    """Newest messages first; follow `next` to load older ones"""
+    page_size = 50
+    page_size_query_param = "page_size"
+    max_page_size = 200
+    ordering = ("-created_at", "-id")
@@ -0,0 +1,240 @@
+"""
+Rate limits and daily quotas for chat submissions.
+
+Each chat POST is classified as text, voice (an `audio` upload) or image
+(a `file` upload) and must pass, for that kind:
+
+- a token bucket per user and one per client IP (settings.CHAT_RATE_LIMIT
+  "user" / "ip", in DRF's "<requests>/<period>" format: the bucket holds
+  <requests> tokens and refills at that rate, so short bursts are allowed);
+- a per-user daily quota ("daily_quota", 0 = unlimited), counted in
+  TIME_ZONE days.
+
+A request either passes every check and takes one token from each bucket
+plus one quota unit, or is refused and consumes nothing. Refusals raise
+ChatRateLimited: 429 with Retry-After and
+{"error": ..., "reason": "user_rate" | "ip_rate" | "daily_quota", "kind": ...}.
+
+With Redis (django-redis) the whole check runs as one Lua script, so it
+is atomic and costs one round trip, with Redis's clock as the time source.
+Other cache backends (LocMem in benchmarks) use an equivalent
+read-modify-write that is only atomic within one process. If the limiter's
+store is unreachable, requests are let through (and logged) rather than
+turning a cache outage into a chat outage.
+"""
+import math
+import time
+import threading
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+from rest_framework.exceptions import Throttled
+from rest_framework.throttling import BaseThrottle
+
+from MedAi.log import get_logger
+
+logger = get_logger("chatbot.ratelimit")
+
+TEXT = "text"
+VOICE = "voice"
+IMAGE = "image"
+
+PERIODS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+
+# KEYS: bucket keys..., quota key
+# ARGV: capacity and refill rate (tokens/s) per bucket, then quota limit and TTL
+# Returns {allowed, index of the failed check (buckets, then quota), retry_after_ms, quota_used}
+CHECK_SCRIPT = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local buckets = #KEYS - 1
+local quota_key = KEYS[buckets + 1]
+local quota_limit = tonumber(ARGV[2 * buckets + 1])
+local quota_ttl = tonumber(ARGV[2 * buckets + 2])
+
+local used = tonumber(redis.call('GET', quota_key) or '0')
+if quota_limit > 0 and used >= quota_limit then
+  return {0, buckets + 1, quota_ttl * 1000, used}
+end
+
+local levels = {}
+local blocked, wait = 0, 0
+for i = 1, buckets do
+  local capacity = tonumber(ARGV[2 * i - 1])
+  local rate = tonumber(ARGV[2 * i])
+  local state = redis.call('HMGET', KEYS[i], 'tokens', 'ts')
+  local level = tonumber(state[1]) or capacity
+  local ts = tonumber(state[2]) or now
+  level = math.min(capacity, level + math.max(0, now - ts) * rate)
+  levels[i] = level
+  if level < 1 and (1 - level) / rate > wait then
+    blocked, wait = i, (1 - level) / rate
+  end
+end
+if blocked > 0 then
+  return {0, blocked, math.ceil(wait * 1000), used}
+end
+
+for i = 1, buckets do
+  local capacity = tonumber(ARGV[2 * i - 1])
+  local rate = tonumber(ARGV[2 * i])
+  redis.call('HSET', KEYS[i], 'tokens', levels[i] - 1, 'ts', now)
+  redis.call('PEXPIRE', KEYS[i], math.ceil(capacity / rate * 1000) + 1000)
+end
+if quota_limit > 0 then
+  used = redis.call('INCR', quota_key)
+  if used == 1 then
+    redis.call('EXPIRE', quota_key, quota_ttl + 60)
+  end
+end
+return {1, 0, 0, used}
+"""
+
+_lock = threading.Lock()
+_script = None
+
+
+def parse_rate(rate):
+    """'20/min' -> (20 tokens capacity, 20/60 tokens per second); None -> None"""
+    if not rate:
+        return None
+    count, period = rate.split("/")
+    count = int(count)
+    return count, count / PERIODS[period[0]]
+
+
+def message_kind(data):
+    if data.get("audio"):
+        return VOICE
+    if data.get("file"):
+        return IMAGE
+    return TEXT
+
+
+class Decision:
+
+    def __init__(self, allowed, kind, reason=None, retry_after=0, quota_used=0, quota_limit=0):
+        self.allowed = allowed
+        self.kind = kind
+        self.reason = reason
+        self.retry_after = retry_after
+        self.quota_used = quota_used
+        self.quota_limit = quota_limit
+
+
+class ChatRateLimited(Throttled):
+
+    def __init__(self, decision):
+        super().__init__(wait=decision.retry_after)
+        self.detail = {
+            "error": "Daily chat quota reached" if decision.reason == "daily_quota" else "Too many chat requests",
+            "reason": decision.reason,
+            "kind": decision.kind,
+        }
+
+
+def _seconds_until_midnight(now):
+    tomorrow = (now + timedelta(days=1)).date()
+    midnight = timezone.make_aware(datetime.combine(tomorrow, datetime.min.time()), now.tzinfo)
+    return max(1, math.ceil((midnight - now).total_seconds()))
+
+
+def _redis_client():
+    # django-redis exposes the raw client; other backends have no scripting
+    client = getattr(cache, "client", None)
+    if client is None or not hasattr(client, "get_client"):
+        return None
+    return client.get_client(write=True)
+
+
+def _check_redis(client, buckets, quota_key, quota_limit, quota_ttl):
+    global _script
+    if _script is None:
+        _script = client.register_script(CHECK_SCRIPT)
+    args = []
+    for _, _, capacity, rate in buckets:
+        args += [capacity, rate]
+    allowed, failed, retry_ms, used = _script(
+        keys=[cache.make_key(key) for _, key, _, _ in buckets] + [cache.make_key(quota_key)],
+        args=args + [quota_limit, quota_ttl],
+        client=client,
+    )
+    return bool(allowed), failed - 1, retry_ms / 1000, used
+
+
+def _check_local(buckets, quota_key, quota_limit, quota_ttl):
+    with _lock:
+        now = time.time()
+        keys = [key for _, key, _, _ in buckets]
+        values = cache.get_many(keys + [quota_key])
+        used = values.get(quota_key, 0)
+        if quota_limit and used >= quota_limit:
+            return False, len(buckets), quota_ttl, used
+
+        levels = []
+        blocked, wait = None, 0
+        for index, (_, key, capacity, rate) in enumerate(buckets):
+            level, ts = values.get(key, (capacity, now))
+            level = min(capacity, level + max(0, now - ts) * rate)
+            levels.append(level)
+            if level < 1 and (1 - level) / rate > wait:
+                blocked, wait = index, (1 - level) / rate
+        if blocked is not None:
+            return False, blocked, wait, used
+
+        for (_, key, capacity, rate), level in zip(buckets, levels):
+            cache.set(key, (level - 1, now), timeout=math.ceil(capacity / rate) + 1)
+        if quota_limit:
+            used += 1
+            cache.set(quota_key, used, timeout=quota_ttl + 60)
+        return True, None, 0, used
+
+
+def check(kind, user_id, ip):
+    """Take one request of `kind` from the user's and the IP's allowance"""
+    config = settings.CHAT_RATE_LIMIT
+    buckets = []
+    for scope, ident in (("user", user_id), ("ip", ip)):
+        rate = parse_rate(config[scope].get(kind))
+        if rate and ident is not None:
+            buckets.append((f"{scope}_rate", f"ratelimit:{scope}:{ident}:{kind}", *rate))
+
+    now = timezone.localtime()
+    quota_limit = config["daily_quota"].get(kind) or 0
+    quota_key = f"ratelimit:quota:{user_id}:{kind}:{now.date().isoformat()}"
+    quota_ttl = _seconds_until_midnight(now)
+
+    try:
+        client = _redis_client()
+        if client is not None:
+            allowed, failed, retry_after, used = _check_redis(client, buckets, quota_key, quota_limit, quota_ttl)
+        else:
+            allowed, failed, retry_after, used = _check_local(buckets, quota_key, quota_limit, quota_ttl)
+    except Exception:
+        logger.warning("Rate limiter unavailable; allowing request", exc_info=True)
+        return Decision(True, kind)
+
+    if allowed:
+        return Decision(True, kind, quota_used=used, quota_limit=quota_limit)
+    reason = "daily_quota" if failed == len(buckets) else buckets[failed][0]
+    return Decision(False, kind, reason, retry_after, used, quota_limit)
+
+
+class ChatRateThrottle(BaseThrottle):
+    """
+    DRF throttle for the chat views: checks POSTs against the user's and
+    client IP's limits for the message kind, and answers 429 with a reason.
+    The chat views call it themselves once the Idempotency-Key is claimed
+    and the request has validated (not via throttle_classes), so a replayed
+    retry is never refused and a 400 costs nothing.
+    """
+
+    def allow_request(self, request, view):
+        if request.method != "POST" or not settings.CHAT_RATE_LIMIT["enabled"]:
+            return True
+        decision = check(message_kind(request.data), request.user.pk, self.get_ident(request))
+        if not decision.allowed:
+            raise ChatRateLimited(decision)
+        return True
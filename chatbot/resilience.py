@@ -0,0 +1,333 @@
+"""
+Circuit breaker and adaptive concurrency limit for the AI upstreams.
+
+State lives in the shared Django cache (Redis), so every web and Celery
+worker sees the same picture of an upstream:
+
+- Circuit breaker: `failure_threshold` failures (transport errors or 5xx
+  replies) within `failure_window` seconds open the circuit. While open,
+  calls fail fast for `reset_timeout` seconds; then one probe call is let
+  through (half-open) and its outcome closes or re-opens the circuit.
+- Concurrency limit (AIMD): at most `limit` calls may be in flight across
+  workers. A call that finishes under `latency_target` raises the limit by
+  1/limit (about +1 per window of calls); a slow or failed call multiplies
+  it by `backoff`. The limit stays within [min_limit, max_limit].
+
+Updates are read-modify-write on the cache, so under heavy contention the
+limit is approximate. In-flight calls are counted exactly: each admitted
+call holds its own permit that expires after `call_timeout`, so a worker
+that dies mid-call cannot leak a slot. With Redis the permits are a sorted
+set scored by deadline and admission is one Lua script; other cache
+backends keep them in one cache entry, atomic only within a process.
+
+If the cache is unreachable, calls are let through (and logged) rather
+than failing every chat.
+
+    with upstream_call("chatbot") as call:
+        response = client.post(...)
+        call.ok = response.status_code < 500
+
+Rejected calls raise UpstreamUnavailable before anything is sent.
+"""
+import math
+import time
+import uuid
+import threading
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+
+from MedAi.log import get_logger
+
+logger = get_logger("chatbot.resilience")
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+DEFAULTS = {
+    "failure_threshold": 5,
+    "failure_window": 30,
+    "reset_timeout": 30,
+    "initial_limit": 20,
+    "min_limit": 2,
+    "max_limit": 100,
+    "latency_target": 20,
+    "backoff": 0.9,
+    # Upper bound on one call; in-flight permits and probe locks expire after it
+    "call_timeout": 120,
+}
+
+# Weight of the newest sample in the latency moving average
+LATENCY_ALPHA = 0.2
+
+# KEYS: permit set
+# ARGV: permit id, limit, call_timeout, force (1 for the half-open probe)
+# Returns the number of calls in flight including this one, or 0 if refused
+ACQUIRE_SCRIPT = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local timeout = tonumber(ARGV[3])
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now)
+local in_flight = redis.call('ZCARD', KEYS[1]) + 1
+if in_flight > tonumber(ARGV[2]) and ARGV[4] == '0' then
+  return 0
+end
+redis.call('ZADD', KEYS[1], now + timeout, ARGV[1])
+redis.call('PEXPIRE', KEYS[1], math.ceil(timeout * 1000) + 1000)
+return in_flight
+"""
+
+# In-flight permits are not a plain cache value (see _Permits)
+KEYS = (
+    "failures",
+    "open",
+    "tripped",
+    "probe",
+    "limit",
+    "latency",
+    "rejected_open",
+    "rejected_busy",
+)
+
+
+class UpstreamUnavailable(Exception):
+    """
+    The call was refused locally: the circuit is open or the upstream
+    already has `limit` calls in flight.
+    """
+
+    def __init__(self, upstream, reason, retry_after=1):
+        super().__init__(f"{upstream} upstream unavailable ({reason})")
+        self.upstream = upstream
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+def _incr(key, timeout=None):
+    cache.add(key, 0, timeout=timeout)
+    try:
+        return cache.incr(key)
+    except ValueError:
+        cache.set(key, 1, timeout=timeout)
+        return 1
+
+
+def _redis_client():
+    # django-redis exposes the raw client; other backends have no sorted sets
+    client = getattr(cache, "client", None)
+    if client is None or not hasattr(client, "get_client"):
+        return None
+    return client.get_client(write=True)
+
+
+class _Permits:
+    """The in-flight calls of one upstream, each with its own deadline"""
+
+    _lock = threading.Lock()
+    _script = None
+
+    def __init__(self, key):
+        self.key = key
+
+    def acquire(self, permit_id, limit, timeout, force=False):
+        """Add a permit unless `limit` calls are in flight (force: always)"""
+        client = _redis_client()
+        if client is not None:
+            if _Permits._script is None:
+                _Permits._script = client.register_script(ACQUIRE_SCRIPT)
+            return bool(_Permits._script(
+                keys=[cache.make_key(self.key)],
+                args=[permit_id, limit, timeout, int(force)],
+                client=client,
+            ))
+        with self._lock:
+            now = time.time()
+            permits = {pid: deadline for pid, deadline in (cache.get(self.key) or {}).items() if deadline > now}
+            if len(permits) + 1 > limit and not force:
+                return False
+            permits[permit_id] = now + timeout
+            cache.set(self.key, permits, timeout=math.ceil(timeout) + 1)
+            return True
+
+    def release(self, permit_id):
+        client = _redis_client()
+        if client is not None:
+            client.zrem(cache.make_key(self.key), permit_id)
+            return
+        with self._lock:
+            permits = cache.get(self.key) or {}
+            if permits.pop(permit_id, None) is not None:
+                cache.set(self.key, permits, timeout=max(1, math.ceil(max(permits.values(), default=0) - time.time())))
+
+    def count(self):
+        now = time.time()
+        client = _redis_client()
+        if client is not None:
+            return client.zcount(cache.make_key(self.key), now, "+inf")
+        return sum(1 for deadline in (cache.get(self.key) or {}).values() if deadline > now)
+
+    def clear(self):
+        cache.delete(self.key)
+
+
+class UpstreamGuard:
+    """Shared breaker + limiter state for one upstream ("chatbot", "tts")"""
+
+    def __init__(self, upstream):
+        self.upstream = upstream
+        self.config = {**DEFAULTS, **settings.AI_RESILIENCE.get(upstream, {})}
+        self.keys = {name: f"ai:{upstream}:{name}" for name in KEYS}
+        self.permits = _Permits(f"ai:{upstream}:in_flight")
+
+    def acquire(self):
+        """
+        Admit one call or raise UpstreamUnavailable.
+        Returns (started_at, is_probe, permit_id) for release().
+        """
+        try:
+            return self._acquire()
+        except UpstreamUnavailable:
+            raise
+        except Exception:
+            logger.warning("Upstream guard unavailable; allowing call", extra={"upstream": self.upstream}, exc_info=True)
+            return time.monotonic(), False, None
+
+    def _acquire(self):
+        keys, config = self.keys, self.config
+        values = cache.get_many([keys["open"], keys["tripped"], keys["limit"]])
+
+        if keys["open"] in values:
+            _incr(keys["rejected_open"])
+            retry_after = math.ceil(values[keys["open"]] - time.time())
+            raise UpstreamUnavailable(self.upstream, "circuit_open", max(retry_after, 1))
+
+        is_probe = False
+        if keys["tripped"] in values:
+            # Half-open: a single caller probes the upstream, the rest wait
+            if not cache.add(keys["probe"], 1, timeout=config["call_timeout"]):
+                _incr(keys["rejected_open"])
+                raise UpstreamUnavailable(self.upstream, "circuit_half_open")
+            is_probe = True
+
+        limit = values.get(keys["limit"], config["initial_limit"])
+        permit_id = uuid.uuid4().hex
+        if not self.permits.acquire(permit_id, limit, config["call_timeout"], force=is_probe):
+            _incr(keys["rejected_busy"])
+            raise UpstreamUnavailable(self.upstream, "concurrency_limit")
+
+        return time.monotonic(), is_probe, permit_id
+
+    def release(self, permit, ok, elapsed=None):
+        """Record the outcome of an admitted call"""
+        started_at, is_probe, permit_id = permit
+        if elapsed is None:
+            elapsed = time.monotonic() - started_at
+        if permit_id is None:
+            return  # admitted without the cache (see acquire)
+        try:
+            self._release(is_probe, permit_id, ok, elapsed)
+        except Exception:
+            logger.warning("Upstream guard unavailable; outcome not recorded", extra={"upstream": self.upstream}, exc_info=True)
+
+    def _release(self, is_probe, permit_id, ok, elapsed):
+        keys, config = self.keys, self.config
+        self.permits.release(permit_id)
+
+        values = cache.get_many([keys["limit"], keys["latency"]])
+        limit = values.get(keys["limit"], config["initial_limit"])
+        latency = values.get(keys["latency"])
+        if ok and elapsed <= config["latency_target"]:
+            limit = min(config["max_limit"], limit + 1 / limit)
+        else:
+            limit = max(config["min_limit"], limit * config["backoff"])
+        latency = elapsed if latency is None else latency + LATENCY_ALPHA * (elapsed - latency)
+        cache.set_many({keys["limit"]: limit, keys["latency"]: latency}, timeout=None)
+
+        if ok:
+            if is_probe:
+                cache.delete_many([keys["tripped"], keys["failures"], keys["probe"]])
+        elif is_probe or _incr(keys["failures"], timeout=config["failure_window"]) >= config["failure_threshold"]:
+            self.trip()
+
+    def trip(self):
+        """Open the circuit for reset_timeout seconds"""
+        keys, reset_timeout = self.keys, self.config["reset_timeout"]
+        cache.set(keys["open"], time.time() + reset_timeout, timeout=reset_timeout)
+        cache.set(keys["tripped"], 1, timeout=None)
+        cache.delete_many([keys["failures"], keys["probe"]])
+
+    def reset(self):
+        cache.delete_many(list(self.keys.values()))
+        self.permits.clear()
+
+    def state(self):
+        values = cache.get_many([self.keys["open"], self.keys["tripped"]])
+        if self.keys["open"] in values:
+            return OPEN
+        if self.keys["tripped"] in values:
+            return HALF_OPEN
+        return CLOSED
+
+    def stats(self):
+        values = cache.get_many(list(self.keys.values()))
+
+        def value(name, default=0):
+            return values.get(self.keys[name], default)
+
+        latency = value("latency", None)
+        return {
+            "state": self.state(),
+            "recent_failures": value("failures"),
+            "in_flight": self.permits.count(),
+            "limit": round(value("limit", self.config["initial_limit"]), 2),
+            "latency_avg": round(latency, 3) if latency is not None else None,
+            "latency_target": self.config["latency_target"],
+            "rejected_open": value("rejected_open"),
+            "rejected_busy": value("rejected_busy"),
+        }
+
+
+class upstream_call:
+    """
+    Context manager around one upstream request (sync or async).
+    Set `ok = False` for a failed reply; exceptions count as failures.
+    Call stop() to end the latency measurement early (e.g. once a
+    streamed reply has started).
+    """
+
+    def __init__(self, upstream):
+        self.guard = UpstreamGuard(upstream)
+        self.ok = True
+        self.elapsed = None
+
+    def stop(self):
+        if self.elapsed is None:
+            self.elapsed = time.monotonic() - self.permit[0]
+
+    def _failed(self, exc_type):
+        # Client disconnects (GeneratorExit, cancellation) are not upstream failures
+        return exc_type is not None and issubclass(exc_type, Exception)
+
+    def __enter__(self):
+        self.permit = self.guard.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.guard.release(self.permit, self.ok and not self._failed(exc_type), self.elapsed)
+        return False
+
+    async def __aenter__(self):
+        self.permit = await sync_to_async(self.guard.acquire)()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await sync_to_async(self.guard.release)(
+            self.permit, self.ok and not self._failed(exc_type), self.elapsed
+        )
+        return False
+
+
+def stats():
+    return {upstream: UpstreamGuard(upstream).stats() for upstream in settings.AI_RESILIENCE}
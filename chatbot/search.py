@@ -0,0 +1,99 @@
+"""
+Full-text search over Message.text_content, scoped to one user.
+
+SQLite uses the chatbot_message_fts FTS5 table and Postgres a GIN index on
+to_tsvector('english', text_content); both are created by migration 0006
+and kept up to date on insert/update/delete (triggers on SQLite, the index
+itself on Postgres). Other databases fall back to an icontains scan, as
+does SQLite when the FTS table or any of its triggers is missing: rebuilding
+chatbot_message (e.g. an AlterField migration) drops the triggers, after
+which the index silently goes stale. Every backend returns the newest
+matching messages first.
+"""
+from django.db import connection
+
+from MedAi.log import get_logger
+from .models import Message
+
+logger = get_logger("chatbot.search")
+
+# The FTS table and the triggers that keep it in sync (migration 0006)
+FTS_OBJECTS = (
+    "chatbot_message_fts",
+    "chatbot_message_fts_ai",
+    "chatbot_message_fts_ad",
+    "chatbot_message_fts_au",
+)
+
+FTS_SQL = """
+    SELECT m.id
+    FROM chatbot_message_fts f
+    JOIN chatbot_message m ON m.id = f.rowid
+    JOIN chatbot_conversation c ON c.id = m.conversation_id
+    WHERE chatbot_message_fts MATCH %s AND c.user_id = %s
+    ORDER BY f.rowid DESC
+    LIMIT %s
+"""
+
+
+def _fts5_query(query):
+    # Quote every term so user input can't use FTS5 operators; terms are ANDed
+    terms = query.split()
+    return " ".join('"%s"' % term.replace('"', '""') for term in terms)
+
+
+def _search_sqlite(user, query, limit):
+    with connection.cursor() as cursor:
+        cursor.execute(FTS_SQL, [_fts5_query(query), user.id, limit])
+        ids = [row[0] for row in cursor.fetchall()]
+    messages = Message.objects.in_bulk(ids)
+    return [messages[i] for i in ids if i in messages]
+
+
+def _search_postgres(user, query, limit):
+    from django.contrib.postgres.search import SearchQuery, SearchVector
+
+    # Same expression as the GIN index in migration 0006
+    vector = SearchVector("text_content", config="english")
+    return list(
+        Message.objects.annotate(search=vector)
+        .filter(
+            conversation__user=user,
+            search=SearchQuery(query, config="english", search_type="plain"),
+        )
+        .order_by("-created_at")[:limit]
+    )
+
+
+def search_scan(user, query, limit):
+    """Unindexed icontains scan (fallback, and the benchmark baseline)"""
+    return list(
+        Message.objects.filter(
+            conversation__user=user,
+            text_content__icontains=query,
+        ).order_by("-created_at")[:limit]
+    )
+
+
+def _fts_ready():
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT name FROM sqlite_master WHERE name IN (%s)" % ", ".join(["%s"] * len(FTS_OBJECTS)),
+            FTS_OBJECTS,
+        )
+        found = {row[0] for row in cursor.fetchall()}
+    missing = [name for name in FTS_OBJECTS if name not in found]
+    if missing and found:
+        logger.warning("Message search index incomplete; scanning", extra={"missing": missing})
+    return not missing
+
+
+def search_messages(user, query, limit=50):
+    query = (query or "").strip()
+    if not query:
+        return []
+    if connection.vendor == "sqlite" and _fts_ready():
+        return _search_sqlite(user, query, limit)
+    if connection.vendor == "postgresql":
+        return _search_postgres(user, query, limit)
+    return search_scan(user, query, limit)
@@ -5,7 +5,6 @@ class MessageSerializer(serializers.ModelSerializer):
     """Serializer for displaying message history"""
 
     conversation_id = serializers.IntegerField(
-        source="conversation.id",
         read_only=True
     )
     
@@ -23,8 +22,10 @@ class MessageSerializer(serializers.ModelSerializer):
             "text_content",
             "voice_file",
             "voice_file_url",
+            "voice_status",
             "image_file",
             "image_file_url",
+            "is_truncated",
             "created_at",
         ]
         read_only_fields = ["id", "created_at", "conversation_id"]
@@ -77,6 +78,13 @@ class ChatRequestSerializer(serializers.Serializer):
         default="text"
     )
 
+    # Relay the reply token by token as Server-Sent Events or NDJSON lines
+    stream = serializers.ChoiceField(
+        choices=["sse", "ndjson"],
+        required=False,
+        allow_null=True
+    )
+
     def validate(self, data):
         if not any([
             data.get("text"),
@@ -98,11 +106,15 @@ class ChatResponseSerializer(serializers.Serializer):
 
 
 class ConversationSerializer(serializers.ModelSerializer):
-    """Serializer for conversation list"""
-    
-    message_count = serializers.IntegerField(read_only=True)
+    """
+    Serializer for conversation list (reads the ConversationSummary row).
+    Conversations created without one (admin, other code paths) show as empty.
+    """
+
+    message_count = serializers.SerializerMethodField()
+    has_unpaired_user_message = serializers.SerializerMethodField()
     latest_message = serializers.SerializerMethodField()
-    
+
     class Meta:
         model = Conversation
         fields = [
@@ -110,17 +122,26 @@ class ConversationSerializer(serializers.ModelSerializer):
             "created_at",
             "updated_at",
             "message_count",
+            "has_unpaired_user_message",
             "latest_message",
         ]
         read_only_fields = ["id", "created_at", "updated_at"]
-    
+
+    def get_message_count(self, obj):
+        summary = getattr(obj, "summary", None)
+        return summary.message_count if summary else 0
+
+    def get_has_unpaired_user_message(self, obj):
+        summary = getattr(obj, "summary", None)
+        return summary.has_unpaired_user_message if summary else False
+
     def get_latest_message(self, obj):
         """Get the latest message preview"""
-        latest = obj.messages.last()
-        if latest:
-            return {
-                "text": latest.text_content[:50] if latest.text_content else None,
-                "sender": latest.sender,
-                "created_at": latest.created_at,
-            }
-        return None
\ No newline at end of file
+        summary = getattr(obj, "summary", None)
+        if not summary or not summary.last_sender:
+            return None
+        return {
+            "text": summary.last_message_text[:50] if summary.last_message_text else None,
+            "sender": summary.last_sender,
+            "created_at": summary.last_activity_at,
+        }
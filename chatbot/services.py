@@ -0,0 +1,322 @@
+"""
+Chat pipeline steps shared by the sync and async chat views.
+"""
+import json
+import mimetypes
+
+import httpx
+from django.db import transaction
+from django.urls import reverse
+from kombu.exceptions import OperationalError
+
+from MedAi.log import get_logger
+from MedAi.metrics import span
+
+from . import context
+from .client import get_client, get_async_client, upstream_url
+from .models import Message, Conversation, ConversationSummary
+from .resilience import UpstreamUnavailable, upstream_call
+
+logger = get_logger("chatbot.ai")
+
+
+class AIResponseParser:
+
+    @staticmethod
+    def extract_text(ai_json):
+        return ai_json.get("assistant_message")
+
+    @staticmethod
+    def extract_tts(ai_json):
+        return ai_json.get("tts")
+
+    @staticmethod
+    def extract_data(ai_json):
+        """Extract the data field from AI response"""
+        return ai_json.get("data")
+
+
+class AIServiceError(Exception):
+    """
+    The AI upstream could not produce a usable reply.
+    `payload` and `status` are returned to the client as-is.
+    """
+
+    def __init__(self, payload, status=502, headers=None):
+        super().__init__(payload.get("error"))
+        self.payload = payload
+        self.status = status
+        self.headers = headers
+
+
+def unavailable_error(exc):
+    """AIServiceError for a call refused by the circuit breaker / limiter"""
+    return AIServiceError(
+        {
+            "error": "AI service temporarily unavailable",
+            "reason": exc.reason,
+            "retry_after": exc.retry_after,
+        },
+        status=503,
+        headers={"Retry-After": str(exc.retry_after)},
+    )
+
+
+def get_conversation(user, conversation_id):
+    """
+    Return the user's conversation, a new one when no id is given,
+    or None when the id does not belong to the user.
+    """
+    if conversation_id:
+        return Conversation.objects.filter(
+            id=conversation_id,
+            user=user
+        ).first()
+    with transaction.atomic():
+        conversation = Conversation.objects.create(user=user)
+        ConversationSummary.objects.create(conversation=conversation)
+    return conversation
+
+
+def get_message_type(validated_data):
+    if validated_data.get("audio"):
+        return Message.MessageType.VOICE
+    if validated_data.get("file"):
+        return Message.MessageType.IMAGE
+    return Message.MessageType.TEXT
+
+
+def prepare_user_message(conversation, validated_data):
+    """
+    Build the user Message without inserting it. Uploads are written to
+    storage now so they can be streamed to the AI; the row itself is saved
+    with the rest of the turn by save_turn().
+    """
+    user_message = Message(
+        conversation=conversation,
+        sender=Message.SenderType.USER,
+        message_type=get_message_type(validated_data),
+        text_content=validated_data.get("text"),
+    )
+    if validated_data.get("audio"):
+        audio = validated_data["audio"]
+        user_message.voice_file.save(audio.name, audio, save=False)
+    if validated_data.get("file"):
+        image = validated_data["file"]
+        user_message.image_file.save(image.name, image, save=False)
+    return user_message
+
+
+def build_ai_request(user, conversation, validated_data, user_message):
+    """
+    Returns (ai_data, ai_files) for the AI chatbot request.
+
+    Uploads are not read into memory: prepare_user_message already moved (or
+    streamed) them into storage, so the stored files are opened here and the
+    HTTP client sends them in chunks. Callers must close_files(ai_files).
+
+    `history` carries the recent turns (see chatbot/context.py) so the AI
+    service does not have to reload the conversation itself.
+    """
+    ai_data = {
+        "user_id": user.id,
+        "conversation_id": conversation.id,
+        "reply_mode": validated_data.get("reply_mode", "text"),
+        "history": context.get_window(conversation.id),
+    }
+
+    if validated_data.get("text"):
+        ai_data["text"] = validated_data["text"]
+
+    ai_files = {}
+
+    if user_message.voice_file:
+        audio = validated_data["audio"]
+
+        # Guess correct MIME from filename
+        guessed_type, _ = mimetypes.guess_type(audio.name)
+        ai_files["audio"] = (
+            audio.name,
+            user_message.voice_file.open("rb"),
+            guessed_type or "audio/m4a"
+        )
+
+    if user_message.image_file:
+        image = validated_data["file"]
+        ai_files["file"] = (
+            image.name,
+            user_message.image_file.open("rb"),
+            image.content_type
+        )
+
+    return ai_data, ai_files
+
+
+def close_files(ai_files):
+    for _name, fileobj, _content_type in ai_files.values():
+        fileobj.close()
+
+
+def forward_headers(request):
+    """Forward the caller's Bearer token to the AI service"""
+    auth_header = request.headers.get("Authorization")
+    return {"Authorization": auth_header} if auth_header else {}
+
+
+def request_kwargs(ai_data, ai_files, headers):
+    if ai_files:
+        # Multipart request (for audio/image); form fields must be flat
+        data = dict(ai_data, history=json.dumps(ai_data.get("history", [])))
+        return {"data": data, "files": ai_files, "headers": headers}
+    # Pure JSON request (for text)
+    return {"json": ai_data, "headers": headers}
+
+
+def parse_ai_response(ai_response):
+    # Reply bodies are patient conversations: log their size, never their text
+    extra = {
+        "status": ai_response.status_code,
+        "bytes": len(ai_response.content),
+        "elapsed_ms": round(ai_response.elapsed.total_seconds() * 1000),
+    }
+    if ai_response.status_code != 200:
+        logger.warning("AI chatbot error response", extra=extra)
+        raise AIServiceError(
+            {"error": "AI chatbot error", "details": ai_response.text},
+            status=502,
+        )
+    logger.info("AI chatbot response", extra=extra)
+
+    try:
+        return ai_response.json()
+    except ValueError:
+        raise AIServiceError(
+            {"error": "Invalid AI response format"},
+            status=502,
+        )
+
+
+def call_ai(ai_data, ai_files, headers):
+    try:
+        with span("ai"), upstream_call("chatbot") as call:
+            ai_response = get_client("chatbot").post(
+                upstream_url("chatbot"),
+                **request_kwargs(ai_data, ai_files, headers),
+            )
+            call.ok = ai_response.status_code < 500
+    except UpstreamUnavailable as e:
+        raise unavailable_error(e)
+    except httpx.HTTPError as e:
+        raise AIServiceError(
+            {"error": "AI service unreachable", "details": str(e)},
+            status=503,
+        )
+    finally:
+        close_files(ai_files)
+    with span("parse"):
+        return parse_ai_response(ai_response)
+
+
+async def acall_ai(ai_data, ai_files, headers):
+    try:
+        with span("ai"):
+            async with upstream_call("chatbot") as call:
+                ai_response = await get_async_client("chatbot").post(
+                    upstream_url("chatbot"),
+                    **request_kwargs(ai_data, ai_files, headers),
+                )
+                call.ok = ai_response.status_code < 500
+    except UpstreamUnavailable as e:
+        raise unavailable_error(e)
+    except httpx.HTTPError as e:
+        raise AIServiceError(
+            {"error": "AI service unreachable", "details": str(e)},
+            status=503,
+        )
+    finally:
+        close_files(ai_files)
+    with span("parse"):
+        return parse_ai_response(ai_response)
+
+
+def queue_voice(ai_message, tts_payload):
+    """
+    Hand TTS synthesis to Celery once the AI message is committed
+    """
+    from .tasks import synthesize_message_voice
+
+    def enqueue():
+        try:
+            synthesize_message_voice.delay(ai_message.id, tts_payload)
+        except OperationalError:
+            logger.error("TTS queue unavailable", extra={"message_id": ai_message.id}, exc_info=True)
+            Message.objects.filter(id=ai_message.id).update(
+                voice_status=Message.VoiceStatus.FAILED
+            )
+
+    transaction.on_commit(enqueue)
+
+
+def new_ai_message(conversation, ai_text, tts_data=None, is_truncated=False):
+    """
+    Build the (unsaved) AI reply. When the AI asked for TTS the message
+    starts with voice_status=pending and the audio is attached later by a
+    Celery task.
+    """
+    wants_voice = bool(tts_data and tts_data.get("enabled"))
+    return Message(
+        conversation=conversation,
+        sender=Message.SenderType.AI,
+        message_type=Message.MessageType.TEXT,
+        text_content=ai_text,
+        voice_status=Message.VoiceStatus.PENDING if wants_voice else Message.VoiceStatus.NONE,
+        is_truncated=is_truncated,
+    )
+
+
+@transaction.atomic
+def save_turn(conversation, user_message, ai_message=None, tts_data=None):
+    """
+    Persist one chat turn in a single transaction: both messages in one
+    INSERT, one summary UPDATE and one Conversation.updated_at bump.
+    When the AI call failed, pass no ai_message to keep the user's message.
+    """
+    messages = [user_message] if ai_message is None else [user_message, ai_message]
+    Message.objects.bulk_create(messages)
+    ConversationSummary.record(*messages)
+    conversation.updated_at = messages[-1].created_at
+    Conversation.objects.filter(pk=conversation.pk).update(updated_at=conversation.updated_at)
+
+    def update_context():
+        for message in messages:
+            context.append(message)
+
+    transaction.on_commit(update_context)
+    if ai_message is not None and ai_message.voice_status == Message.VoiceStatus.PENDING:
+        queue_voice(ai_message, tts_data.get("payload"))
+    return ai_message
+
+
+def build_chat_response(request, conversation, ai_message, ai_json):
+    ai_data_field = AIResponseParser.extract_data(ai_json)
+
+    response_data = {
+        "conversation_id": conversation.id,
+        "response": ai_message.text_content,
+        "message_type": ai_message.message_type,
+        "created_at": ai_message.created_at,
+    }
+
+    # Include data field if present
+    if ai_data_field is not None:
+        response_data["data"] = ai_data_field
+
+    # Voice replies are synthesized in the background; poll voice_status_url
+    if ai_message.voice_status != Message.VoiceStatus.NONE:
+        response_data["message_id"] = ai_message.id
+        response_data["voice_status"] = ai_message.voice_status
+        response_data["voice_status_url"] = request.build_absolute_uri(
+            reverse("chatbot:message_voice", args=[ai_message.id])
+        )
+
+    return response_data
@@ -0,0 +1,208 @@
+"""
+Token-by-token relay of AI replies to the client.
+
+The AI chatbot service is asked to stream (`"stream": true` and an
+`Accept: text/event-stream` header). Each upstream line is either SSE
+(`data: {...}`) or NDJSON; `{"delta": "..."}` events carry tokens and a
+final event may carry `assistant_message`, `data` and `tts`.
+
+The client receives `start`, `delta`, and then `done` or `error` events,
+formatted as Server-Sent Events or JSON lines. The turn (user and AI
+messages) is saved once the stream ends; if the stream breaks after some
+tokens arrived, the partial text is saved with `is_truncated=True`, and if
+none arrived only the user message is kept.
+"""
+import json
+
+import httpx
+from asgiref.sync import sync_to_async
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import StreamingHttpResponse
+
+from .client import get_client, get_async_client, upstream_url
+from .resilience import UpstreamUnavailable, upstream_call
+from .services import (
+    AIResponseParser,
+    unavailable_error,
+    request_kwargs,
+    close_files,
+    new_ai_message,
+    save_turn,
+    build_chat_response,
+)
+
+STREAM_CONTENT_TYPES = {
+    "sse": "text/event-stream",
+    "ndjson": "application/x-ndjson",
+}
+
+
+def parse_stream_line(line):
+    """
+    Decode one upstream line (SSE or NDJSON) into an event dict, or None
+    """
+    line = line.strip()
+    if not line or line.startswith(":") or line.startswith("event:"):
+        return None
+    if line.startswith("data:"):
+        line = line[5:].strip()
+    if line == "[DONE]":
+        return {"done": True}
+    try:
+        event = json.loads(line)
+    except ValueError:
+        return None
+    return event if isinstance(event, dict) else None
+
+
+class ChatStream:
+    """
+    Iterable relay for one chat turn. Iterate it in a sync view, or
+    async-iterate it under ASGI; both save the AI message when done.
+    """
+
+    def __init__(self, request, conversation, user_message, ai_data, ai_files, headers, fmt="sse"):
+        self.request = request
+        self.conversation = conversation
+        self.user_message = user_message
+        self.fmt = fmt
+        self.ai_files = ai_files
+        self.kwargs = request_kwargs(
+            {**ai_data, "stream": True},
+            ai_files,
+            {**headers, "Accept": "text/event-stream"},
+        )
+        self.chunks = []
+        self.final = {}
+        self.saved = False
+
+    def _encode(self, event):
+        payload = json.dumps(event, cls=DjangoJSONEncoder)
+        if self.fmt == "sse":
+            return f"data: {payload}\n\n"
+        return payload + "\n"
+
+    def _feed(self, line):
+        """Record one upstream line; returns the token text to relay, if any"""
+        event = parse_stream_line(line)
+        if event is None:
+            return None
+        delta = event.get("delta")
+        if delta:
+            self.chunks.append(delta)
+            return delta
+        self.final.update({k: v for k, v in event.items() if k != "done"})
+        return None
+
+    def _text(self):
+        return AIResponseParser.extract_text(self.final) or "".join(self.chunks)
+
+    def _start_event(self):
+        return self._encode({"type": "start", "conversation_id": self.conversation.id})
+
+    def _status_error(self, response):
+        return {"error": "AI chatbot error", "details": response.text}
+
+    def _transport_error(self, exc):
+        if self.chunks:
+            return {"error": "AI stream interrupted", "details": str(exc)}
+        return {"error": "AI service unreachable", "details": str(exc)}
+
+    def _save(self, tts_data=None, truncated=False):
+        """Save the turn; a failed stream with no tokens keeps only the user message"""
+        self.saved = True
+        ai_message = None
+        if not truncated or self.chunks:
+            ai_message = new_ai_message(self.conversation, self._text(), tts_data, is_truncated=truncated)
+        return save_turn(self.conversation, self.user_message, ai_message, tts_data)
+
+    def _end_event(self, ai_message, error):
+        if error is None:
+            return self._encode({
+                "type": "done",
+                "message_id": ai_message.id,
+                **build_chat_response(self.request, self.conversation, ai_message, self.final),
+            })
+        event = {"type": "error", "conversation_id": self.conversation.id, **error}
+        if ai_message is not None:
+            event["message_id"] = ai_message.id
+            event["partial_response"] = ai_message.text_content
+        return self._encode(event)
+
+    def __iter__(self):
+        try:
+            yield self._start_event()
+            error = None
+            try:
+                with upstream_call("chatbot") as call, \
+                        get_client("chatbot").stream("POST", upstream_url("chatbot"), **self.kwargs) as response:
+                    call.ok = response.status_code < 500
+                    call.stop()  # latency = time to first byte, not stream length
+                    if response.status_code != 200:
+                        response.read()
+                        error = self._status_error(response)
+                    else:
+                        for line in response.iter_lines():
+                            delta = self._feed(line)
+                            if delta:
+                                yield self._encode({"type": "delta", "text": delta})
+            except UpstreamUnavailable as e:
+                error = unavailable_error(e).payload
+            except httpx.HTTPError as e:
+                error = self._transport_error(e)
+
+            if error is None:
+                ai_message = self._save(AIResponseParser.extract_tts(self.final))
+            else:
+                ai_message = self._save(truncated=True)
+            yield self._end_event(ai_message, error)
+        finally:
+            close_files(self.ai_files)
+            # Client went away mid-stream: keep what was received so far
+            if not self.saved:
+                self._save(truncated=True)
+
+    async def __aiter__(self):
+        try:
+            yield self._start_event()
+            error = None
+            try:
+                client = get_async_client("chatbot")
+                async with upstream_call("chatbot") as call, \
+                        client.stream("POST", upstream_url("chatbot"), **self.kwargs) as response:
+                    call.ok = response.status_code < 500
+                    call.stop()
+                    if response.status_code != 200:
+                        await response.aread()
+                        error = self._status_error(response)
+                    else:
+                        async for line in response.aiter_lines():
+                            delta = self._feed(line)
+                            if delta:
+                                yield self._encode({"type": "delta", "text": delta})
+            except UpstreamUnavailable as e:
+                error = unavailable_error(e).payload
+            except httpx.HTTPError as e:
+                error = self._transport_error(e)
+
+            if error is None:
+                ai_message = await sync_to_async(self._save)(AIResponseParser.extract_tts(self.final))
+            else:
+                ai_message = await sync_to_async(self._save)(truncated=True)
+            yield self._end_event(ai_message, error)
+        finally:
+            close_files(self.ai_files)
+            if not self.saved:
+                await sync_to_async(self._save)(truncated=True)
+
+
+def stream_response(chat_stream, is_async=False):
+    # Django buffers an iterator of the wrong flavour, so pick one explicitly
+    content = chat_stream.__aiter__() if is_async else iter(chat_stream)
+    response = StreamingHttpResponse(
+        content,
+        content_type=STREAM_CONTENT_TYPES[chat_stream.fmt],
+    )
+    response["Cache-Control"] = "no-cache"
+    response["X-Accel-Buffering"] = "no"  # disable nginx buffering
+    return response
@@ -0,0 +1,60 @@
+import time
+
+import httpx
+from celery import shared_task
+
+from . import tts_cache
+from .metrics import TTS_SECONDS
+from .client import get_client, upstream_url
+from .models import Message
+from .resilience import UpstreamUnavailable, upstream_call
+
+
+@shared_task(bind=True, max_retries=2, default_retry_delay=5)
+def synthesize_message_voice(self, message_id, tts_payload):
+    """
+    Generate TTS audio for an AI message and attach it as voice_file.
+    The chat response has already gone out with voice_status=pending.
+    Repeated payloads reuse the cached blob without calling TTS again.
+    """
+    try:
+        message = Message.objects.get(id=message_id)
+    except Message.DoesNotExist:
+        return "Message not found"
+
+    started = time.perf_counter()
+    key = tts_cache.cache_key(tts_payload)
+    entry = tts_cache.lookup(key)
+    if entry is not None:
+        _attach(message, entry)
+        TTS_SECONDS.observe(time.perf_counter() - started, outcome="cached")
+        return f"Voice ready for message {message_id} (cached)"
+
+    try:
+        with upstream_call("tts") as call:
+            tts_resp = get_client("tts").post(upstream_url("tts"), json=tts_payload)
+            call.ok = tts_resp.status_code < 500
+    except (httpx.HTTPError, UpstreamUnavailable) as exc:
+        if self.request.retries < self.max_retries:
+            # Refused by the breaker: retry once it may have closed again
+            raise self.retry(exc=exc, countdown=getattr(exc, "retry_after", None))
+        tts_resp = None
+
+    if tts_resp is None or tts_resp.status_code != 200:
+        Message.objects.filter(id=message_id).update(
+            voice_status=Message.VoiceStatus.FAILED
+        )
+        TTS_SECONDS.observe(time.perf_counter() - started, outcome="failed")
+        return f"TTS failed for message {message_id}"
+
+    _attach(message, tts_cache.store(key, tts_resp.content))
+    TTS_SECONDS.observe(time.perf_counter() - started, outcome="synthesized")
+    return f"Voice ready for message {message_id}"
+
+
+def _attach(message, entry):
+    # Point the message at the shared blob; no per-message copy is stored
+    message.voice_file.name = entry.audio_file.name
+    message.message_type = Message.MessageType.VOICE
+    message.voice_status = Message.VoiceStatus.READY
+    message.save(update_fields=["voice_file", "message_type", "voice_status"])
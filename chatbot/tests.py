@@ -1,3 +1,1211 @@
-from django.test import TestCase
+import io
+import asyncio
+import gzip
+import os
+import json
+import logging
+import time
+import shutil
+import tempfile
+import threading
+import wave
+from array import array
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from PIL import Image
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management.base import CommandError
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import DatabaseError, connection
+from django.test import AsyncClient, TestCase, SimpleTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.response import Response
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from MedAi import log, metrics
+from MedAi.celery import app as celery_app, propagate_request_id
+from MedAi.log import RequestIDFilter
+from users.models import Users
+from .models import Conversation, ConversationSummary, Message, TTSAudio
+from . import audio, context, idempotency, images, ratelimit, resilience, search, services, tts_cache
+from .fake_ai import REPLY_TEXT, FakeAIServer
+from .management.commands import bench_chat_load
+from .streaming import STREAM_CONTENT_TYPES
+
+LOCMEM_CACHES = {
+    "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+}
+
+
+def redis_caches():
+    """
+    A django-redis cache for the Redis-only code paths (Lua scripts, sorted
+    sets): the server at TEST_REDIS_URL if set, otherwise an in-process
+    fakeredis server if that package is installed. None when neither is
+    available.
+    """
+    url = os.environ.get("TEST_REDIS_URL")
+    if url:
+        return {"default": {"BACKEND": "django_redis.cache.RedisCache", "LOCATION": url}}
+    try:
+        import lupa  # noqa: F401  (fakeredis needs it for EVALSHA)
+        from fakeredis import FakeConnection, FakeServer
+    except ImportError:
+        return None
+    return {
+        "default": {
+            "BACKEND": "django_redis.cache.RedisCache",
+            "LOCATION": "redis://fakeredis:6379/0",
+            "OPTIONS": {
+                "CONNECTION_POOL_KWARGS": {"connection_class": FakeConnection, "server": FakeServer()},
+            },
+        },
+    }
+
+
+class CacheBackendMixin:
+    """Run a test class against `caches` (a CACHES setting), cleared per test"""
+
+    caches = LOCMEM_CACHES
+
+    def setUp(self):
+        super().setUp()
+        if self.caches is None:
+            self.skipTest("No Redis: set TEST_REDIS_URL or install fakeredis and lupa")
+        override = override_settings(CACHES=self.caches)
+        override.enable()
+        self.addCleanup(override.disable)
+        cache.clear()
+
+
+def rate_limits(user=None, ip=None, quota=None):
+    return {
+        "enabled": True,
+        "user": {"text": user} if user else {},
+        "ip": {"text": ip} if ip else {},
+        "daily_quota": {"text": quota or 0},
+    }
+
+
+class RateLimitChecks(CacheBackendMixin):
+
+    def check(self, user_id=1, ip="10.0.0.1", kind="text"):
+        return ratelimit.check(kind, user_id, ip)
+
+    def test_uses_expected_backend(self):
+        self.assertEqual(ratelimit._redis_client() is not None, self.caches is not LOCMEM_CACHES)
+
+    def test_burst_then_user_rate(self):
+        with self.settings(CHAT_RATE_LIMIT=rate_limits(user="3/min")):
+            self.assertTrue(all(self.check().allowed for _ in range(3)))
+            decision = self.check()
+        self.assertFalse(decision.allowed)
+        self.assertEqual(decision.reason, "user_rate")
+        self.assertGreater(decision.retry_after, 0)
+        self.assertLessEqual(decision.retry_after, 20)  # one token per 20s
+
+    def test_bucket_refills(self):
+        with self.settings(CHAT_RATE_LIMIT=rate_limits(user="2/s")):
+            self.assertTrue(self.check().allowed)
+            self.assertTrue(self.check().allowed)
+            self.assertFalse(self.check().allowed)
+            time.sleep(0.6)
+            self.assertTrue(self.check().allowed)
+
+    def test_ip_bucket_is_shared_by_users(self):
+        with self.settings(CHAT_RATE_LIMIT=rate_limits(user="10/min", ip="2/min")):
+            self.assertTrue(self.check(user_id=1).allowed)
+            self.assertTrue(self.check(user_id=2).allowed)
+            decision = self.check(user_id=3)
+            self.assertEqual((decision.allowed, decision.reason), (False, "ip_rate"))
+            self.assertTrue(self.check(user_id=3, ip="10.0.0.2").allowed)
+
+    def test_refusal_consumes_nothing(self):
+        with self.settings(CHAT_RATE_LIMIT=rate_limits(user="2/min", ip="1/min", quota=10)):
+            self.assertEqual(self.check(ip="10.0.0.1").quota_used, 1)
+            refused = self.check(ip="10.0.0.1")
+            self.assertEqual((refused.allowed, refused.reason), (False, "ip_rate"))
+            # The refusal took neither a user token nor a quota unit
+            second = self.check(ip="10.0.0.2")
+            self.assertTrue(second.allowed)
+            self.assertEqual(second.quota_used, 2)
+            self.assertEqual(self.check(ip="10.0.0.3").reason, "user_rate")
+
+    def test_daily_quota(self):
+        with self.settings(CHAT_RATE_LIMIT=rate_limits(user="10/min", quota=2)):
+            self.assertEqual([self.check().quota_used for _ in range(2)], [1, 2])
+            decision = self.check()
+            self.assertEqual((decision.allowed, decision.reason), (False, "daily_quota"))
+            self.assertGreater(decision.retry_after, 0)
+            self.assertLessEqual(decision.retry_after, 24 * 60 * 60)
+            # Quotas are per user and per kind
+            self.assertTrue(self.check(user_id=2).allowed)
+            self.assertTrue(self.check(kind="voice").allowed)
+
+
+class LocalRateLimitTests(RateLimitChecks, SimpleTestCase):
+    caches = LOCMEM_CACHES
+
+
+class RedisRateLimitTests(RateLimitChecks, SimpleTestCase):
+    caches = redis_caches()
+
+
+class APITestCase(CacheBackendMixin, TestCase):
+    """API calls as an authenticated patient"""
+
+    def setUp(self):
+        super().setUp()
+        self.user = self.make_user("patient")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def make_user(self, name, **extra):
+        return Users.objects.create_user(f"{name}@example.com", name.capitalize(), is_active=True, **extra)
+
+    def add_message(self, text, conversation=None, sender=Message.SenderType.USER):
+        conversation = conversation or Conversation.objects.create(user=self.user)
+        return Message.objects.create(conversation=conversation, sender=sender, text_content=text)
+
+
+class FakeAITestCase(APITestCase):
+    """Chat views against a local FakeAIServer"""
+
+    server_options = {}
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = FakeAIServer(latency=0, **cls.server_options).start()
+        cls.addClassCleanup(cls.server.stop)
+
+    def setUp(self):
+        super().setUp()
+        override = override_settings(
+            AI_CHATBOT_URL=self.server.url + "/chat",
+            AI_TTS_URL=self.server.url + "/tts",
+        )
+        override.enable()
+        self.addCleanup(override.disable)
+        self.server.reset_stats()
+
+    def chat(self, text="hi", path="/chatbot/chat/", **headers):
+        return self.client.post(path, {"text": text}, headers=headers)
+
+
+class ChatRateLimitViewTests(FakeAITestCase):
+
+    def test_idempotent_retry_is_not_throttled(self):
+        with self.settings(CHAT_RATE_LIMIT=rate_limits(user="1/min")):
+            first = self.chat(**{"Idempotency-Key": "k1"})
+            retry = self.chat(**{"Idempotency-Key": "k1"})
+            other = self.chat()
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(retry.status_code, 200)
+        self.assertEqual(retry["Idempotent-Replayed"], "true")
+        self.assertEqual(other.status_code, 429)
+        self.assertEqual(other.data["reason"], "user_rate")
+        self.assertIn("Retry-After", other)
+
+    def test_rejected_request_is_not_counted(self):
+        for path in ("/chatbot/chat/", "/chatbot/chat/async/"):
+            with self.subTest(path=path), self.settings(CHAT_RATE_LIMIT=rate_limits(user="1/min")):
+                cache.clear()
+                self.assertEqual(self.chat("", path).status_code, 400)
+                self.assertEqual(self.chat("", path).status_code, 400)
+                self.assertEqual(self.chat("hi", path).status_code, 200)
+                self.assertEqual(self.chat("hi", path).status_code, 429)
+
+
+class AsyncChatViewTests(FakeAITestCase):
+    """/chatbot/chat/async/ driven through the ASGI handler"""
+
+    def send(self, *requests):
+        """Run (method, data) requests concurrently; returns the responses"""
+        client = AsyncClient()
+        headers = {"Authorization": f"Bearer {RefreshToken.for_user(self.user).access_token}"}
+
+        async def run():
+            calls = [
+                getattr(client, method)("/chatbot/chat/async/", data, headers=headers)
+                for method, data in requests
+            ]
+            return await asyncio.gather(*calls)
+
+        return async_to_sync(run)()
+
+    def test_chat(self):
+        [response] = self.send(("post", {"text": "hi"}))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["response"], REPLY_TEXT)
+        self.assertEqual(Message.objects.count(), 2)
+
+    def test_other_methods_are_not_allowed(self):
+        [response] = self.send(("get", {}))
+        self.assertEqual(response.status_code, 405)
+
+    def test_rate_limited(self):
+        with self.settings(CHAT_RATE_LIMIT=rate_limits(user="1/min")):
+            first, second = self.send(("post", {"text": "hi"}), ("post", {"text": "again"}))
+        self.assertEqual(sorted([first.status_code, second.status_code]), [200, 429])
+        throttled = first if first.status_code == 429 else second
+        self.assertIn("Retry-After", throttled)
+        self.assertEqual(throttled.json()["reason"], "user_rate")
+
+    def test_upstream_calls_overlap(self):
+        self.server.latency = 0.3
+        self.addCleanup(setattr, self.server, "latency", 0)
+        responses = self.send(*[("post", {"text": f"hi {i}"}) for i in range(3)])
+        self.assertEqual([r.status_code for r in responses], [200] * 3)
+        self.assertEqual(self.server.peak_in_flight, 3)
+
+
+def upstream_settings(**options):
+    return {"chatbot": {"initial_limit": 2, "min_limit": 2, "max_limit": 2, **options}}
+
+
+class UpstreamPermitChecks(CacheBackendMixin):
+
+    def guard(self, **options):
+        with self.settings(AI_RESILIENCE=upstream_settings(**options)):
+            return resilience.UpstreamGuard("chatbot")
+
+    def test_concurrency_limit(self):
+        guard = self.guard()
+        first, second = guard.acquire(), guard.acquire()
+        with self.assertRaises(resilience.UpstreamUnavailable) as refused:
+            guard.acquire()
+        self.assertEqual(refused.exception.reason, "concurrency_limit")
+        self.assertEqual(guard.stats()["in_flight"], 2)
+
+        guard.release(first, ok=True)
+        self.assertEqual(guard.stats()["in_flight"], 1)
+        guard.release(guard.acquire(), ok=True)
+        guard.release(second, ok=True)
+        self.assertEqual(guard.stats()["in_flight"], 0)
+
+    def test_expired_permits_free_their_slot(self):
+        guard = self.guard(call_timeout=1)
+        stale = [guard.acquire(), guard.acquire()]
+        time.sleep(1.1)
+        self.assertEqual(guard.stats()["in_flight"], 0)
+
+        fresh = [guard.acquire(), guard.acquire()]
+        # Late releases of the expired calls must not free the new calls' slots
+        for permit in stale:
+            guard.release(permit, ok=True)
+        self.assertEqual(guard.stats()["in_flight"], 2)
+        with self.assertRaises(resilience.UpstreamUnavailable):
+            guard.acquire()
+        for permit in fresh:
+            guard.release(permit, ok=True)
+
+
+class LocalUpstreamPermitTests(UpstreamPermitChecks, SimpleTestCase):
+    caches = LOCMEM_CACHES
+
+
+class RedisUpstreamPermitTests(UpstreamPermitChecks, SimpleTestCase):
+    caches = redis_caches()
+
+
+@override_settings(CACHES={
+    "default": {"BACKEND": "django_redis.cache.RedisCache", "LOCATION": "redis://127.0.0.1:1/0"},
+})
+class UpstreamGuardOutageTests(SimpleTestCase):
+
+    def test_calls_pass_when_the_cache_is_down(self):
+        with self.settings(AI_RESILIENCE=upstream_settings()):
+            with resilience.upstream_call("chatbot") as call:
+                call.ok = False
+        self.assertIsNone(call.permit[2])
+
+
+class CircuitBreakerTests(FakeAITestCase):
+    server_options = {"status": 503}
+
+    def test_breaker_opens_and_recovers(self):
+        breaker = upstream_settings(failure_threshold=2, reset_timeout=1)
+        with self.settings(AI_RESILIENCE=breaker):
+            failures = [self.chat() for _ in range(2)]
+            self.assertTrue(all(response.status_code >= 500 for response in failures))
+
+            refused = self.chat()
+            self.assertEqual(refused.status_code, 503)
+            self.assertEqual(refused.data["reason"], "circuit_open")
+            self.assertEqual(self.server.total_requests, 2)  # refused without a call
+
+            self.server.status = 200
+            time.sleep(1.1)
+            self.assertEqual(self.chat().status_code, 200)  # the half-open probe
+            self.assertEqual(resilience.UpstreamGuard("chatbot").state(), resilience.CLOSED)
+
+
+def wav_upload(frames, rate=48000, channels=2, name="voice.wav"):
+    """A 16-bit PCM WAV upload; frames is a list of per-channel sample tuples"""
+    samples = array("h", (sample for frame in frames for sample in frame))
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as output:
+        output.setnchannels(channels)
+        output.setsampwidth(2)
+        output.setframerate(rate)
+        output.writeframes(samples.tobytes())
+    return SimpleUploadedFile(name, buffer.getvalue(), content_type="audio/wav")
+
+
+class WaveAudioProcessorTests(SimpleTestCase):
+    config = {"sample_rate": 16000, "max_seconds": 2, "silence_threshold_db": -45}
+
+    def process(self, upload):
+        result = audio.WaveAudioProcessor(self.config).process(upload)
+        result.seek(0)
+        with wave.open(result, "rb") as output:
+            params = (output.getnchannels(), output.getframerate())
+            samples = array("h", output.readframes(output.getnframes()))
+        return result, params, samples
+
+    def test_downmix_resample_and_trim(self):
+        silence, tone = (0, 0), (1000, 3000)
+        frames = [silence] * 4800 + [tone] * 48000 + [silence] * 9600  # 0.1s, 1s, 0.2s
+        result, params, samples = self.process(wav_upload(frames))
+        self.assertEqual(params, (1, 16000))
+        self.assertEqual(len(samples), 16000)
+        self.assertEqual(set(samples), {2000})
+        self.assertEqual((result.name, result.content_type), ("voice.wav", "audio/wav"))
+
+    def test_caps_duration(self):
+        _, _, samples = self.process(wav_upload([(1000,)] * 16000 * 5, rate=16000, channels=1))
+        self.assertEqual(len(samples), 16000 * self.config["max_seconds"])
+
+    def test_silence_only(self):
+        _, _, samples = self.process(wav_upload([(3,)] * 16000, rate=16000, channels=1))
+        self.assertEqual(len(samples), 0)
+
+    def test_other_formats_pass_through(self):
+        upload = SimpleUploadedFile("voice.ogg", b"OggS not a wav", content_type="audio/ogg")
+        self.assertIs(audio.WaveAudioProcessor(self.config).process(upload), upload)
+        self.assertEqual(upload.tell(), 0)
+
+
+class MessageSearchTests(APITestCase):
+
+    def search(self, query):
+        response = self.client.get("/chatbot/search/", {"q": query})
+        self.assertEqual(response.status_code, 200)
+        return [result["id"] for result in response.data["results"]]
+
+    def test_finds_the_users_messages(self):
+        older = self.add_message("High fever since Monday")
+        newer = self.add_message("The fever is gone", conversation=older.conversation)
+        self.add_message("Only a headache")
+        other = self.make_user("other")
+        Message.objects.create(
+            conversation=Conversation.objects.create(user=other), sender="user", text_content="fever too",
+        )
+        self.assertEqual(self.search("fever"), [newer.id, older.id])
+        self.assertEqual(self.search("gone FEVER"), [newer.id])
+        self.assertEqual(self.client.get("/chatbot/search/").status_code, 400)
+
+    def test_edits_and_deletes_are_reflected(self):
+        edited = self.add_message("Mild cough")
+        deleted = self.add_message("Dry cough at night")
+        Message.objects.filter(pk=edited.pk).update(text_content="Mild rash")
+        deleted.delete()
+        self.assertEqual(self.search("cough"), [])
+        self.assertEqual(self.search("rash"), [edited.id])
+
+    def test_scans_when_triggers_are_missing(self):
+        if connection.vendor != "sqlite" or not search._fts_ready():
+            self.skipTest("SQLite FTS5 index not in use")
+        message = self.add_message("Mild cough")
+        with connection.cursor() as cursor:
+            cursor.execute("DROP TRIGGER chatbot_message_fts_au")
+        Message.objects.filter(pk=message.pk).update(text_content="Mild rash")
+        self.assertFalse(search._fts_ready())
+        self.assertEqual(self.search("rash"), [message.id])
+        self.assertEqual(self.search("cough"), [])
+
+
+class ChatHistoryTests(APITestCase):
+
+    def add_conversation(self, text):
+        message = self.add_message(text)
+        ConversationSummary.record(message)
+        return message.conversation
+
+    def history(self):
+        response = self.client.get("/chatbot/history/")
+        self.assertEqual(response.status_code, 200)
+        return response.data["results"]
+
+    def test_conversation_without_summary(self):
+        bare = Conversation.objects.create(user=self.user)  # e.g. created in the admin
+        summarized = self.add_conversation("Headache again")
+        results = {result["id"]: result for result in self.history()}
+        self.assertEqual(
+            (results[bare.id]["message_count"], results[bare.id]["latest_message"]), (0, None)
+        )
+        self.assertEqual(results[summarized.id]["message_count"], 1)
+        self.assertEqual(results[summarized.id]["latest_message"]["text"], "Headache again")
+        self.assertTrue(results[summarized.id]["has_unpaired_user_message"])
+
+    def test_query_count_does_not_grow_with_page(self):
+        def queries():
+            with CaptureQueriesContext(connection) as captured:
+                self.history()
+            return len(captured)
+
+        self.add_conversation("first")
+        few = queries()
+        for i in range(10):
+            self.add_conversation(f"more {i}")
+        Conversation.objects.create(user=self.user)
+        self.assertEqual(len(self.history()), 12)
+        self.assertEqual(queries(), few)
+
+    def walk(self, path, **params):
+        """Ids of every page, following the next cursor"""
+        pages = []
+        response = self.client.get(path, {"page_size": 2, **params})
+        while True:
+            self.assertEqual(response.status_code, 200)
+            pages.append([result["id"] for result in response.data["results"]])
+            if not response.data["next"]:
+                return pages
+            response = self.client.get(response.data["next"])
+
+    def test_cursor_pages_are_stable(self):
+        conversations = [self.add_conversation(f"chat {i}") for i in range(5)]
+        # Tied timestamps fall back to the id
+        Conversation.objects.filter(id__in=[c.id for c in conversations[:3]]).update(
+            updated_at=conversations[0].updated_at
+        )
+        pages = self.walk("/chatbot/history/")
+        ids = [id for page in pages for id in page]
+        self.assertEqual([len(page) for page in pages], [2, 2, 1])
+        self.assertEqual(ids, list(
+            Conversation.objects.order_by("-updated_at", "-id").values_list("id", flat=True)
+        ))
+
+    def test_new_conversation_does_not_shift_pages(self):
+        for i in range(4):
+            self.add_conversation(f"chat {i}")
+        first = self.client.get("/chatbot/history/", {"page_size": 2}).data
+        self.add_conversation("arrived while paging")
+        second = self.client.get(first["next"]).data
+
+        ids = [result["id"] for result in first["results"] + second["results"]]
+        self.assertEqual(len(set(ids)), 4)
+        self.assertIsNone(second["next"])
+
+    def test_message_pages(self):
+        conversation = Conversation.objects.create(user=self.user)
+        messages = [self.add_message(f"message {i}", conversation) for i in range(5)]
+        path = f"/chatbot/history/{conversation.id}/messages/"
+        pages = self.walk(path)
+        self.assertEqual([id for page in pages for id in page], [m.id for m in reversed(messages)])
+
+        self.client.force_authenticate(self.make_user("other"))
+        self.assertEqual(self.client.get(path).status_code, 404)
+
+
+class ChatExportTests(APITestCase):
+
+    def export(self, **params):
+        response = self.client.get("/chatbot/history/export/", params)
+        if response.status_code != 200:
+            return response, None
+        body = b"".join(response.streaming_content)
+        if params.get("compress") == "gzip":
+            body = gzip.decompress(body)
+        return response, [json.loads(line) for line in body.decode().splitlines()]
+
+    def test_ndjson(self):
+        conversation = self.add_message("Fever since Monday").conversation
+        self.add_message("Drink fluids", conversation, Message.SenderType.AI)
+        self.add_message("someone else's", Conversation.objects.create(user=self.make_user("other")))
+
+        response, rows = self.export()
+        self.assertEqual(response["Content-Type"], "application/x-ndjson")
+        self.assertIn(f'chat_export_{self.user.id}.ndjson"', response["Content-Disposition"])
+        self.assertEqual(
+            [(row["user_id"], row["sender"], row["text_content"]) for row in rows],
+            [(self.user.id, "user", "Fever since Monday"), (self.user.id, "ai", "Drink fluids")],
+        )
+
+    def test_gzip(self):
+        for i in range(2000):  # several 64 KB chunks
+            self.add_message(f"message {i} " + "x" * 40)
+        response, rows = self.export(compress="gzip")
+        self.assertEqual(response["Content-Type"], "application/gzip")
+        self.assertTrue(response["Content-Disposition"].endswith('.ndjson.gz"'))
+        self.assertEqual(len(rows), 2000)
+        self.assertEqual(rows[-1]["text_content"], "message 1999 " + "x" * 40)
+
+    def test_other_users_need_a_superuser(self):
+        patient = self.make_user("other")
+        self.add_message("private", Conversation.objects.create(user=patient))
+
+        response, _ = self.export(user_id=patient.id)
+        self.assertEqual(response.status_code, 403)
+
+        self.client.force_authenticate(self.make_user("admin", is_superuser=True, is_staff=True))
+        _, rows = self.export(user_id=patient.id)
+        self.assertEqual([row["text_content"] for row in rows], ["private"])
+        self.assertEqual(self.export(user_id="abc")[0].status_code, 400)
+        self.assertEqual(self.export(user_id=patient.id + 100)[0].status_code, 404)
+
+
+class ContextWindowTests(APITestCase):
+
+    def cached(self, conversation):
+        return cache.get(context._key(conversation.id))
+
+    def chat_turn(self, conversation, text):
+        with self.captureOnCommitCallbacks(execute=True):  # the window updates on commit
+            services.save_turn(
+                conversation,
+                services.prepare_user_message(conversation, {"text": text}),
+                services.new_ai_message(conversation, f"re: {text}"),
+            )
+
+    def test_saved_turns_extend_the_window(self):
+        conversation = services.get_conversation(self.user, None)
+        self.chat_turn(conversation, "first")
+        self.assertEqual(context.get_window(conversation.id), [
+            {"role": "user", "content": "first"},
+            {"role": "assistant", "content": "re: first"},
+        ])
+        self.chat_turn(conversation, "second")
+        self.assertEqual(
+            [entry["content"] for entry in self.cached(conversation)],
+            ["first", "re: first", "second", "re: second"],
+        )
+
+    @override_settings(CHAT_CONTEXT_WINDOW={"max_turns": 1, "max_tokens": 2000, "timeout": 60})
+    def test_window_is_trimmed(self):
+        conversation = services.get_conversation(self.user, None)
+        for text in ("first", "second"):
+            self.chat_turn(conversation, text)
+        self.assertEqual(
+            [entry["content"] for entry in context.get_window(conversation.id)],
+            ["second", "re: second"],
+        )
+
+    def test_clear_and_delete_drop_the_window(self):
+        kept, deleted = (services.get_conversation(self.user, None) for _ in range(2))
+        for conversation in (kept, deleted):
+            self.chat_turn(conversation, "hello")
+            context.get_window(conversation.id)
+
+        self.client.delete(f"/chatbot/history/{deleted.id}/delete/")
+        self.assertIsNone(self.cached(deleted))
+        self.assertIsNotNone(self.cached(kept))
+
+        self.client.delete("/chatbot/history/clear/")
+        self.assertIsNone(self.cached(kept))
+
+    def test_cache_outage_reads_the_db(self):
+        conversation = services.get_conversation(self.user, None)
+        self.chat_turn(conversation, "hello")
+        with mock.patch.object(context.cache, "get", side_effect=ConnectionError):
+            self.assertEqual(len(context.get_window(conversation.id)), 2)
+
+
+class MetricsChecks(CacheBackendMixin):
+
+    def setUp(self):
+        super().setUp()
+        metrics.flush()  # observations left over from earlier tests
+        cache.clear()
+
+    def test_histogram_rendering(self):
+        for seconds in (0.003, 0.003, 2.0):
+            metrics.REQUEST_STAGE_SECONDS.observe(seconds, view="test", stage="total")
+        metrics.REQUEST_STAGE_SECONDS.observe(0.02, view="test", stage="save")
+        lines = set(metrics.render().splitlines())
+
+        series = 'request_stage_seconds_{}{{view="test",stage="total"{}}} {}'
+        self.assertIn("# TYPE request_stage_seconds histogram", lines)
+        self.assertIn(series.format("bucket", ',le="0.0025"', 0), lines)
+        self.assertIn(series.format("bucket", ',le="0.005"', 2), lines)
+        self.assertIn(series.format("bucket", ',le="1.0"', 2), lines)
+        self.assertIn(series.format("bucket", ',le="2.5"', 3), lines)
+        self.assertIn(series.format("bucket", ',le="+Inf"', 3), lines)
+        self.assertIn(series.format("count", "", 3), lines)
+        self.assertIn(series.format("sum", "", 2.006), lines)
+        self.assertIn('request_stage_seconds_count{view="test",stage="save"} 1', lines)
+
+    def test_flushes_accumulate(self):
+        metrics.REQUEST_STAGE_SECONDS.observe(0.1, view="test", stage="total")
+        metrics.flush()
+        metrics.REQUEST_STAGE_SECONDS.observe(0.1, view="test", stage="total")
+        self.assertIn('request_stage_seconds_count{view="test",stage="total"} 2', metrics.render())
+
+
+class LocalMetricsTests(MetricsChecks, TestCase):
+    caches = LOCMEM_CACHES
+
+
+class RedisMetricsTests(MetricsChecks, TestCase):
+    caches = redis_caches()
+
+
+class MetricsViewTests(FakeAITestCase):
+
+    def test_server_timing(self):
+        response = self.chat()
+        self.assertEqual(response.status_code, 200)
+        stages = [entry.split(";")[0] for entry in response["Server-Timing"].split(", ")]
+        self.assertIn("validate", stages)
+        self.assertEqual(stages[-1], "total")
+        with self.settings(METRICS={**settings.METRICS, "server_timing": False}):
+            self.assertNotIn("Server-Timing", self.chat())
+
+    def test_requires_token(self):
+        with self.settings(METRICS={**settings.METRICS, "token": ""}):
+            self.assertEqual(self.client.get("/metrics").status_code, 404)
+        with self.settings(METRICS={**settings.METRICS, "token": "secret"}):
+            self.assertEqual(self.client.get("/metrics").status_code, 401)
+            self.assertEqual(
+                self.client.get("/metrics", headers={"Authorization": "Bearer wrong"}).status_code, 401
+            )
+            self.chat()
+            response = self.client.get("/metrics", headers={"Authorization": "Bearer secret"})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'request_stage_seconds_count{view="chat",stage="total"}', response.content)
+        self.assertIn(b"# TYPE upstream_circuit_state gauge", response.content)
+
+
+class RecordingHandler(logging.Handler):
+    """Keeps records, tagged with the request ID like the console handler"""
+
+    def __init__(self):
+        super().__init__()
+        self.records = []
+        self.addFilter(RequestIDFilter())
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+@override_settings(LOG_SAMPLE_RATES={})
+class RequestIDLoggingTests(FakeAITestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.handler = RecordingHandler()
+        for name in ("chatbot", "django.request"):
+            logger = logging.getLogger(name)
+            logger.addHandler(self.handler)
+            self.addCleanup(logger.removeHandler, self.handler)
+
+    def ids(self, logger_name):
+        return {r.request_id for r in self.handler.records if r.name == logger_name}
+
+    def test_caller_id_is_echoed_and_logged(self):
+        response = self.chat(**{"X-Request-ID": "trace-123"})
+        self.assertEqual(response["X-Request-ID"], "trace-123")
+        self.assertEqual(self.ids("chatbot.ai"), {"trace-123"})
+        self.assertEqual(log.request_id.get(), "-")  # reset after the request
+
+    def test_invalid_id_is_replaced(self):
+        response = self.chat(**{"X-Request-ID": "bad id!" + "x" * 80})
+        self.assertRegex(response["X-Request-ID"], r"^[0-9a-f]{32}$")
+        self.assertEqual(self.ids("chatbot.ai"), {response["X-Request-ID"]})
+
+    def test_error_responses_carry_the_id(self):
+        # django.request logs 4xx after the middleware has reset the ID
+        response = self.client.get("/chatbot/history/999/", headers={"X-Request-ID": "lost-1"})
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(self.ids("django.request"), {"lost-1"})
+
+    def test_task_logs_under_the_queuing_request(self):
+        headers = {}
+        token = log.request_id.set("queued-7")
+        try:
+            propagate_request_id(headers=headers)
+        finally:
+            log.request_id.reset(token)
+        self.assertEqual(headers, {"request_id": "queued-7"})
+
+
+class LogFormatTests(SimpleTestCase):
+
+    def test_json_lines_keep_extra_fields(self):
+        record = logging.makeLogRecord({
+            "name": "chatbot.ai", "levelno": logging.INFO, "levelname": "INFO",
+            "msg": "AI chatbot response %s", "args": (200,), "request_id": "r-1", "elapsed_ms": 12,
+        })
+        entry = json.loads(log.JSONFormatter().format(record))
+        self.assertEqual(
+            {key: entry[key] for key in ("logger", "level", "msg", "request_id", "elapsed_ms")},
+            {"logger": "chatbot.ai", "level": "INFO", "msg": "AI chatbot response 200",
+             "request_id": "r-1", "elapsed_ms": 12},
+        )
+
+    def test_sampling_keeps_warnings(self):
+        logger = log.get_logger("chatbot.test", rate=0.0)
+        logger.logger.setLevel(logging.INFO)
+        self.addCleanup(logger.logger.setLevel, logging.NOTSET)
+        self.assertFalse(logger.isEnabledFor(logging.INFO))
+        self.assertTrue(logger.isEnabledFor(logging.WARNING))
+
+
+class IdempotencyTests(FakeAITestCase):
+
+    def test_retry_replays_the_first_response(self):
+        first = self.chat("hi", **{"Idempotency-Key": "k1"})
+        retry = self.chat("hi", **{"Idempotency-Key": "k1"})
+        self.assertEqual(first.status_code, 200)
+        self.assertNotIn("Idempotent-Replayed", first)
+        self.assertEqual((retry.status_code, retry["Idempotent-Replayed"]), (200, "true"))
+        self.assertEqual(retry.data, first.data)
+        self.assertEqual(self.server.total_requests, 1)
+        self.assertEqual(Message.objects.count(), 2)  # one user message, one reply
+
+        # Keys are per user
+        self.client.force_authenticate(self.make_user("other"))
+        self.assertNotIn("Idempotent-Replayed", self.chat("hi", **{"Idempotency-Key": "k1"}))
+
+    def test_async_view_replays(self):
+        first = self.chat("hi", "/chatbot/chat/async/", **{"Idempotency-Key": "k1"})
+        retry = self.chat("hi", "/chatbot/chat/async/", **{"Idempotency-Key": "k1"})
+        self.assertEqual((retry.status_code, retry["Idempotent-Replayed"]), (200, "true"))
+        self.assertEqual(retry.data, first.data)
+        self.assertEqual(self.server.total_requests, 1)
+
+    def test_key_reused_for_another_body(self):
+        self.chat("hi", **{"Idempotency-Key": "k1"})
+        response = self.chat("bye", **{"Idempotency-Key": "k1"})
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(self.server.total_requests, 1)
+
+    def test_server_errors_are_not_stored(self):
+        self.server.status = 503
+        self.addCleanup(setattr, self.server, "status", 200)
+        failed = self.chat("hi", **{"Idempotency-Key": "k1"})
+        self.assertGreaterEqual(failed.status_code, 500)
+
+        self.server.status = 200
+        retry = self.chat("hi", **{"Idempotency-Key": "k1"})
+        self.assertEqual(retry.status_code, 200)
+        self.assertNotIn("Idempotent-Replayed", retry)
+        self.assertEqual(self.server.total_requests, 2)
+
+    def test_duplicate_waits_for_the_request_in_flight(self):
+        in_flight = idempotency.IdempotentRequest(self.user.id, "k1", {"text": "hi"})
+        self.assertIsNone(in_flight.claim())
+
+        with self.settings(CHAT_IDEMPOTENCY={**settings.CHAT_IDEMPOTENCY, "wait_timeout": 0.3}):
+            self.assertEqual(self.chat("hi", **{"Idempotency-Key": "k1"}).status_code, 409)
+
+            # The original finishes while the duplicate is waiting
+            finish = threading.Timer(0.1, in_flight.finish, [Response({"response": "done"}, status=200)])
+            finish.start()
+            self.addCleanup(finish.join)
+            duplicate = self.chat("hi", **{"Idempotency-Key": "k1"})
+        self.assertEqual((duplicate.status_code, duplicate.data), (200, {"response": "done"}))
+        self.assertEqual(duplicate["Idempotent-Replayed"], "true")
+        self.assertEqual(self.server.total_requests, 0)
+
+    def test_key_length_is_limited(self):
+        response = self.chat("hi", **{"Idempotency-Key": "k" * 256})
+        self.assertEqual(response.status_code, 400)
+
+
+class ChatStreamTests(FakeAITestCase):
+    server_options = {"token_delay": 0}
+
+    def stream(self, fmt="sse", path="/chatbot/chat/"):
+        """The streamed response's events; async views are read as under ASGI"""
+        data = {"text": "hi", "stream": fmt}
+        if "async" in path:
+            token = RefreshToken.for_user(self.user).access_token
+
+            async def read():
+                response = await AsyncClient().post(path, data, headers={"Authorization": f"Bearer {token}"})
+                return response, [chunk async for chunk in response.streaming_content]
+
+            response, chunks = async_to_sync(read)()
+        else:
+            response = self.client.post(path, data)
+            chunks = list(response.streaming_content)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], STREAM_CONTENT_TYPES[fmt])
+        return self.events(chunks, fmt)
+
+    def events(self, chunks, fmt="sse"):
+        body = b"".join(chunks).decode()
+        if fmt == "sse":
+            return [json.loads(event.removeprefix("data: ")) for event in body.split("\n\n") if event]
+        return [json.loads(line) for line in body.splitlines()]
+
+    def replies(self):
+        return list(Message.objects.filter(sender=Message.SenderType.AI).values_list("text_content", "is_truncated"))
+
+    def test_completed_stream_saves_one_turn(self):
+        for fmt in ("sse", "ndjson"):
+            for path in ("/chatbot/chat/", "/chatbot/chat/async/"):
+                with self.subTest(fmt=fmt, path=path):
+                    Message.objects.all().delete()
+                    events = self.stream(fmt, path)
+                    self.assertEqual(events[0]["type"], "start")
+                    deltas = [event["text"] for event in events if event["type"] == "delta"]
+                    self.assertEqual("".join(deltas), REPLY_TEXT + " ")
+                    self.assertEqual(events[-1]["type"], "done")
+                    self.assertEqual(self.replies(), [(REPLY_TEXT, False)])
+                    self.assertEqual(Message.objects.filter(sender=Message.SenderType.USER).count(), 1)
+                    self.assertEqual(events[-1]["message_id"], Message.objects.get(sender="ai").id)
+
+    def test_upstream_error_keeps_the_user_message(self):
+        self.server.status = 503
+        self.addCleanup(setattr, self.server, "status", 200)
+        events = self.stream()
+        self.assertEqual([event["type"] for event in events], ["start", "error"])
+        self.assertEqual(self.replies(), [])
+        self.assertEqual(Message.objects.count(), 1)
+
+    def test_broken_stream_saves_a_partial(self):
+        self.server.drop_after = 2
+        self.addCleanup(setattr, self.server, "drop_after", None)
+        for path in ("/chatbot/chat/", "/chatbot/chat/async/"):
+            with self.subTest(path=path):
+                Message.objects.all().delete()
+                events = self.stream("ndjson", path)
+                self.assertEqual(events[-1]["type"], "error")
+                self.assertEqual(events[-1]["partial_response"], "This is ")
+                self.assertEqual(self.replies(), [("This is ", True)])
+
+    def test_client_disconnect_saves_a_partial(self):
+        response = self.client.post("/chatbot/chat/", {"text": "hi", "stream": "sse"})
+        content = iter(response.streaming_content)
+        received = self.events([next(content) for _ in range(3)])  # start and two tokens
+        self.assertEqual([event["type"] for event in received], ["start", "delta", "delta"])
+        response.close()
+        self.assertEqual(self.replies(), [("This is ", True)])
+        self.assertEqual(Message.objects.count(), 2)
+
+
+class SaveTurnTests(APITestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.conversation = services.get_conversation(self.user, None)
+
+    def turn(self, text="hi", reply="hello"):
+        return (
+            self.conversation,
+            services.prepare_user_message(self.conversation, {"text": text}),
+            services.new_ai_message(self.conversation, reply),
+        )
+
+    def test_one_transaction_three_statements(self):
+        with CaptureQueriesContext(connection) as captured:
+            services.save_turn(*self.turn())
+        statements = [query["sql"] for query in captured]
+        self.assertTrue(statements[0].startswith("SAVEPOINT"))  # atomic (nested in the test's transaction)
+        self.assertTrue(statements[-1].startswith("RELEASE SAVEPOINT"))
+        # Both messages in one INSERT, the summary UPDATE, the updated_at bump
+        self.assertEqual(len(statements) - 2, 3)
+
+        summary = ConversationSummary.objects.get(pk=self.conversation.pk)
+        self.assertEqual((summary.message_count, summary.last_message_text), (2, "hello"))
+        self.assertFalse(summary.has_unpaired_user_message)
+
+    def test_failure_rolls_back_the_whole_turn(self):
+        services.save_turn(*self.turn("first", "reply"))
+        updated_at = Conversation.objects.get(pk=self.conversation.pk).updated_at
+
+        with mock.patch.object(Conversation.objects, "filter", side_effect=DatabaseError("boom")):
+            with self.assertRaises(DatabaseError):
+                services.save_turn(*self.turn("second", "lost"))
+
+        self.assertEqual(
+            list(Message.objects.values_list("text_content", flat=True).order_by("id")), ["first", "reply"]
+        )
+        summary = ConversationSummary.objects.get(pk=self.conversation.pk)
+        self.assertEqual((summary.message_count, summary.last_message_text), (2, "reply"))
+        self.assertEqual(Conversation.objects.get(pk=self.conversation.pk).updated_at, updated_at)
+
+    def test_failed_ai_call_keeps_the_user_message(self):
+        conversation, user_message, _ = self.turn("only me")
+        self.assertIsNone(services.save_turn(conversation, user_message))
+        summary = ConversationSummary.objects.get(pk=self.conversation.pk)
+        self.assertEqual(summary.message_count, 1)
+        self.assertTrue(summary.has_unpaired_user_message)
+
+
+class MediaRootMixin:
+    """Uploads and generated files go to a temporary MEDIA_ROOT"""
+
+    def setUp(self):
+        super().setUp()
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        override = override_settings(MEDIA_ROOT=media_root)
+        override.enable()
+        self.addCleanup(override.disable)
+
+
+class VoiceReplyTests(MediaRootMixin, FakeAITestCase):
+    server_options = {"tts": True, "tts_bytes": 100}
+
+    def setUp(self):
+        super().setUp()
+        # CELERY_TASK_ALWAYS_EAGER; Celery read the Django settings at startup
+        self.addCleanup(setattr, celery_app.conf, "task_always_eager", celery_app.conf.task_always_eager)
+        celery_app.conf.task_always_eager = True
+
+    def voice_chat(self):
+        """A chat whose TTS task runs (eagerly) once the turn commits"""
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.chat()
+            self.assertEqual(response.data["voice_status"], "pending")
+            message = Message.objects.get(pk=response.data["message_id"])
+            self.assertEqual(message.voice_status, Message.VoiceStatus.PENDING)
+        message.refresh_from_db()
+        return response, message
+
+    def test_voice_becomes_ready(self):
+        response, message = self.voice_chat()
+        self.assertEqual(message.voice_status, Message.VoiceStatus.READY)
+        self.assertEqual(message.message_type, Message.MessageType.VOICE)
+        self.assertEqual(message.voice_file.size, 102)
+
+        status = self.client.get(response.data["voice_status_url"])
+        self.assertEqual(status.data["voice_status"], "ready")
+
+    def test_repeated_reply_reuses_the_cached_audio(self):
+        _, first = self.voice_chat()
+        _, second = self.voice_chat()
+        self.assertEqual(second.voice_status, Message.VoiceStatus.READY)
+        self.assertEqual(second.voice_file.name, first.voice_file.name)
+        self.assertEqual(TTSAudio.objects.get().hits, 1)
+        self.assertEqual(self.server.total_requests, 3)  # two chats, one TTS call
+        self.assertEqual((tts_cache.stats()["hits"], tts_cache.stats()["misses"]), (1, 1))
+
+    def test_tts_failure(self):
+        self.addCleanup(setattr, self.server, "status", 200)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.chat()
+            self.server.status = 503  # the chat went through; TTS fails
+        message = Message.objects.get(pk=response.data["message_id"])
+        self.assertEqual(message.voice_status, Message.VoiceStatus.FAILED)
+        self.assertFalse(message.voice_file)
+        self.assertFalse(TTSAudio.objects.exists())
+
+
+def photo(size=(3000, 2000), orientation=None, fmt="JPEG", name="photo.jpg"):
+    """An upload of a solid-colour image, optionally with EXIF tags"""
+    exif = Image.Exif()
+    exif[0x010F] = "PhoneMaker"  # Make
+    if orientation:
+        exif[0x0112] = orientation
+    buffer = io.BytesIO()
+    Image.new("RGB", size, (200, 30, 30)).save(buffer, fmt, exif=exif)
+    return SimpleUploadedFile(name, buffer.getvalue(), content_type=f"image/{fmt.lower()}")
+
+
+@override_settings(CHAT_IMAGE={**settings.CHAT_IMAGE, "enabled": False})
+class UploadForwardingTests(MediaRootMixin, FakeAITestCase):
+    """Uploads are stored once and streamed to the AI from storage"""
+
+    def test_stored_file_is_streamed_and_closed(self):
+        buffer = io.BytesIO()
+        Image.frombytes("RGB", (600, 600), os.urandom(600 * 600 * 3)).save(buffer, "PNG")
+        data = buffer.getvalue()  # ~1 MB, incompressible
+
+        opened = []
+
+        def capture(*args):
+            ai_data, ai_files = services.build_ai_request(*args)
+            opened.extend(fileobj for _name, fileobj, _type in ai_files.values())
+            return ai_data, ai_files
+
+        upload = SimpleUploadedFile("scan.png", data, content_type="image/png")
+        with mock.patch("chatbot.views.build_ai_request", side_effect=capture):
+            response = self.client.post("/chatbot/chat/", {"file": upload})
+        self.assertEqual(response.status_code, 200)
+
+        message = Message.objects.get(sender=Message.SenderType.USER)
+        with message.image_file.open("rb") as stored:
+            self.assertEqual(stored.read(), data)
+        [fileobj] = opened
+        self.assertEqual(fileobj.name, message.image_file.name)  # the stored file, not the upload
+        self.assertTrue(fileobj.closed)
+        self.assertGreater(self.server.bytes_received, len(data))
+
+
+@override_settings(CHAT_IMAGE={**settings.CHAT_IMAGE, "enabled": True, "max_dimension": 1600, "format": "WEBP"})
+class ImagePreprocessTests(MediaRootMixin, FakeAITestCase):
+
+    def test_resized_rotated_and_stripped(self):
+        upload = images.preprocess(photo(orientation=6))  # shot in portrait
+        self.assertEqual((upload.name, upload.content_type), ("photo.webp", "image/webp"))
+        with Image.open(upload) as image:
+            self.assertEqual(image.format, "WEBP")
+            self.assertEqual(image.size, (1067, 1600))
+            self.assertEqual(dict(image.getexif()), {})
+            self.assertNotIn("exif", image.info)
+
+    def test_small_image_keeps_its_size(self):
+        with Image.open(images.preprocess(photo(size=(640, 480)))) as image:
+            self.assertEqual(image.size, (640, 480))
+
+    def test_undecodable_upload_is_forwarded_unchanged(self):
+        data = photo().read()[:2000]  # truncated mid-scan
+        upload = SimpleUploadedFile("broken.jpg", data, content_type="image/jpeg")
+        self.assertIs(images.preprocess(upload), upload)
+        self.assertEqual(upload.read(), data)
+
+    def test_chat_stores_the_processed_image(self):
+        response = self.client.post("/chatbot/chat/", {"file": photo(orientation=6)})
+        self.assertEqual(response.status_code, 200)
+        message = Message.objects.get(sender=Message.SenderType.USER)
+        self.assertTrue(message.image_file.name.endswith(".webp"))
+        with Image.open(message.image_file.path) as image:
+            self.assertEqual(image.size, (1067, 1600))
+
+    def test_non_image_is_rejected(self):
+        upload = SimpleUploadedFile("notes.jpg", b"not an image", content_type="image/jpeg")
+        response = self.client.post("/chatbot/chat/", {"file": upload})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("file", response.data)
+        self.assertEqual(self.server.total_requests, 0)
+        self.assertFalse(Message.objects.exists())
+
+
+class TTSCacheEvictionTests(MediaRootMixin, APITestCase):
+
+    def cached_voice(self, key):
+        entry = tts_cache.store(key, b"x" * 100)
+        message = self.add_message(key, sender=Message.SenderType.AI)
+        message.voice_file.name = entry.audio_file.name
+        message.voice_status = Message.VoiceStatus.READY
+        message.save()
+        return message
+
+    def test_least_recently_used_is_evicted(self):
+        with self.settings(TTS_CACHE_MAX_BYTES=250):
+            old, used = self.cached_voice("old"), self.cached_voice("used")
+            self.assertIsNotNone(tts_cache.lookup("old"))  # now more recent than "used"
+            new = self.cached_voice("new")
+
+        self.assertEqual(sorted(TTSAudio.objects.values_list("key", flat=True)), ["new", "old"])
+        for message in (old, new):
+            message.refresh_from_db()
+            self.assertEqual(message.voice_status, Message.VoiceStatus.READY)
+            self.assertTrue(message.voice_file.storage.exists(message.voice_file.name))
+
+        evicted_name = used.voice_file.name
+        used.refresh_from_db()
+        self.assertEqual((used.voice_status, used.voice_file.name), (Message.VoiceStatus.EXPIRED, ""))
+        self.assertFalse(old.voice_file.storage.exists(evicted_name))
+
+    def test_new_entry_is_kept_even_when_over_the_cap(self):
+        with self.settings(TTS_CACHE_MAX_BYTES=50):
+            message = self.cached_voice("big")
+        self.assertEqual(list(TTSAudio.objects.values_list("key", flat=True)), ["big"])
+        self.assertTrue(message.voice_file.storage.exists(message.voice_file.name))
+
+
+class ConditionalGetTests(APITestCase):
+
+    def get(self, path, etag=None, **params):
+        headers = {"If-None-Match": etag} if etag else {}
+        return self.client.get(path, params, headers=headers)
+
+    def assertRevalidates(self, path, **params):
+        """The path answers 304 to its own ETag; returns that ETag"""
+        response = self.get(path, **params)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn("Last-Modified", response)  # deletes move no timestamp
+        not_modified = self.get(path, response["ETag"], **params)
+        self.assertEqual(not_modified.status_code, 304)
+        self.assertEqual(not_modified.content, b"")
+        return response["ETag"]
+
+    def chat_turn(self, conversation, text="hi"):
+        services.save_turn(
+            conversation,
+            services.prepare_user_message(conversation, {"text": text}),
+            services.new_ai_message(conversation, "reply"),
+        )
+
+    def test_history(self):
+        conversation = services.get_conversation(self.user, None)
+        self.chat_turn(conversation)
+        etag = self.assertRevalidates("/chatbot/history/")
+        self.assertNotEqual(self.assertRevalidates("/chatbot/history/", page_size=5), etag)
+
+        self.chat_turn(conversation, "again")
+        self.assertEqual(self.get("/chatbot/history/", etag).status_code, 200)
+        etag = self.assertRevalidates("/chatbot/history/")
+
+        self.assertEqual(self.client.delete("/chatbot/history/clear/").status_code, 200)
+        self.assertEqual(self.get("/chatbot/history/", etag).status_code, 200)
+
+    def test_etag_is_per_user(self):
+        etag = self.assertRevalidates("/chatbot/history/")
+        self.client.force_authenticate(self.make_user("other"))
+        self.assertEqual(self.get("/chatbot/history/", etag).status_code, 200)
+
+    def test_conversation(self):
+        conversation = services.get_conversation(self.user, None)
+        self.chat_turn(conversation)
+        path = f"/chatbot/history/{conversation.id}/"
+        etag = self.assertRevalidates(path)
+
+        self.chat_turn(conversation, "again")
+        self.assertEqual(self.get(path, etag).status_code, 200)
+        etag = self.assertRevalidates(path)
+
+        # Background TTS finishing changes the body too
+        Message.objects.filter(conversation=conversation, sender="ai").update(
+            voice_status=Message.VoiceStatus.PENDING
+        )
+        self.assertEqual(self.get(path, etag).status_code, 200)
+        etag = self.assertRevalidates(path)
+
+        self.client.delete(f"/chatbot/history/{conversation.id}/delete/")
+        gone = self.get(path, etag)
+        self.assertEqual(gone.status_code, 404)
+        self.assertNotIn("ETag", gone)
+
+
+class LoadHarnessTests(SimpleTestCase):
+    """The pure parts of the bench_chat_load command"""
+
+    def test_parse_mix(self):
+        self.assertEqual(bench_chat_load.parse_mix("chat=5, history"), {"chat": 5.0, "history": 1.0})
+        with self.assertRaises(CommandError):
+            bench_chat_load.parse_mix("chat=5,upload=1")
+
+    def test_summarize(self):
+        samples = [(200, ms / 1000) for ms in range(1, 101)] + [(503, 0.2), (0, 0.3)]
+        summary = bench_chat_load.summarize(samples, wall=2.0)
+        self.assertEqual(
+            (summary["requests"], summary["errors"], summary["throughput"]), (102, 2, 51.0)
+        )
+        self.assertEqual(summary["statuses"], {"0": 1, "200": 100, "503": 1})
+        self.assertEqual(summary["max_ms"], 300.0)
+        self.assertLess(summary["p50_ms"], summary["p99_ms"])
+
+    def test_baseline_regression_fails_the_run(self):
+        def report(p95):
+            return {
+                "config": {}, "mix": {},
+                "operations": {"chat": {"p95_ms": p95, "throughput": 10.0}},
+            }
+
+        with tempfile.NamedTemporaryFile("w", suffix=".json") as baseline:
+            json.dump(report(100.0), baseline)
+            baseline.flush()
+            command = bench_chat_load.Command(stdout=io.StringIO(), stderr=io.StringIO())
+            command._compare(report(110.0), baseline.name, max_regression=0.2)
+            with self.assertRaisesMessage(CommandError, "chat"):
+                command._compare(report(130.0), baseline.name, max_regression=0.2)
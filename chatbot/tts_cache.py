@@ -0,0 +1,120 @@
+"""
+Content-addressed cache for TTS audio.
+
+The key is a SHA-256 of the TTS payload with its text normalized, so the
+same reply in the same voice maps to one stored blob. Messages link their
+voice_file to that blob instead of storing a fresh MP3. Total size is capped
+by settings.TTS_CACHE_MAX_BYTES; least recently used entries are evicted
+first. Hit/miss counters live in the shared Django cache.
+"""
+import json
+import hashlib
+import unicodedata
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.db import IntegrityError
+from django.db.models import F, Sum
+from django.utils import timezone
+
+from .models import Message, TTSAudio
+
+HITS_KEY = "tts_cache:hits"
+MISSES_KEY = "tts_cache:misses"
+
+
+def _normalize(value):
+    if isinstance(value, str):
+        return " ".join(unicodedata.normalize("NFC", value).split())
+    if isinstance(value, dict):
+        return {k: _normalize(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_normalize(v) for v in value]
+    return value
+
+
+def cache_key(tts_payload):
+    """Stable hash of the normalized TTS payload (text + voice parameters)"""
+    normalized = json.dumps(_normalize(tts_payload or {}), sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+
+
+def _count(counter_key):
+    cache.add(counter_key, 0, timeout=None)
+    try:
+        cache.incr(counter_key)
+    except ValueError:
+        cache.set(counter_key, 1, timeout=None)
+
+
+def lookup(key):
+    """
+    Return the cached entry for key (and mark it used), or None on a miss
+    """
+    entry = TTSAudio.objects.filter(key=key).first()
+    if entry is None:
+        _count(MISSES_KEY)
+        return None
+
+    TTSAudio.objects.filter(pk=entry.pk).update(
+        hits=F("hits") + 1,
+        last_used_at=timezone.now(),
+    )
+    _count(HITS_KEY)
+    return entry
+
+
+def store(key, content):
+    """
+    Save TTS audio bytes under key and evict old entries past the size cap
+    """
+    entry = TTSAudio(key=key, size=len(content), last_used_at=timezone.now())
+    entry.audio_file.save(f"{key}.mp3", ContentFile(content), save=False)
+    try:
+        entry.save()
+    except IntegrityError:
+        # Another worker cached the same payload first; keep theirs
+        entry.audio_file.delete(save=False)
+        entry = TTSAudio.objects.get(key=key)
+
+    evict(settings.TTS_CACHE_MAX_BYTES, keep=entry.pk)
+    return entry
+
+
+def evict(max_bytes, keep=None):
+    """
+    Drop least recently used entries until the cache fits in max_bytes.
+    Messages pointing at an evicted blob are marked voice_status=expired.
+    """
+    total = TTSAudio.objects.aggregate(total=Sum("size"))["total"] or 0
+    evicted = 0
+
+    for entry in TTSAudio.objects.exclude(pk=keep).order_by("last_used_at").iterator():
+        if total <= max_bytes:
+            break
+        name = entry.audio_file.name
+        entry.delete()
+        entry.audio_file.storage.delete(name)
+        Message.objects.filter(voice_file=name).update(
+            voice_file="",
+            voice_status=Message.VoiceStatus.EXPIRED,
+        )
+        total -= entry.size
+        evicted += 1
+
+    return evicted
+
+
+def stats():
+    hits = cache.get(HITS_KEY, 0)
+    misses = cache.get(MISSES_KEY, 0)
+    totals = TTSAudio.objects.aggregate(total=Sum("size"))
+    return {
+        "hits": hits,
+        "misses": misses,
+        "hit_ratio": round(hits / (hits + misses), 4) if hits + misses else None,
+        "entries": TTSAudio.objects.count(),
+        "total_bytes": totals["total"] or 0,
+        "max_bytes": settings.TTS_CACHE_MAX_BYTES,
+    }
@@ -1,8 +1,15 @@
 from django.urls import path
 from .views import (
     ChatAPIView, 
+    AsyncChatAPIView,
+    MessageVoiceAPIView,
+    TTSCacheStatsAPIView,
+    UpstreamStatsAPIView,
     ChatHistoryAPIView, 
     ConversationDetailAPIView,
+    ConversationMessagesAPIView,
+    ChatExportAPIView,
+    MessageSearchAPIView,
     ClearChatHistoryAPIView,
     DeleteConversationAPIView
 )
@@ -12,9 +19,16 @@ app_name = 'chatbot'
 urlpatterns = [
     # Chat endpoint
     path('chat/', ChatAPIView.as_view(), name='chat'),
+    path('chat/async/', AsyncChatAPIView.as_view(), name='chat_async'),  # Non-blocking variant (ASGI)
+    path('messages/<int:message_id>/voice/', MessageVoiceAPIView.as_view(), name='message_voice'),  # Poll background TTS
+    path('tts-cache/stats/', TTSCacheStatsAPIView.as_view(), name='tts_cache_stats'),  # Admin only
+    path('upstreams/stats/', UpstreamStatsAPIView.as_view(), name='upstream_stats'),  # Admin only
     
     # History endpoints
-    path('history/', ChatHistoryAPIView.as_view(), name='chat_history'),  # List all conversations
+    path('history/', ChatHistoryAPIView.as_view(), name='chat_history'),  # Cursor-paginated conversation summaries
+    path('history/<int:conversation_id>/messages/', ConversationMessagesAPIView.as_view(), name='conversation_messages'),  # Keyset-paginated messages
+    path('history/export/', ChatExportAPIView.as_view(), name='chat_export'),  # Streamed NDJSON export
+    path('search/', MessageSearchAPIView.as_view(), name='message_search'),  # Full-text search
     path('history/<int:conversation_id>/', ConversationDetailAPIView.as_view(), name='conversation_detail'),  # Get specific conversation messages
     
     # Deletion endpoints
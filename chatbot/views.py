@@ -1,40 +1,49 @@
-import os
-import time
-import requests
-import mimetypes
+import asyncio
 
+from asgiref.sync import sync_to_async
 from django.conf import settings
-from django.core.files.base import ContentFile
+from django.contrib.auth import get_user_model
+from django.db.models import Count, Max, Q
+from django.http import StreamingHttpResponse
 
 from rest_framework import status
 from rest_framework.views import APIView
 from rest_framework.response import Response
+from rest_framework.exceptions import MethodNotAllowed
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.parsers import MultiPartParser, FormParser, JSONParser
 
 from .models import Message, Conversation
-from users.permissions import IsNormalUser
+from users.permissions import IsNormalUser, IsAdminOrSuperUser
+from MedAi.conditional import conditional_get
+from MedAi.metrics import span, timed
+from . import audio, context, idempotency, images, resilience, tts_cache
+from .ratelimit import ChatRateThrottle
+from .export import iter_export
+from .search import search_messages
 
 from .serializers import (
     ChatRequestSerializer,
+    ConversationSerializer,
     MessageSerializer,
 )
+from .pagination import ConversationCursorPagination, MessageCursorPagination
+from .services import (
+    AIResponseParser,
+    AIServiceError,
+    get_conversation,
+    prepare_user_message,
+    build_ai_request,
+    forward_headers,
+    call_ai,
+    acall_ai,
+    new_ai_message,
+    save_turn,
+    build_chat_response,
+)
+from .streaming import ChatStream, stream_response
 
-
-class AIResponseParser:
-
-    @staticmethod
-    def extract_text(ai_json):
-        return ai_json.get("assistant_message")
-
-    @staticmethod
-    def extract_tts(ai_json):
-        return ai_json.get("tts")
-    
-    @staticmethod
-    def extract_data(ai_json):
-        """Extract the data field from AI response"""
-        return ai_json.get("data")
+User = get_user_model()
 
 
 class ChatAPIView(APIView):
@@ -42,257 +51,375 @@ class ChatAPIView(APIView):
     permission_classes = [IsAuthenticated, IsNormalUser]
     parser_classes = [MultiPartParser, FormParser, JSONParser]
 
-    AI_CHATBOT_URL = settings.AI_CHATBOT_URL
-    AI_TTS_URL = settings.AI_TTS_URL
-
+    @timed("chat")
     def post(self, request):
-        serializer = ChatRequestSerializer(data=request.data)
+        # Retries with the same Idempotency-Key replay the first response
+        return idempotency.run(request, lambda: self.chat(request))
 
-        if not serializer.is_valid():
-            return Response(serializer.errors, status=400)
+    def chat(self, request):
+        with span("read"):
+            data = request.data  # parses the body, including multipart uploads
+
+        with span("validate"):
+            serializer = ChatRequestSerializer(data=data)
+            if not serializer.is_valid():
+                return Response(serializer.errors, status=400)
+
+        # Checked after the idempotency claim and validation, so replayed
+        # retries and rejected requests cost no allowance
+        ChatRateThrottle().allow_request(request, self)
 
         validated_data = serializer.validated_data
         user = request.user
 
+        # Shrink image/voice uploads on the pool while the conversation is looked up
+        image_job = images.submit(validated_data)
+        audio_job = audio.submit(validated_data)
+
         # 🔹 Get or create conversation
-        conversation_id = request.data.get("conversation_id")
+        with span("conversation"):
+            conversation = get_conversation(user, request.data.get("conversation_id"))
+        if not conversation:
+            return Response(
+                {"error": "Invalid conversation"},
+                status=404
+            )
 
-        if conversation_id:
-            conversation = Conversation.objects.filter(
-                id=conversation_id,
-                user=user
-            ).first()
+        with span("upload"):
+            if image_job:
+                validated_data["file"] = image_job.result()
+            if audio_job:
+                validated_data["audio"] = audio_job.result()
 
-            if not conversation:
-                return Response(
-                    {"error": "Invalid conversation"},
-                    status=404
-                )
-        else:
-            conversation = Conversation.objects.create(user=user)
-
-        # Determine message type
-        message_type = Message.MessageType.TEXT
-        if validated_data.get("audio"):
-            message_type = Message.MessageType.VOICE
-        elif validated_data.get("file"):
-            message_type = Message.MessageType.IMAGE
-
-        # Save USER message
-        Message.objects.create(
-            conversation=conversation,
-            sender=Message.SenderType.USER,
-            message_type=message_type,
-            text_content=validated_data.get("text"),
-            voice_file=validated_data.get("audio"),
-            image_file=validated_data.get("file"),
-        )
+            # USER message (uploads go to storage once and are streamed from there);
+            # the row is written together with the AI reply in save_turn
+            user_message = prepare_user_message(conversation, validated_data)
 
-        # Prepare AI request
-        ai_data = {
-            "user_id": user.id,
-            "conversation_id": conversation.id,
-            "reply_mode": validated_data.get("reply_mode", "text"),
-        }
+        with span("context"):
+            ai_data, ai_files = build_ai_request(user, conversation, validated_data, user_message)
 
-        if validated_data.get("text"):
-            ai_data["text"] = validated_data["text"]
+        if validated_data.get("stream"):
+            return stream_response(ChatStream(
+                request, conversation, user_message, ai_data, ai_files,
+                forward_headers(request), fmt=validated_data["stream"],
+            ))
 
-        ai_files = {}
+        try:
+            ai_json = call_ai(ai_data, ai_files, forward_headers(request))
+        except AIServiceError as e:
+            with span("save"):
+                save_turn(conversation, user_message)
+            return Response(e.payload, status=e.status, headers=e.headers)
 
-        if validated_data.get("audio"):
-            audio = validated_data["audio"]
+        # Save both messages (TTS, if requested, runs in the background)
+        tts_data = AIResponseParser.extract_tts(ai_json)
+        with span("save"):
+            ai_message = save_turn(
+                conversation,
+                user_message,
+                new_ai_message(conversation, AIResponseParser.extract_text(ai_json), tts_data),
+                tts_data,
+            )
 
-            # Reset file pointer to the beginning
-            audio.seek(0)
+        with span("respond"):
+            return Response(
+                build_chat_response(request, conversation, ai_message, ai_json),
+                status=200
+            )
 
-            # Guess correct MIME from filename
-            guessed_type, _ = mimetypes.guess_type(audio.name)
 
-            ai_files["audio"] = (
-                audio.name,
-                # audio.file,
-                audio.read(),
-                guessed_type or "audio/m4a"
-            )
-            print(f"Audio: {audio.name}, Type: {guessed_type or 'audio/m4a'}")
+class AsyncChatAPIView(APIView):
+    """
+    Async variant of ChatAPIView for ASGI deployments (MedAi/asgi.py).
 
+    The worker is released while the AI call is in flight, so one
+    process can hold many slow chats at once. DB work runs in the sync
+    thread via sync_to_async; upstream calls share a keep-alive pool.
+    """
 
-        if validated_data.get("file"):
-            image = validated_data["file"]
-            image.seek(0)
-            ai_files["file"] = (image.name, image.read(), image.content_type)
-            print(f"Image: {image.name}, Type: {image.content_type}")
+    permission_classes = [IsAuthenticated, IsNormalUser]
+    parser_classes = [MultiPartParser, FormParser, JSONParser]
 
-        # 🔹 Forward Bearer token
-        auth_header = request.headers.get("Authorization")
-        headers = {"Authorization": auth_header} if auth_header else {}
+    async def dispatch(self, request, *args, **kwargs):
+        # APIView.dispatch is sync-only, so run its steps around an awaited handler
+        self.args = args
+        self.kwargs = kwargs
+        request = self.initialize_request(request, *args, **kwargs)
+        self.request = request
+        self.headers = self.default_response_headers
 
         try:
-            if ai_files:
-                # Multipart request (for audio/image)
-                ai_response = requests.post(
-                    self.AI_CHATBOT_URL,
-                    data=ai_data,
-                    files=ai_files,
-                    headers=headers,
-                    timeout=60,
-                )
-            else:
-                # Pure JSON request (for text)
-                ai_response = requests.post(
-                    self.AI_CHATBOT_URL,
-                    json=ai_data,
-                    headers=headers,
-                    timeout=60,
-                )
-            
-            print(f"AI Response Status: {ai_response.status_code}")
-            print(f"AI Response Body: {ai_response.text[:500]}")
+            await sync_to_async(self.initial)(request, *args, **kwargs)
+            if request.method.lower() != "post":
+                raise MethodNotAllowed(request.method)
+            response = await self.post(request, *args, **kwargs)
+        except Exception as exc:
+            response = self.handle_exception(exc)
+
+        self.response = self.finalize_response(request, response, *args, **kwargs)
+        return self.response
+
+    def _validate(self, request):
+        serializer = ChatRequestSerializer(data=request.data)
+        serializer.is_valid()
+        return serializer
+
+    @timed("chat_async")
+    async def post(self, request):
+        return await idempotency.arun(request, lambda: self.chat(request))
+
+    async def chat(self, request):
+        with span("validate"):
+            serializer = await sync_to_async(self._validate)(request)
+
+        if serializer.errors:
+            return Response(serializer.errors, status=400)
+
+        await sync_to_async(ChatRateThrottle().allow_request)(request, self)
+
+        validated_data = serializer.validated_data
+        user = request.user
 
+        image_job = images.submit(validated_data)
+        audio_job = audio.submit(validated_data)
 
-        except requests.exceptions.RequestException as e:
+        with span("conversation"):
+            conversation = await sync_to_async(get_conversation)(
+                user, request.data.get("conversation_id")
+            )
+        if not conversation:
             return Response(
-                {"error": "AI service unreachable", "details": str(e)},
-                status=503,
+                {"error": "Invalid conversation"},
+                status=404
             )
 
-        if ai_response.status_code != 200:
-            return Response(
-                {"error": "AI chatbot error", "details": ai_response.text},
-                status=502,
+        with span("upload"):
+            if image_job:
+                validated_data["file"] = await asyncio.wrap_future(image_job)
+            if audio_job:
+                validated_data["audio"] = await asyncio.wrap_future(audio_job)
+
+            user_message = await sync_to_async(prepare_user_message)(conversation, validated_data)
+
+        with span("context"):
+            ai_data, ai_files = await sync_to_async(build_ai_request)(
+                user, conversation, validated_data, user_message
             )
 
+        if validated_data.get("stream"):
+            return stream_response(ChatStream(
+                request, conversation, user_message, ai_data, ai_files,
+                forward_headers(request), fmt=validated_data["stream"],
+            ), is_async=True)
+
         try:
-            ai_json = ai_response.json()
-        except ValueError:
+            ai_json = await acall_ai(ai_data, ai_files, forward_headers(request))
+        except AIServiceError as e:
+            with span("save"):
+                await sync_to_async(save_turn)(conversation, user_message)
+            return Response(e.payload, status=e.status, headers=e.headers)
+
+        tts_data = AIResponseParser.extract_tts(ai_json)
+        with span("save"):
+            ai_message = await sync_to_async(save_turn)(
+                conversation,
+                user_message,
+                new_ai_message(conversation, AIResponseParser.extract_text(ai_json), tts_data),
+                tts_data,
+            )
+
+        with span("respond"):
             return Response(
-                {"error": "Invalid AI response format"},
-                status=502,
+                build_chat_response(request, conversation, ai_message, ai_json),
+                status=200
             )
 
-        ai_text = AIResponseParser.extract_text(ai_json)
-        ai_data_field = AIResponseParser.extract_data(ai_json)
-        ai_message_type = "text"  # Default to text
 
-        tts_data = AIResponseParser.extract_tts(ai_json)
-        voice_file_obj = None
-        voice_url = None
+class MessageVoiceAPIView(APIView):
+    """
+    Poll the background TTS status of an AI message
+    """
+    permission_classes = [IsAuthenticated]
 
-        if tts_data and tts_data.get("enabled"):
-            tts_payload = tts_data.get("payload")
-            try:
-                tts_resp = requests.post(
-                    settings.AI_TTS_URL,
-                    json=tts_payload,
-                    timeout=60
-                )
-                if tts_resp.status_code == 200:
-                    ai_message_type = "voice"
-                    # Save audio to Message.voice_file
-                    filename = f"chat_{user.id}_{int(time.time())}.mp3"
-                    voice_file_obj = ContentFile(tts_resp.content, name=filename)
-            except Exception as e:
-                print("TTS Error:", e)
-
-        # Save AI message
-        ai_message = Message.objects.create(
-            conversation=conversation,
-            sender=Message.SenderType.AI,
-            message_type=ai_message_type,
-            text_content=ai_text,
-            voice_file=voice_file_obj
-        )
+    def get(self, request, message_id):
+        message = Message.objects.filter(
+            id=message_id,
+            conversation__user=request.user
+        ).first()
+
+        if not message:
+            return Response(
+                {"error": "Message not found"},
+                status=status.HTTP_404_NOT_FOUND
+            )
+
+        return Response({
+            "message_id": message.id,
+            "message_type": message.message_type,
+            "voice_status": message.voice_status,
+            "voice_url": request.build_absolute_uri(message.voice_file.url) if message.voice_file else None,
+        }, status=status.HTTP_200_OK)
 
-        # Build response with data field
-        response_data = {
-            "conversation_id": conversation.id,
-            "response": ai_text,
-            "message_type": ai_message_type,
-            "created_at": ai_message.created_at,
-        }
-        
-        # Include data field if present
-        if ai_data_field is not None:
-            response_data["data"] = ai_data_field
-        
-        # Include voice URL if voice message
-        if ai_message_type == "voice" and ai_message.voice_file:
-            voice_url = request.build_absolute_uri(ai_message.voice_file.url)
-            response_data["voice_url"] = voice_url
 
-        return Response(response_data, status=200)
+class TTSCacheStatsAPIView(APIView):
+    """
+    TTS audio cache hit/miss counters and size (admin only)
+    """
+    permission_classes = [IsAuthenticated, IsAdminOrSuperUser]
+
+    def get(self, request):
+        return Response(tts_cache.stats(), status=status.HTTP_200_OK)
+
+
+class UpstreamStatsAPIView(APIView):
+    """
+    Circuit breaker state and concurrency limit per AI upstream (admin only)
+    """
+    permission_classes = [IsAuthenticated, IsAdminOrSuperUser]
+
+    def get(self, request):
+        return Response(resilience.stats(), status=status.HTTP_200_OK)
+
+
+def history_validator(request):
+    # Every chat turn bumps updated_at; deletions change the count
+    stats = Conversation.objects.filter(user=request.user).aggregate(
+        count=Count("id"),
+        last_activity=Max("updated_at"),
+    )
+    return stats["count"], stats["last_activity"]
+
+
+def conversation_validator(request, conversation_id):
+    # New messages raise count/last id; TTS completion, failure and cache
+    # eviction move the pending and voice counts
+    stats = Message.objects.filter(
+        conversation_id=conversation_id,
+        conversation__user=request.user,
+    ).aggregate(
+        count=Count("id"),
+        last_id=Max("id"),
+        pending=Count("id", filter=Q(voice_status=Message.VoiceStatus.PENDING)),
+        voices=Count("id", filter=Q(voice_file__gt="")),
+    )
+    if not stats["count"]:
+        return None
+    return stats.values()
 
 
 class ChatHistoryAPIView(APIView):
     """
-    Get all conversations with all messages for the authenticated user
+    Cursor-paginated conversation list for the authenticated user.
+    Returns summaries only; load messages per conversation from
+    ConversationMessagesAPIView. Supports If-None-Match (304).
     """
     permission_classes = [IsAuthenticated]
 
+    @conditional_get(history_validator)
     def get(self, request):
         """
-        Returns all conversations with complete message details grouped by sender
+        One query per page: counts and previews come from the
+        denormalized ConversationSummary row joined in
         """
         conversations = Conversation.objects.filter(
             user=request.user
-        ).prefetch_related('messages').order_by('-updated_at')
-        
-        conversations_data = []
-        
-        for conversation in conversations:
-            messages = conversation.messages.all().order_by('created_at')
-            
-            # Group messages into pairs (user -> ai)
-            message_pairs = []
-            temp_pair = {}
-            
-            for message in messages:
-                message_data = {
-                    "message_id": message.id,
-                    "message_type": message.message_type,
-                    "text_content": message.text_content,
-                    "voice_file_url": request.build_absolute_uri(message.voice_file.url) if message.voice_file else None,
-                    "image_file_url": request.build_absolute_uri(message.image_file.url) if message.image_file else None,
-                    "created_at": message.created_at,
-                }
-                
-                if message.sender == Message.SenderType.USER:
-                    # Start a new pair with user message
-                    temp_pair = {
-                        "user": message_data,
-                        "ai": None
-                    }
-                elif message.sender == Message.SenderType.AI:
-                    # Complete the pair with AI message
-                    if temp_pair:
-                        temp_pair["ai"] = message_data
-                        message_pairs.append(temp_pair)
-                        temp_pair = {}
-                    else:
-                        # AI message without user message (shouldn't happen, but handle it)
-                        message_pairs.append({
-                            "user": None,
-                            "ai": message_data
-                        })
-            
-            # If there's an unpaired user message, add it
-            if temp_pair:
-                message_pairs.append(temp_pair)
-            
-            conversation_info = {
-                "id": conversation.id,
-                "message_count": messages.count(),
-                "messages": message_pairs,
-                "created_at": conversation.created_at,
-                "updated_at": conversation.updated_at,
-            }
-            
-            conversations_data.append(conversation_info)
+        ).select_related("summary")
+
+        paginator = ConversationCursorPagination()
+        page = paginator.paginate_queryset(conversations, request, view=self)
+        serializer = ConversationSerializer(page, many=True)
+        return paginator.get_paginated_response(serializer.data)
+
+
+class ConversationMessagesAPIView(APIView):
+    """
+    Keyset-paginated messages of one conversation, newest first
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, conversation_id):
+        if not Conversation.objects.filter(id=conversation_id, user=request.user).exists():
+            return Response(
+                {"error": "Conversation not found"},
+                status=status.HTTP_404_NOT_FOUND
+            )
+
+        messages = Message.objects.filter(conversation_id=conversation_id)
+
+        paginator = MessageCursorPagination()
+        page = paginator.paginate_queryset(messages, request, view=self)
+        serializer = MessageSerializer(page, many=True, context={"request": request})
+        return paginator.get_paginated_response(serializer.data)
+
+
+class ChatExportAPIView(APIView):
+    """
+    Stream the full chat history as NDJSON (?compress=gzip for a .gz file).
+    Admins may export another user with ?user_id=<id>.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        user_id = request.user.id
+        if request.query_params.get("user_id"):
+            if not request.user.is_superuser:
+                return Response(
+                    {"error": "Only admins can export other users"},
+                    status=status.HTTP_403_FORBIDDEN
+                )
+            try:
+                user_id = int(request.query_params["user_id"])
+            except ValueError:
+                return Response(
+                    {"error": "user_id must be an integer"},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            if not User.objects.filter(id=user_id).exists():
+                return Response(
+                    {"error": "User not found"},
+                    status=status.HTTP_404_NOT_FOUND
+                )
+
+        compress = request.query_params.get("compress") == "gzip"
+        filename = f"chat_export_{user_id}.ndjson" + (".gz" if compress else "")
+
+        response = StreamingHttpResponse(
+            iter_export(
+                [user_id],
+                media_url=request.build_absolute_uri(settings.MEDIA_URL),
+                compress=compress,
+            ),
+            content_type="application/gzip" if compress else "application/x-ndjson",
+        )
+        response["Content-Disposition"] = f'attachment; filename="{filename}"'
+        return response
+
+
+class MessageSearchAPIView(APIView):
+    """
+    Full-text search over the authenticated user's messages (?q=...)
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        query = request.query_params.get("q", "").strip()
+        if not query:
+            return Response(
+                {"error": "q is required"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        try:
+            limit = min(int(request.query_params.get("limit", 50)), 200)
+        except ValueError:
+            limit = 50
 
+        messages = search_messages(request.user, query, limit=limit)
+        serializer = MessageSerializer(messages, many=True, context={"request": request})
         return Response({
-            "count": conversations.count(),
-            "conversations": conversations_data
+            "query": query,
+            "count": len(messages),
+            "results": serializer.data,
         }, status=status.HTTP_200_OK)
 
 
@@ -302,6 +429,7 @@ class ConversationDetailAPIView(APIView):
     """
     permission_classes = [IsAuthenticated]
 
+    @conditional_get(conversation_validator)
     def get(self, request, conversation_id):
         """
         Returns all messages for a specific conversation
@@ -329,6 +457,7 @@ class ConversationDetailAPIView(APIView):
                 "message_type": message.message_type,
                 "text_content": message.text_content,
                 "voice_file_url": request.build_absolute_uri(message.voice_file.url) if message.voice_file else None,
+                "voice_status": message.voice_status,
                 "image_file_url": request.build_absolute_uri(message.image_file.url) if message.image_file else None,
                 "created_at": message.created_at,
             }
@@ -375,13 +504,15 @@ class ClearChatHistoryAPIView(APIView):
         
         # Get all conversations for the user
         conversations = Conversation.objects.filter(user=request.user)
-        conversation_count = conversations.count()
+        conversation_ids = list(conversations.values_list("id", flat=True))
+        conversation_count = len(conversation_ids)
         
         # Count messages before deletion
         message_count = Message.objects.filter(conversation__user=request.user).count()
         
         # Delete all conversations (this will cascade delete all messages)
         conversations.delete()
+        context.invalidate(conversation_ids)
         
         return Response({
             'message': 'Chat history cleared successfully',
@@ -416,6 +547,7 @@ class DeleteConversationAPIView(APIView):
         
         # Delete the conversation (cascade deletes messages)
         conversation.delete()
+        context.invalidate([conversation_id])
         
         return Response({
             'message': 'Conversation deleted successfully',
@@ -6,7 +6,8 @@ from .models import (
     Medicine_Time,
     MedicalTest,
     pharmacy,
-    NotificationLog
+    NotificationLog,
+    ReminderSchedule
 )
 
 # ---------------------------
@@ -82,6 +83,25 @@ class MedicineAdmin(admin.ModelAdmin):
     readonly_fields = ('created_at', 'updated_at')
 
 
+# ---------------------------
+# Reminder Schedule Admin
+# ---------------------------
+@admin.register(ReminderSchedule)
+class ReminderScheduleAdmin(admin.ModelAdmin):
+    list_display = (
+        'id',
+        'medicine',
+        'user',
+        'slot',
+        'time_of_day',
+        'start_date',
+        'end_date'
+    )
+    list_filter = ('slot',)
+    search_fields = ('medicine__name', 'user__email')
+    readonly_fields = ('user', 'prescription', 'medicine', 'slot', 'time_of_day', 'start_date', 'end_date')
+
+
 # ---------------------------
 # Medical Test Admin
 # ---------------------------
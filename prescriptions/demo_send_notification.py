@@ -1,4 +1,4 @@
-from prescriptions.tasks import send_push_notification
+from prescriptions.push import send_push_notification
 from users.models import Users
 
 # Test user (যার Flutter app এ login আছে)
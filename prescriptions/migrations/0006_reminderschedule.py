@@ -0,0 +1,64 @@
+# Generated by Django 5.2.11 on 2026-10-18 05:42
+
+from datetime import timedelta
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.utils import timezone
+
+SLOTS = ('morning', 'afternoon', 'evening', 'night')
+
+
+def backfill_schedule(apps, schema_editor):
+    Medicine = apps.get_model('prescriptions', 'Medicine')
+    ReminderSchedule = apps.get_model('prescriptions', 'ReminderSchedule')
+
+    rows = []
+    medicines = Medicine.objects.select_related('prescription', *SLOTS)
+    for medicine in medicines.iterator(chunk_size=500):
+        start_date = timezone.localtime(medicine.prescription.created_at).date()
+        end_date = start_date + timedelta(days=medicine.how_many_day - 1)
+        for slot in SLOTS:
+            slot_time = getattr(medicine, slot)
+            if slot_time is None:
+                continue
+            rows.append(ReminderSchedule(
+                user_id=medicine.prescription.users_id,
+                prescription_id=medicine.prescription_id,
+                medicine_id=medicine.id,
+                slot=slot,
+                time_of_day=slot_time.time,
+                start_date=start_date,
+                end_date=end_date,
+            ))
+    ReminderSchedule.objects.bulk_create(rows, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('prescriptions', '0005_remove_adminnotification_is_read'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReminderSchedule',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('slot', models.CharField(choices=[('morning', 'Morning'), ('afternoon', 'Afternoon'), ('evening', 'Evening'), ('night', 'Night')], max_length=10)),
+                ('time_of_day', models.TimeField()),
+                ('start_date', models.DateField()),
+                ('end_date', models.DateField()),
+                ('medicine', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reminder_schedule', to='prescriptions.medicine')),
+                ('prescription', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reminder_schedule', to='prescriptions.prescription')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reminder_schedule', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['time_of_day', 'start_date', 'end_date'], name='prescriptio_time_of_01fd6d_idx')],
+                'constraints': [models.UniqueConstraint(fields=('medicine', 'slot'), name='unique_reminder_per_medicine_slot')],
+            },
+        ),
+        migrations.RunPython(backfill_schedule, migrations.RunPython.noop),
+    ]
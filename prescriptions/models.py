@@ -1,4 +1,6 @@
-from django.db import models
+from datetime import timedelta
+from django.db import models, transaction
+from django.utils import timezone
 from users.models import Users
 # Create your models here.
 class Prescription(models.Model):
@@ -50,6 +52,64 @@ class Medicine(models.Model):
     def __str__(self):
         return f"{self.name} - {self.prescription.id}" 
 
+class ReminderSchedule(models.Model):
+    """
+    One row per medicine slot that has a time, with the local dates the
+    course covers, so the reminder dispatcher finds who is due at a given
+    minute with one indexed query. Kept in sync from Medicine and
+    Medicine_Time saves (prescriptions/signals.py); deleting the medicine
+    deletes its rows.
+    """
+    SLOTS = ("morning", "afternoon", "evening", "night")
+
+    user = models.ForeignKey(Users, on_delete=models.CASCADE, related_name='reminder_schedule')
+    prescription = models.ForeignKey(Prescription, on_delete=models.CASCADE, related_name='reminder_schedule')
+    medicine = models.ForeignKey(Medicine, on_delete=models.CASCADE, related_name='reminder_schedule')
+    slot = models.CharField(max_length=10, choices=[(slot, slot.capitalize()) for slot in SLOTS])
+    time_of_day = models.TimeField()
+    start_date = models.DateField()
+    end_date = models.DateField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["medicine", "slot"], name="unique_reminder_per_medicine_slot"),
+        ]
+        indexes = [
+            models.Index(fields=["time_of_day", "start_date", "end_date"]),
+        ]
+
+    def __str__(self):
+        return f"{self.medicine_id} {self.slot} {self.time_of_day} ({self.start_date} - {self.end_date})"
+
+    @classmethod
+    def rows_for(cls, medicine):
+        """Unsaved schedule rows for a medicine (its prescription and slot times loaded)"""
+        start_date = timezone.localtime(medicine.prescription.created_at).date()
+        end_date = start_date + timedelta(days=int(medicine.how_many_day) - 1)
+        rows = []
+        for slot in cls.SLOTS:
+            slot_time = getattr(medicine, slot)
+            if slot_time is None:
+                continue
+            rows.append(cls(
+                user_id=medicine.prescription.users_id,
+                prescription_id=medicine.prescription_id,
+                medicine_id=medicine.id,
+                slot=slot,
+                time_of_day=slot_time.time,
+                start_date=start_date,
+                end_date=end_date,
+            ))
+        return rows
+
+    @classmethod
+    def sync(cls, medicine):
+        """Rewrite a medicine's rows from its current slots and course length"""
+        with transaction.atomic():
+            cls.objects.filter(medicine_id=medicine.id).delete()
+            cls.objects.bulk_create(cls.rows_for(medicine))
+
+
 class MedicalTest(models.Model):
     prescription=models.ForeignKey(Prescription, on_delete=models.CASCADE)
     test_name=models.CharField(max_length=100)
@@ -0,0 +1,210 @@
+"""
+Push notifications, sent in batches.
+
+Callers queue notifications on a PushBatch and send them together. The
+batch hands the backend up to `chunk_size` messages per call (FCM allows
+500) and gets one result per message back. The backend is a dotted path in
+settings.PUSH_NOTIFICATIONS so it can be swapped:
+
+- FirebasePushBackend (default): FCM's send_each.
+- FakePushBackend: keeps messages in memory instead of sending them; for
+  tests, benchmarks and hosts without Firebase credentials.
+
+Each batch writes its NotificationLog rows with one bulk_create, records
+the outcomes with one bulk_update and clears the FCM tokens the backend
+reports as unregistered with one UPDATE.
+"""
+from django.conf import settings
+from django.utils.module_loading import import_string
+from firebase_admin import messaging
+
+from MedAi.log import get_logger
+from users.models import Users
+from .models import NotificationLog
+
+logger = get_logger("prescriptions.push")
+
+NO_TOKEN = "No FCM token found for this user"
+UNREGISTERED = "FCM token is invalid or unregistered"
+
+
+class PushMessage:
+
+    def __init__(self, token, title, body):
+        self.token = token
+        self.title = title
+        self.body = body
+
+
+class PushResult:
+
+    def __init__(self, success, response=None, error=None, unregistered=False):
+        self.success = success
+        self.response = response
+        self.error = error
+        self.unregistered = unregistered
+
+
+class PushBackend:
+    """Base class: send(messages) returns one PushResult per message, in order"""
+
+    max_chunk = 500
+
+    def __init__(self, config):
+        self.config = config
+
+    def send(self, messages):
+        raise NotImplementedError
+
+
+class FirebasePushBackend(PushBackend):
+
+    def build(self, message):
+        return messaging.Message(
+            notification=messaging.Notification(
+                title=message.title,
+                body=message.body,
+            ),
+            token=message.token,
+            android=messaging.AndroidConfig(priority='high'),
+            apns=messaging.APNSConfig(
+                payload=messaging.APNSPayload(
+                    aps=messaging.Aps(sound='default'),
+                ),
+            ),
+        )
+
+    def send(self, messages):
+        batch = messaging.send_each([self.build(message) for message in messages])
+        return [
+            PushResult(
+                response.success,
+                response=response.message_id,
+                error=str(response.exception) if response.exception else None,
+                unregistered=isinstance(response.exception, messaging.UnregisteredError),
+            )
+            for response in batch.responses
+        ]
+
+
+class FakePushBackend(PushBackend):
+    """
+    Records messages in FakePushBackend.outbox. Tokens starting with
+    "unregistered" are reported as unregistered and tokens starting with
+    "fail" as failed, so callers can exercise every outcome.
+    """
+
+    outbox = []
+    calls = 0
+
+    def send(self, messages):
+        FakePushBackend.calls += 1
+        results = []
+        for message in messages:
+            if message.token.startswith("unregistered"):
+                results.append(PushResult(False, error=UNREGISTERED, unregistered=True))
+            elif message.token.startswith("fail"):
+                results.append(PushResult(False, error="Fake delivery failure"))
+            else:
+                FakePushBackend.outbox.append(message)
+                results.append(PushResult(True, response=f"fake/{len(FakePushBackend.outbox)}"))
+        return results
+
+
+def get_backend():
+    config = settings.PUSH_NOTIFICATIONS
+    return import_string(config["backend"])(config)
+
+
+class PushBatch:
+    """
+    Collects notifications and sends them with as few backend calls as
+    possible. add() sends automatically once `batch_size` notifications are
+    pending; call send() (or use the batch as a context manager) for the
+    rest.
+    """
+
+    def __init__(self, backend=None):
+        self.backend = backend or get_backend()
+        config = settings.PUSH_NOTIFICATIONS
+        self.chunk_size = min(config["chunk_size"], self.backend.max_chunk)
+        self.batch_size = config["batch_size"]
+        self.pending = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.send()
+
+    def add(self, user, title, body, notification_type='medicine_reminder', medicine=None):
+        self.pending.append((user, title, body, notification_type, medicine))
+        if len(self.pending) >= self.batch_size:
+            self.send()
+
+    def send(self):
+        pending, self.pending = self.pending, []
+        if not pending:
+            return
+
+        logs = NotificationLog.objects.bulk_create([
+            NotificationLog(
+                user=user,
+                notification_type=notification_type,
+                title=title,
+                body=body,
+                medicine=medicine,
+                is_sent=False,
+                error_message=None if user.fcm_token else NO_TOKEN,
+            )
+            for user, title, body, notification_type, medicine in pending
+        ])
+        deliverable = [
+            (user, log, PushMessage(user.fcm_token, title, body))
+            for (user, title, body, _, _), log in zip(pending, logs)
+            if user.fcm_token
+        ]
+
+        unregistered = set()
+        for start in range(0, len(deliverable), self.chunk_size):
+            chunk = deliverable[start:start + self.chunk_size]
+            try:
+                results = self.backend.send([message for _, _, message in chunk])
+            except Exception as e:
+                logger.error("Push chunk failed", extra={"messages": len(chunk)}, exc_info=True)
+                results = [PushResult(False, error=str(e))] * len(chunk)
+
+            for (_, log, message), result in zip(chunk, results):
+                log.is_sent = result.success
+                if result.success:
+                    log.firebase_response = str(result.response)
+                else:
+                    log.error_message = result.error
+                if result.unregistered:
+                    unregistered.add(message.token)
+
+        NotificationLog.objects.bulk_update(
+            [log for _, log, _ in deliverable],
+            ["is_sent", "firebase_response", "error_message"],
+        )
+
+        if unregistered:
+            # Only tokens still on file; a user may have registered a new one meanwhile
+            Users.objects.filter(fcm_token__in=unregistered).update(fcm_token=None)
+            for user, _, message in deliverable:
+                if message.token in unregistered:
+                    user.fcm_token = None
+            logger.warning("Push tokens unregistered; cleared", extra={"tokens": len(unregistered)})
+
+        logger.info("Push batch sent", extra={
+            "notifications": len(pending),
+            "delivered": sum(1 for _, log, _ in deliverable if log.is_sent),
+            "no_token": len(pending) - len(deliverable),
+        })
+
+
+def send_push_notification(user, title, body, notification_type='medicine_reminder', medicine=None):
+    """Send one notification right away"""
+    with PushBatch() as batch:
+        batch.add(user, title, body, notification_type=notification_type, medicine=medicine)
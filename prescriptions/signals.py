@@ -1,58 +1,35 @@
+from django.db.models import Q
 from django.db.models.signals import post_save
 from django.dispatch import receiver
-from django.utils import timezone
-from datetime import datetime, timedelta
-from .models import Medicine, AdminNotification, pharmacy
+from .models import Prescription, Medicine, Medicine_Time, ReminderSchedule, AdminNotification, pharmacy
+
+# Medicine fields the reminder schedule is derived from
+SCHEDULE_FIELDS = {'prescription', 'how_many_day', *ReminderSchedule.SLOTS}
 
-_scheduled = set()
 
 @receiver(post_save, sender=Medicine)
-def schedule_medicine_reminder(sender, instance, created, **kwargs):
-    if not created:
+def sync_reminder_schedule(sender, instance, update_fields=None, **kwargs):
+    # Stock updates save with update_fields and leave the schedule alone
+    if update_fields is not None and not SCHEDULE_FIELDS & set(update_fields):
         return
+    ReminderSchedule.sync(instance)
 
-    from .tasks import send_grouped_medicine_reminder
-
-    user = instance.prescription.users
-    prescription_id = instance.prescription.id
-    now = timezone.now()
-
-    slots = {
-        'Morning': instance.morning,
-        'Afternoon': instance.afternoon,
-        'Evening': instance.evening,
-        'Night': instance.night,
-    }
-
-    for slot_name, slot_obj in slots.items():
-        if slot_obj and slot_obj.time:
-            slot_time = slot_obj.time
-            if isinstance(slot_time, str):
-                slot_time = datetime.strptime(slot_time, '%H:%M:%S').time()
 
-            slot_time_str = slot_time.strftime('%H:%M:%S')
-            schedule_key = f"{prescription_id}_{slot_name}_{slot_time_str}"
-
-            if schedule_key in _scheduled:
-                print(f"[SCHEDULE] ⚠️ Skip: {schedule_key}")
-                continue
-
-            _scheduled.add(schedule_key)
-
-            slot_datetime = datetime.combine(now.date(), slot_time)
-            slot_datetime = timezone.make_aware(slot_datetime)
-            reminder_time = slot_datetime - timedelta(minutes=30)
+@receiver(post_save, sender=Medicine_Time)
+def sync_reminder_time(sender, instance, created, **kwargs):
+    if created:
+        return  # not attached to a medicine yet
+    medicines = Medicine.objects.filter(
+        Q(morning=instance) | Q(afternoon=instance) | Q(evening=instance) | Q(night=instance)
+    ).select_related('prescription', *ReminderSchedule.SLOTS)
+    for medicine in medicines:
+        ReminderSchedule.sync(medicine)
 
-            if reminder_time <= now:
-                slot_datetime += timedelta(days=1)
-                reminder_time = slot_datetime - timedelta(minutes=30)
 
-            send_grouped_medicine_reminder.apply_async(
-                args=[user.id, slot_name, slot_time_str],
-                kwargs={'prescription_id': prescription_id},
-                eta=reminder_time
-            )
-            print(f"[SCHEDULE] ✅ {slot_name} {slot_time_str} → prescription {prescription_id} at {reminder_time}")
+@receiver(post_save, sender=Prescription)
+def sync_reminder_user(sender, instance, created, **kwargs):
+    if not created:
+        ReminderSchedule.objects.filter(prescription=instance).exclude(user_id=instance.users_id).update(user_id=instance.users_id)
 
 
 # ✅ Admin Notifications
@@ -1,143 +1,179 @@
 from celery import shared_task
 from django.utils import timezone
 from django.conf import settings
-from datetime import datetime, timedelta
-from firebase_admin import messaging
-from .models import Medicine, NotificationLog
+from django.core.cache import cache
+from datetime import timedelta
+from MedAi.log import get_logger
+from .models import Medicine, NotificationLog, ReminderSchedule
+from .push import PushBatch
+
+logger = get_logger("prescriptions.reminders")
+
+CURSOR_KEY = "reminders:cursor"
+# Claims only need to outlive catch-up and task retries; keys carry the date
+CLAIM_TIMEOUT = 60 * 60 * 24
+
+
+def reminder_body(medicine_names):
+    if len(medicine_names) == 1:
+        return f"Time to take {medicine_names[0]}"
+    return f"Time to take: {', '.join(medicine_names)}"
+
+
+def due_reminders(slot_at):
+    """
+    Reminders for the slot time slot_at (local, minute precision), for
+    medicines whose course covers that day. Medicines of one prescription
+    taken at the same slot and time share one notification:
+    [{"user_id", "prescription_id", "slot", "slot_time", "date", "medicines"}, ...]
+    """
+    day = slot_at.date()
+    minute = slot_at.time().replace(second=0, microsecond=0)
+    rows = ReminderSchedule.objects.filter(
+        time_of_day__range=(minute, minute.replace(second=59, microsecond=999999)),
+        start_date__lte=day,
+        end_date__gte=day,
+    ).order_by("medicine_id").values_list(
+        "user_id", "prescription_id", "slot", "time_of_day", "medicine__name"
+    )
 
+    groups = {}
+    for user_id, prescription_id, slot, time_of_day, name in rows:
+        key = (user_id, prescription_id, slot, time_of_day.strftime('%H:%M:%S'))
+        names = groups.setdefault(key, [])
+        if name not in names:
+            names.append(name)
+
+    return [
+        {
+            "user_id": user_id,
+            "prescription_id": prescription_id,
+            "slot": slot,
+            "slot_time": slot_time,
+            "date": day.isoformat(),
+            "medicines": names,
+        }
+        for (user_id, prescription_id, slot, slot_time), names in groups.items()
+    ]
+
+
+def reminder_key(reminder):
+    return (
+        f"reminders:sent:{reminder['prescription_id']}:{reminder['slot']}:"
+        f"{reminder['slot_time']}:{reminder['date']}"
+    )
 
-@shared_task
-def send_grouped_medicine_reminder(user_id, slot_name, slot_time, prescription_id=None):
-    from users.models import Users
 
-    try:
-        user = Users.objects.get(id=user_id)
-    except Users.DoesNotExist:
-        return "User not found"
-
-    today = timezone.now().date()
-    slot_filter = {f"{slot_name.lower()}__isnull": False}
-
-    medicines = Medicine.objects.filter(
-        prescription__users=user,
-        prescription__id=prescription_id,
-        **slot_filter
-    ).select_related('prescription')
-
-    active_medicines = []
-    seen = set()
-
-    for med in medicines:
-        start_date = med.prescription.created_at.date()
-        end_date = start_date + timedelta(days=med.how_many_day - 1)
-
-        if not (start_date <= today <= end_date):
-            continue
-
-        # ✅ Same exact time এর medicine শুধু এই notification এ
-        slot_obj = getattr(med, slot_name.lower())
-        if slot_obj:
-            med_time = slot_obj.time
-            if isinstance(med_time, str):
-                med_time = datetime.strptime(med_time, '%H:%M:%S').time()
-            
-            med_time_str = med_time.strftime('%H:%M:%S')
-            
-            # ✅ শুধু same time এর medicine নাও
-            if med_time_str == slot_time and med.name not in seen:
-                active_medicines.append(med.name)
-                seen.add(med.name)
-
-    if not active_medicines:
-        return f"No active medicines for {slot_name} at {slot_time}"
-
-    if len(active_medicines) == 1:
-        body = f"Time to take {active_medicines[0]}"
-    else:
-        names = ", ".join(active_medicines)
-        body = f"Time to take: {names}"
-
-    send_push_notification(
-        user,
-        f"💊 Medicine Reminder ({slot_name})",
-        body,
-        notification_type='medicine_reminder'
-    )
+def minutes_to_dispatch(slot_at):
+    """
+    Slot minutes not dispatched yet, oldest first: everything after the
+    cursor up to slot_at, so minutes missed while beat or the workers were
+    down are caught up, at most `max_catchup_minutes` back.
+    """
+    limit = settings.MEDICINE_REMINDERS["max_catchup_minutes"]
+    cursor = cache.get(CURSOR_KEY)
+    first = slot_at
+    if cursor is not None:
+        first = max(cursor + timedelta(minutes=1), slot_at - timedelta(minutes=limit))
+        skipped = (first - cursor).total_seconds() // 60 - 1
+        if skipped > 0:
+            logger.warning("Reminder catch-up limit reached; minutes skipped", extra={
+                "cursor": cursor.isoformat(),
+                "skipped_minutes": int(skipped),
+            })
+
+    minutes = []
+    while first <= slot_at:
+        minutes.append(first)
+        first += timedelta(minutes=1)
+    return minutes
 
-    now = timezone.now()
-    tomorrow_slot = datetime.combine(
-        now.date() + timedelta(days=1),
-        datetime.strptime(slot_time, '%H:%M:%S').time()
-    )
-    tomorrow_slot = timezone.make_aware(tomorrow_slot)
-    reminder_time = tomorrow_slot - timedelta(minutes=30)
 
-    send_grouped_medicine_reminder.apply_async(
-        args=[user_id, slot_name, slot_time],
-        kwargs={'prescription_id': prescription_id},
-        eta=reminder_time
-    )
+@shared_task
+def dispatch_due_reminders():
+    """
+    Runs every minute (CELERY_BEAT_SCHEDULE). Finds the reminders due
+    `lead_minutes` ahead of their slot and hands them to workers in
+    batches, so the broker only ever holds the current minute's work.
+
+    Each minute is claimed with cache.add, so a second beat or a late run
+    does not repeat it, and the cursor (last dispatched minute) advances
+    once a minute is fully queued. If queueing fails (broker down) the
+    claim is released and the cursor stays put, so the next run retries
+    that minute.
+    """
+    config = settings.MEDICINE_REMINDERS
+    now = timezone.localtime().replace(second=0, microsecond=0)
+    slot_at = now + timedelta(minutes=config["lead_minutes"])
+    size = config["batch_size"]
+
+    minutes = minutes_to_dispatch(slot_at)
+    total = 0
+    for minute in minutes:
+        claim = f"reminders:dispatched:{minute.isoformat()}"
+        if not cache.add(claim, 1, timeout=CLAIM_TIMEOUT):
+            continue  # another dispatcher has it
+
+        try:
+            reminders = due_reminders(minute)
+            for start in range(0, len(reminders), size):
+                send_reminder_batch.delay(reminders[start:start + size])
+        except Exception:
+            # Let the next run retry this minute; reminders already queued
+            # are deduplicated by their own claims
+            cache.delete(claim)
+            raise
+        cache.set(CURSOR_KEY, minute, timeout=None)
+        total += len(reminders)
+
+        logger.info("Reminders dispatched", extra={
+            "slot_at": minute.isoformat(),
+            "reminders": len(reminders),
+            "batches": -(-len(reminders) // size),
+        })
+
+    return f"{total} reminders due up to {slot_at:%H:%M}"
+
 
-    return f"Grouped reminder sent: {active_medicines}"
+@shared_task
+def send_reminder_batch(reminders):
+    """
+    Send a batch of due_reminders() entries. Each reminder is claimed with
+    cache.add first, so a redelivered or duplicated batch sends it once.
+    """
     from users.models import Users
 
-    try:
-        user = Users.objects.get(id=user_id)
-    except Users.DoesNotExist:
-        return "User not found"
-
-    today = timezone.now().date()
-    slot_filter = {f"{slot_name.lower()}__isnull": False}
-
-    # ✅ Specific prescription filter
-    medicines = Medicine.objects.filter(
-        prescription__users=user,
-        prescription__id=prescription_id,
-        **slot_filter
-    ).select_related('prescription')
-
-    active_medicines = []
-    seen = set()
-
-    for med in medicines:
-        start_date = med.prescription.created_at.date()
-        end_date = start_date + timedelta(days=med.how_many_day - 1)
-
-        if start_date <= today <= end_date and med.name not in seen:
-            active_medicines.append(med.name)
-            seen.add(med.name)
-
-    if not active_medicines:
-        return "No active medicines for this slot"
-
-    if len(active_medicines) == 1:
-        body = f"Time to take {active_medicines[0]}"
-    else:
-        names = ", ".join(active_medicines)
-        body = f"Time to take: {names}"
-
-    send_push_notification(
-        user,
-        f"💊 Medicine Reminder ({slot_name})",
-        body,
-        notification_type='medicine_reminder'
-    )
+    users = Users.objects.in_bulk({reminder["user_id"] for reminder in reminders})
+    sent = 0
 
-    now = timezone.now()
-    tomorrow_slot = datetime.combine(
-        now.date() + timedelta(days=1),
-        datetime.strptime(slot_time, '%H:%M:%S').time()
-    )
-    tomorrow_slot = timezone.make_aware(tomorrow_slot)
-    reminder_time = tomorrow_slot - timedelta(minutes=30)
+    with PushBatch() as batch:
+        for reminder in reminders:
+            user = users.get(reminder["user_id"])
+            if user is None:
+                continue
+            if not cache.add(reminder_key(reminder), 1, timeout=CLAIM_TIMEOUT):
+                logger.info("Reminder already sent", extra={"reminder": reminder_key(reminder)})
+                continue
+            batch.add(
+                user,
+                f"💊 Medicine Reminder ({reminder['slot'].capitalize()})",
+                reminder_body(reminder["medicines"]),
+                notification_type='medicine_reminder'
+            )
+            sent += 1
+
+    return f"{sent} reminders sent"
+
+
+@shared_task
+def send_grouped_medicine_reminder(user_id, slot_name, slot_time, prescription_id=None):
+    """
+    Superseded by dispatch_due_reminders. Kept so the self-rescheduling ETA
+    tasks queued by earlier releases drain without sending or rescheduling.
+    """
+    return "Superseded by dispatch_due_reminders"
 
-    send_grouped_medicine_reminder.apply_async(
-        args=[user_id, slot_name, slot_time],
-        kwargs={'prescription_id': prescription_id},
-        eta=reminder_time
-    )
 
-    return f"Grouped reminder sent: {active_medicines}"
 @shared_task
 def check_low_stock_and_notify():
     threshold = getattr(settings, 'LOW_STOCK_THRESHOLD_DAYS', 3)
@@ -152,82 +188,29 @@ def check_low_stock_and_notify():
 
     count = 0
 
-    for med in low_stock:
-        user = med.prescription.users
-        body = f"⚠️ {med.name} has only {med.stock} day(s) of stock left!"
-        send_push_notification(
-            user,
-            "Low Stock Alert",
-            body,
-            notification_type='low_stock_alert',
-            medicine=med
-        )
-        count += 1
-
-    for med in out_of_stock:
-        user = med.prescription.users
-        body = f"🚨 {med.name} is out of stock! Please buy now."
-        send_push_notification(
-            user,
-            "Out of Stock Alert",
-            body,
-            notification_type='low_stock_alert',
-            medicine=med
-        )
-        count += 1
+    with PushBatch() as batch:
+        for med in low_stock.iterator():
+            batch.add(
+                med.prescription.users,
+                "Low Stock Alert",
+                f"⚠️ {med.name} has only {med.stock} day(s) of stock left!",
+                notification_type='low_stock_alert',
+                medicine=med
+            )
+            count += 1
+
+        for med in out_of_stock.iterator():
+            batch.add(
+                med.prescription.users,
+                "Out of Stock Alert",
+                f"🚨 {med.name} is out of stock! Please buy now.",
+                notification_type='low_stock_alert',
+                medicine=med
+            )
+            count += 1
 
     return f"Alerts sent for {count} medicines"
 
-def send_push_notification(user, title, body, notification_type='medicine_reminder', medicine=None):
-    log = NotificationLog.objects.create(
-        user=user,
-        notification_type=notification_type,
-        title=title,
-        body=body,
-        medicine=medicine,
-        is_sent=False
-    )
-
-    if not user.fcm_token:
-        log.error_message = "No FCM token found for this user"
-        log.save()
-        print(f"[PUSH] ❌ No FCM token - User ID: {user.id} ({user.email})")
-        return
-
-    message = messaging.Message(
-        notification=messaging.Notification(
-            title=title,
-            body=body,
-        ),
-        token=user.fcm_token,
-        android=messaging.AndroidConfig(priority='high'),
-        apns=messaging.APNSConfig(
-            payload=messaging.APNSPayload(
-                aps=messaging.Aps(sound='default'),
-            ),
-        ),
-    )
-
-    try:
-        response = messaging.send(message)
-        log.is_sent = True
-        log.firebase_response = str(response)
-        log.save()
-        print(f"[PUSH] ✅ Sent! User: {user.email} | Medicine: {medicine.name if medicine else 'N/A'}")
-
-    except messaging.UnregisteredError:
-        log.error_message = "FCM token is invalid or unregistered"
-        log.save()
-        user.fcm_token = None
-        user.save(update_fields=['fcm_token'])
-        print(f"[PUSH] ❌ Invalid token cleared for user: {user.email}")
-
-    except Exception as e:
-        log.error_message = str(e)
-        log.save()
-        print(f"[PUSH] ❌ Error for user {user.email}: {e}")
-
-
 @shared_task
 def delete_old_notifications():
     cutoff = timezone.now() - timedelta(days=30)
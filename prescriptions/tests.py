@@ -1,3 +1,311 @@
-from django.test import TestCase
+from datetime import time, timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+from django.utils import timezone
+
+from users.models import Users
+from . import tasks
+from .models import Medicine, Medicine_Time, NotificationLog, Prescription, ReminderSchedule
+from .push import NO_TOKEN, UNREGISTERED, FakePushBackend, PushBatch
+
+PUSH_NOTIFICATIONS = {
+    "backend": "prescriptions.push.FakePushBackend",
+    "chunk_size": 2,
+    "batch_size": 100,
+}
+
+
+@override_settings(
+    PUSH_NOTIFICATIONS=PUSH_NOTIFICATIONS,
+    CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}},
+)
+class PushTestCase(TestCase):
+    """Notifications go to FakePushBackend; the cache is local and cleared per test"""
+
+    def setUp(self):
+        super().setUp()
+        FakePushBackend.outbox = []
+        FakePushBackend.calls = 0
+        cache.clear()
+
+    def make_user(self, name, fcm_token=None):
+        return Users.objects.create_user(
+            f"{name}@example.com", name.capitalize(), is_active=True, fcm_token=fcm_token
+        )
+
+    def make_medicine(self, user, name, stock=10, days=3, **slots):
+        """A medicine on a new prescription; slots map slot names to times"""
+        prescription = Prescription.objects.create(users=user)
+        times = {slot: Medicine_Time.objects.create(time=at) for slot, at in slots.items()}
+        return Medicine.objects.create(
+            prescription=prescription, name=name, how_many_day=days, stock=stock, **times
+        )
+
+    def send(self, users, title="Title", body="Body"):
+        with PushBatch() as batch:
+            for user in users:
+                batch.add(user, title, body)
+
+
+class PushBatchTests(PushTestCase):
+
+    def test_outcomes(self):
+        users = [
+            self.make_user("ok", "ok-1"),
+            self.make_user("notoken"),
+            self.make_user("gone", "unregistered-1"),
+            self.make_user("failing", "fail-1"),
+            self.make_user("other", "ok-2"),
+        ]
+        self.send(users)
+
+        self.assertEqual(FakePushBackend.calls, 2)  # 4 tokens in chunks of 2
+        self.assertEqual([message.token for message in FakePushBackend.outbox], ["ok-1", "ok-2"])
+        outcomes = {
+            log.user.email: (log.is_sent, log.error_message)
+            for log in NotificationLog.objects.select_related("user")
+        }
+        self.assertEqual(outcomes, {
+            "ok@example.com": (True, None),
+            "notoken@example.com": (False, NO_TOKEN),
+            "gone@example.com": (False, UNREGISTERED),
+            "failing@example.com": (False, "Fake delivery failure"),
+            "other@example.com": (True, None),
+        })
+        self.assertTrue(NotificationLog.objects.get(user=users[0]).firebase_response.startswith("fake/"))
+
+        tokens = dict(Users.objects.values_list("email", "fcm_token"))
+        self.assertIsNone(tokens["gone@example.com"])
+        self.assertEqual(tokens["failing@example.com"], "fail-1")
+        self.assertEqual(tokens["ok@example.com"], "ok-1")
+
+    def test_reregistered_token_is_kept(self):
+        user = self.make_user("moved", "unregistered-old")
+        # The app registers a new token while the old one is being sent to
+        Users.objects.filter(pk=user.pk).update(fcm_token="ok-new")
+        self.send([user])
+
+        user.refresh_from_db()
+        self.assertEqual(user.fcm_token, "ok-new")
+
+    def test_sends_at_batch_size(self):
+        users = [self.make_user(f"user{i}", f"ok-{i}") for i in range(4)]
+        with self.settings(PUSH_NOTIFICATIONS={**PUSH_NOTIFICATIONS, "batch_size": 3}):
+            batch = PushBatch()
+            for user in users:
+                batch.add(user, "Title", "Body")
+            self.assertEqual(NotificationLog.objects.count(), 3)
+            self.assertEqual(len(batch.pending), 1)
+            batch.send()
+        self.assertEqual(NotificationLog.objects.filter(is_sent=True).count(), 4)
+
+    def test_statement_count_does_not_grow_with_batch(self):
+        def queries(count):
+            users = [self.make_user(f"n{count}-{i}", f"ok-{count}-{i}") for i in range(count)]
+            users[0].fcm_token = f"unregistered-{count}"
+            with self.settings(PUSH_NOTIFICATIONS={**PUSH_NOTIFICATIONS, "chunk_size": 500}):
+                with CaptureQueriesContext(connection) as captured:
+                    self.send(users)
+            return len(captured)
+
+        # One INSERT, one UPDATE of the outcomes, one UPDATE clearing tokens
+        self.assertEqual(queries(5), 3)
+        self.assertEqual(queries(50), 3)
+
+    def test_low_stock_alerts(self):
+        user = self.make_user("patient", "ok-1")
+        low = self.make_medicine(user, "Napa", stock=2)
+        empty = self.make_medicine(user, "Seclo", stock=0)
+        self.make_medicine(user, "Fexo", stock=10)
+
+        self.assertEqual(tasks.check_low_stock_and_notify(), "Alerts sent for 2 medicines")
+        alerts = {log.medicine_id: log.title for log in NotificationLog.objects.all()}
+        self.assertEqual(alerts, {low.id: "Low Stock Alert", empty.id: "Out of Stock Alert"})
+        self.assertEqual(FakePushBackend.calls, 1)
+
+
+class ReminderScheduleSyncTests(PushTestCase):
+    """prescriptions/signals.py keeps ReminderSchedule in step with medicines"""
+
+    def setUp(self):
+        super().setUp()
+        self.user = self.make_user("patient")
+        self.medicine = self.make_medicine(self.user, "Napa", days=3, morning=time(8, 30), night=time(21, 0))
+        self.start = timezone.localtime(self.medicine.prescription.created_at).date()
+
+    def schedule(self):
+        return {
+            row.slot: (row.time_of_day.strftime("%H:%M"), (row.end_date - row.start_date).days + 1, row.user_id)
+            for row in ReminderSchedule.objects.filter(medicine=self.medicine)
+        }
+
+    def test_created_with_its_slots(self):
+        self.assertEqual(self.schedule(), {
+            "morning": ("08:30", 3, self.user.id),
+            "night": ("21:00", 3, self.user.id),
+        })
+        self.assertEqual(ReminderSchedule.objects.get(slot="morning").start_date, self.start)
+
+    def test_course_length_and_slots_rewrite_the_rows(self):
+        self.medicine.how_many_day = 5
+        self.medicine.night = None
+        self.medicine.save()
+        self.assertEqual(self.schedule(), {"morning": ("08:30", 5, self.user.id)})
+
+        self.medicine.how_many_day = 7
+        self.medicine.save(update_fields=["how_many_day"])
+        self.assertEqual(self.schedule()["morning"][1], 7)
+
+    def test_stock_updates_leave_the_rows_alone(self):
+        ReminderSchedule.objects.filter(medicine=self.medicine).update(end_date=self.start)
+        self.medicine.stock = 1
+        self.medicine.save(update_fields=["stock"])
+        self.assertEqual({days for _, days, _ in self.schedule().values()}, {1})
+
+    def test_slot_time_edit_moves_the_row(self):
+        slot = self.medicine.morning
+        slot.time = slot.time.replace(hour=9)
+        slot.save()
+        self.assertEqual(self.schedule()["morning"][0], "09:30")
+
+    def test_deleting_removes_the_rows(self):
+        self.medicine.night.delete()  # the slot cascades to its medicine
+        self.assertFalse(ReminderSchedule.objects.exists())
+
+        medicine = self.make_medicine(self.user, "Seclo", morning=time(8, 30))
+        medicine.delete()
+        self.assertFalse(ReminderSchedule.objects.exists())
+
+    def test_reassigned_prescription_follows_the_user(self):
+        other = self.make_user("other")
+        prescription = self.medicine.prescription
+        prescription.users = other
+        prescription.save()
+        self.assertEqual({user_id for *_, user_id in self.schedule().values()}, {other.id})
+
+
+@override_settings(MEDICINE_REMINDERS={"lead_minutes": 30, "batch_size": 1, "max_catchup_minutes": 5})
+class ReminderDispatchTests(PushTestCase):
+    """dispatch_due_reminders at a fixed 08:00, so slots due at 08:30 are sent"""
+
+    def setUp(self):
+        super().setUp()
+        self.now = timezone.localtime().replace(hour=8, minute=0, second=0, microsecond=0)
+        self.user = self.make_user("patient", "ok-1")
+
+        clock = mock.patch("prescriptions.tasks.timezone")
+        clock.start().localtime.return_value = self.now
+        self.addCleanup(clock.stop)
+        queue = mock.patch.object(tasks.send_reminder_batch, "delay", side_effect=tasks.send_reminder_batch)
+        self.delay = queue.start()
+        self.addCleanup(queue.stop)
+
+    def at(self, hour, minute):
+        return self.now.replace(hour=hour, minute=minute).time()
+
+    def bodies(self):
+        return sorted(NotificationLog.objects.values_list("body", flat=True))
+
+    def test_dispatches_each_minute_once(self):
+        self.make_medicine(self.user, "Napa", morning=self.at(8, 30))
+        self.make_medicine(self.user, "Fexo", night=self.at(21, 0))
+
+        tasks.dispatch_due_reminders()
+        tasks.dispatch_due_reminders()  # a second beat in the same minute
+        self.assertEqual(self.bodies(), ["Time to take Napa"])
+        self.assertEqual(cache.get(tasks.CURSOR_KEY), self.now + timedelta(minutes=30))
+
+    def test_medicines_at_one_slot_share_a_reminder(self):
+        first = self.make_medicine(self.user, "Napa", morning=self.at(8, 30))
+        Medicine.objects.create(
+            prescription=first.prescription, name="Seclo", how_many_day=3,
+            morning=Medicine_Time.objects.create(time=self.at(8, 30)),
+        )
+        tasks.dispatch_due_reminders()
+        self.assertEqual(self.bodies(), ["Time to take: Napa, Seclo"])
+
+    def test_redelivered_batch_is_sent_once(self):
+        self.make_medicine(self.user, "Napa", morning=self.at(8, 30))
+        reminders = tasks.due_reminders(self.now + timedelta(minutes=30))
+        self.assertEqual(len(reminders), 1)
+
+        tasks.send_reminder_batch(reminders)
+        self.assertEqual(tasks.send_reminder_batch(reminders), "0 reminders sent")
+        self.assertEqual(NotificationLog.objects.count(), 1)
+
+    def test_catches_up_missed_minutes(self):
+        self.make_medicine(self.user, "Napa", morning=self.at(8, 27))
+        self.make_medicine(self.user, "Seclo", morning=self.at(8, 29))
+        cache.set(tasks.CURSOR_KEY, self.now + timedelta(minutes=27), timeout=None)
+
+        tasks.dispatch_due_reminders()
+        # 08:27 was already dispatched before the outage; 08:28-08:30 are caught up
+        self.assertEqual(self.bodies(), ["Time to take Seclo"])
+        self.assertEqual(cache.get(tasks.CURSOR_KEY), self.now + timedelta(minutes=30))
+
+    def test_catch_up_is_capped(self):
+        self.make_medicine(self.user, "Napa", morning=self.at(8, 20))
+        self.make_medicine(self.user, "Seclo", morning=self.at(8, 26))
+        cache.set(tasks.CURSOR_KEY, self.now + timedelta(minutes=10), timeout=None)
+
+        tasks.dispatch_due_reminders()
+        # Only the last max_catchup_minutes (08:25-08:30) are dispatched
+        self.assertEqual(self.bodies(), ["Time to take Seclo"])
+
+    def test_only_days_of_the_course_are_due(self):
+        medicine = self.make_medicine(self.user, "Napa", days=3, morning=self.at(8, 30))
+        start = timezone.localtime(medicine.prescription.created_at).replace(hour=8, minute=30)
+
+        def due(days):
+            return [r["medicines"] for r in tasks.due_reminders(start + timedelta(days=days))]
+
+        self.assertEqual([due(day) for day in (-1, 0, 1, 2, 3)], [[], [["Napa"]], [["Napa"]], [["Napa"]], []])
+        self.assertEqual(tasks.due_reminders(start + timedelta(minutes=1)), [])
+
+    def test_legacy_eta_tasks_drain(self):
+        self.make_medicine(self.user, "Napa", morning=self.at(8, 30))
+        with mock.patch.object(tasks.send_grouped_medicine_reminder, "apply_async") as reschedule:
+            tasks.send_grouped_medicine_reminder(self.user.id, "morning", "08:30:00")
+        reschedule.assert_not_called()
+        self.assertEqual(NotificationLog.objects.count(), 0)
+
+    def test_broker_failure_is_retried(self):
+        self.make_medicine(self.user, "Napa", morning=self.at(8, 30))
+        self.delay.side_effect = ConnectionError("broker down")
+        with self.assertRaises(ConnectionError):
+            tasks.dispatch_due_reminders()
+        self.assertIsNone(cache.get(tasks.CURSOR_KEY))
+        self.assertEqual(NotificationLog.objects.count(), 0)
+
+        self.delay.side_effect = tasks.send_reminder_batch
+        tasks.dispatch_due_reminders()
+        self.assertEqual(self.bodies(), ["Time to take Napa"])
+
+
+class NotificationConditionalGetTests(PushTestCase):
+
+    def test_read_mark_and_delete_change_the_etag(self):
+        user = self.make_user("patient", "ok-1")
+        self.send([user], body="First")
+        self.send([user], body="Second")
+        client = APIClient()
+        client.force_authenticate(user)
+
+        def get(etag=None):
+            return client.get("/treatments/notifications/", headers={"If-None-Match": etag} if etag else {})
+
+        etag = get()["ETag"]
+        self.assertEqual(get(etag).status_code, 304)
+
+        log = NotificationLog.objects.filter(user=user).first()
+        self.assertEqual(client.patch(f"/treatments/notifications/{log.id}/").status_code, 200)
+        response = get(etag)
+        self.assertEqual(response.status_code, 200)
+
+        client.delete(f"/treatments/notifications/{log.id}/")
+        self.assertEqual(get(response["ETag"]).status_code, 200)
@@ -3,6 +3,7 @@ from rest_framework import viewsets, status
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.views import APIView
 from django.utils import timezone
+from django.db.models import Count, Max, Q
 from .models import Prescription, Patient, Medicine, pharmacy, NotificationLog
 from .serializers import (
     PrescriptionSerializer, 
@@ -12,7 +13,8 @@ from .serializers import (
     MedicineStockSerializer
 )
 from users.permissions import IsNormalUser, IsAdminOrSuperUser
-from prescriptions.tasks import send_push_notification
+from MedAi.conditional import conditional_get
+from prescriptions.push import send_push_notification
 from .models import AdminNotification
 
 
@@ -108,7 +110,7 @@ class MarkMedicineTakenView(APIView):
             }, status=400)
 
         medicine.stock -= 1
-        medicine.save()
+        medicine.save(update_fields=["stock", "updated_at"])
 
         if medicine.stock <= 3:
             if medicine.stock == 0:
@@ -149,7 +151,7 @@ class MedicineStockView(APIView):
 
         stock = serializer.validated_data["stock"]
         medicine.stock += stock
-        medicine.save()
+        medicine.save(update_fields=["stock", "updated_at"])
 
         return Response({
             "message": f"{stock} stock added successfully",
@@ -158,9 +160,21 @@ class MedicineStockView(APIView):
         })
 
 
+def notifications_validator(request):
+    # New logs, deletes, read marks, push results and medicine unlinks
+    return NotificationLog.objects.filter(user=request.user).aggregate(
+        count=Count('id'),
+        last_id=Max('id'),
+        unread=Count('id', filter=Q(is_read=False)),
+        sent=Count('id', filter=Q(is_sent=True)),
+        linked=Count('medicine'),
+    ).values()
+
+
 class UserNotificationListView(APIView):
     permission_classes = [IsAuthenticated, IsNormalUser]
 
+    @conditional_get(notifications_validator)
     def get(self, request):
         logs = NotificationLog.objects.filter(
             user=request.user,